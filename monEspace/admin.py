@@ -2,8 +2,11 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import Attachment, Note, TodoItem
+from .models import Attachment, CachedAnswer, EmbeddingJob, EmbeddingModel, Note, TodoItem
 
 admin.site.register(Note)
 admin.site.register(Attachment)
 admin.site.register(TodoItem)
+admin.site.register(EmbeddingJob)
+admin.site.register(EmbeddingModel)
+admin.site.register(CachedAnswer)
@@ -0,0 +1,276 @@
+"""
+Contrôle d'admission des générations du chat.
+
+- Au plus CHAT_MAX_CONCURRENT_GENERATIONS générations en cours par
+  processus ; les suivantes attendent leur tour dans une file bornée
+  (CHAT_ADMISSION_QUEUE), au plus CHAT_ADMISSION_TIMEOUT secondes. La
+  limite n'est pas partagée : avec N workers, le modèle reçoit jusqu'à N
+  fois CHAT_MAX_CONCURRENT_GENERATIONS générations simultanées.
+- Au plus CHAT_MAX_GENERATIONS_PER_USER générations en cours par
+  utilisateur, tous processus confondus : le compteur est dans le cache
+  Django, qui doit être partagé (CACHES : Redis, ou la table du cache en
+  base ; avertissement monEspace.W001 sinon). Seul Redis incrémente de
+  façon atomique ; avec le cache en base, deux demandes strictement
+  simultanées d'un même utilisateur peuvent dépasser la limite.
+
+Une demande qui ne peut pas être admise (file pleine, attente trop longue,
+limite de l'utilisateur) est refusée tout de suite par AdmissionRejected,
+avec un délai conseillé avant de réessayer (en-tête Retry-After du 429).
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import Counter, deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionStats:
+    """
+    Admissions, refus par motif, attente dans la file et profondeur de la
+    file ; un résumé est journalisé toutes les CHAT_ADMISSION_STATS_INTERVAL
+    secondes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record_admitted(self, wait, queue_depth):
+        with self._lock:
+            self.admitted += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.queue_max = max(self.queue_max, queue_depth)
+        self._maybe_log()
+
+    def record_rejected(self, reason):
+        with self._lock:
+            self.rejected[reason] += 1
+        self._maybe_log()
+
+    def record_hold(self, seconds):
+        with self._lock:
+            self.holds += 1
+            self.hold_total += seconds
+
+    @property
+    def mean_hold(self):
+        return self.hold_total / self.holds if self.holds else None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'mean_wait_ms': 1000 * self.wait_total / self.admitted if self.admitted else 0.0,
+                'max_wait_ms': 1000 * self.wait_max,
+                'max_queue_depth': self.queue_max,
+                'mean_generation_seconds': self.mean_hold or 0.0,
+            }
+
+    def _maybe_log(self):
+        interval = getattr(settings, 'CHAT_ADMISSION_STATS_INTERVAL', 60)
+        if interval and time.monotonic() - self.started >= interval:
+            logger.info("Admission des générations : %s", self.snapshot())
+            self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.admitted = 0
+            self.rejected = Counter()
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.queue_max = 0
+            self.holds = 0
+            self.hold_total = 0.0
+            self.started = time.monotonic()
+
+
+class GenerationLimiter:
+    """
+    Sémaphore à file d'attente bornée, commun à tout le processus. Une place
+    libérée passe directement au premier en attente. Sous WSGI chaque requête
+    a sa propre boucle d'événements, dans son thread : l'état est protégé par
+    un verrou et une place est remise dans la boucle de celui qui l'attend.
+    """
+
+    def __init__(self):
+        self.active = 0
+        # (boucle, future) des demandes en attente
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        self.stats = AdmissionStats()
+
+    @property
+    def limit(self):
+        return getattr(settings, 'CHAT_MAX_CONCURRENT_GENERATIONS', 8)
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        # Temps pour écouler la file au rythme des générations en cours
+        mean_hold = self.stats.mean_hold or getattr(settings, 'CHAT_ADMISSION_TIMEOUT', 20)
+        return max(1, math.ceil(mean_hold * (self.queue_depth + 1) / max(self.limit, 1)))
+
+    async def acquire(self):
+        """
+        Renvoie le temps passé dans la file, ou lève AdmissionRejected.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                entry = None
+            elif len(self._waiters) >= getattr(settings, 'CHAT_ADMISSION_QUEUE', 16):
+                entry = False
+            else:
+                entry = (loop, loop.create_future())
+                self._waiters.append(entry)
+                depth = len(self._waiters)
+        if entry is None:
+            self.stats.record_admitted(0.0, 0)
+            return 0.0
+        if entry is False:
+            self.stats.record_rejected('queue_full')
+            raise AdmissionRejected('queue_full', self.retry_after())
+
+        start = time.monotonic()
+        waiter = entry[1]
+        try:
+            await asyncio.wait_for(waiter, getattr(settings, 'CHAT_ADMISSION_TIMEOUT', 20))
+        except asyncio.TimeoutError:
+            # Une place en route vers cette demande est passée à la suivante
+            # par _grant
+            self._remove(entry)
+            self.stats.record_rejected('timeout')
+            raise AdmissionRejected('timeout', self.retry_after())
+        except asyncio.CancelledError:
+            # Client parti pendant l'attente : la place reçue est rendue
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._remove(entry)
+            raise
+        wait = time.monotonic() - start
+        self.stats.record_admitted(wait, depth)
+        return wait
+
+    def _remove(self, entry):
+        with self._lock:
+            try:
+                self._waiters.remove(entry)
+            except ValueError:
+                pass
+
+    def _grant(self, waiter):
+        # Dans la boucle de la demande : si elle a abandonné entre-temps, la
+        # place passe à la suivante
+        if waiter.done():
+            self.release()
+        else:
+            waiter.set_result(None)
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                loop, waiter = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(self._grant, waiter)
+                    return
+                except RuntimeError:
+                    # Boucle déjà fermée
+                    continue
+            self.active -= 1
+
+
+generation_limiter = GenerationLimiter()
+
+
+def _user_key(user_id):
+    return f'chat_inflight:{user_id}'
+
+
+def _incr(key, timeout):
+    # incr synchrone : atomique dans les backends de cache (verrou de
+    # locmem, INCR de Redis), contrairement à aincr de BaseCache
+    cache.add(key, 0, timeout=timeout)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=timeout)
+        return 1
+    # L'expiration repart de chaque génération, pas de la première
+    cache.touch(key, timeout)
+    return count
+
+
+async def _acquire_user(user_id):
+    key = _user_key(user_id)
+    # Le compteur expire de lui-même si un processus s'arrête sans le décrémenter
+    timeout = getattr(settings, 'CHAT_STREAM_TTL', 600)
+    count = await sync_to_async(_incr)(key, timeout)
+    if count > getattr(settings, 'CHAT_MAX_GENERATIONS_PER_USER', 2):
+        await _release_user(user_id)
+        generation_limiter.stats.record_rejected('user_limit')
+        raise AdmissionRejected('user_limit', generation_limiter.retry_after())
+
+
+def _decr(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        pass
+
+
+async def _release_user(user_id):
+    await sync_to_async(_decr)(_user_key(user_id))
+
+
+class Admission:
+    """
+    Place obtenue pour une génération ; release() la rend (une seule fois).
+    """
+
+    def __init__(self, user_id, wait):
+        self.user_id = user_id
+        self.wait = wait
+        self.admitted_at = time.monotonic()
+        self._released = False
+
+    async def release(self):
+        if self._released:
+            return
+        self._released = True
+        generation_limiter.stats.record_hold(time.monotonic() - self.admitted_at)
+        generation_limiter.release()
+        await _release_user(self.user_id)
+
+
+async def admit(user_id):
+    """
+    Réserve une place de génération pour user_id, en attendant au besoin
+    dans la file. Lève AdmissionRejected si la demande est refusée.
+    """
+    await _acquire_user(user_id)
+    try:
+        wait = await generation_limiter.acquire()
+    except BaseException:
+        await _release_user(user_id)
+        raise
+    return Admission(user_id, wait)
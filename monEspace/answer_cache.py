@@ -0,0 +1,190 @@
+"""
+Cache sémantique des réponses du chat (CHAT_ANSWER_CACHE, désactivé par
+défaut).
+
+Les élèves d'un même cours posent souvent la même question : une réponse
+générée est gardée (CachedAnswer) et resservie, sans appel au modèle, à une
+question dont l'embedding est assez proche (CHAT_ANSWER_CACHE_THRESHOLD),
+posée dans le même cours et pour laquelle la recherche a retrouvé exactement
+les mêmes notes. Les réponses expirent après CHAT_ANSWER_CACHE_TTL secondes
+et sont supprimées dès qu'une de leurs notes change.
+
+Seule la première question d'une session est concernée : la réponse ne
+dépend alors que de la question et des notes, pas de la conversation d'un
+élève.
+"""
+import hashlib
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .embedding_format import encode_embedding
+from .embedding_models import active_model
+from .models import CachedAnswer, Note
+from .services import embed_query
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCacheStats:
+    """
+    Questions servies par le cache ou générées, et temps de génération
+    économisé ; un résumé est journalisé toutes les
+    CHAT_ANSWER_CACHE_STATS_INTERVAL secondes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record_hit(self, saved_seconds):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += saved_seconds
+        self._maybe_log()
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+        self._maybe_log()
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'saved_generation_seconds': self.saved_seconds,
+            }
+
+    def _maybe_log(self):
+        interval = getattr(settings, 'CHAT_ANSWER_CACHE_STATS_INTERVAL', 60)
+        if interval and time.monotonic() - self.started >= interval:
+            logger.info("Cache des réponses du chat : %s", self.snapshot())
+            self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.saved_seconds = 0.0
+            self.started = time.monotonic()
+
+
+answer_cache_stats = AnswerCacheStats()
+
+
+def notes_key(note_ids):
+    return hashlib.sha256(','.join(str(note_id) for note_id in sorted(set(note_ids))).encode()).hexdigest()
+
+
+class AnswerLookup:
+    """
+    Question éligible au cache : de quoi chercher une réponse, puis enregistrer
+    celle qui sera générée.
+    """
+
+    def __init__(self, query, course_id, note_ids):
+        self.query = query
+        self.course_id = course_id
+        self.note_ids = sorted(set(note_ids))
+        self.notes_key = notes_key(self.note_ids)
+        self.model = active_model()
+        self.embedding = embed_query(query)
+        self.started_at = timezone.now()
+
+
+def lookup_course_id(chat_session, note_ids):
+    """
+    Cours de la question : celui de la session, sinon celui des notes
+    retrouvées si elles sont toutes du même cours ; None sinon.
+    """
+    if chat_session.course_id:
+        return chat_session.course_id
+    course_ids = set(Note.objects.filter(id__in=note_ids).values_list('course_id', flat=True))
+    if len(course_ids) == 1:
+        return course_ids.pop()
+    return None
+
+
+def prepare_lookup(chat_session, before_id, query, search_results):
+    """
+    AnswerLookup de la question query, ou None si le cache est désactivé, si
+    la question n'est pas la première de la session ou si elle n'est pas
+    rattachée à un cours.
+    """
+    if not getattr(settings, 'CHAT_ANSWER_CACHE', False) or not search_results or not query.strip():
+        return None
+    if chat_session.summary or chat_session.messages.filter(id__lt=before_id).exists():
+        return None
+    note_ids = [result['id'] for result in search_results]
+    course_id = lookup_course_id(chat_session, note_ids)
+    if course_id is None:
+        return None
+    return AnswerLookup(query, course_id, note_ids)
+
+
+def find_answer(lookup):
+    """
+    Réponse en cache la plus proche de la question, None en dessous du seuil.
+    """
+    candidates = list(
+        CachedAnswer.objects.filter(
+            course_id=lookup.course_id,
+            notes_key=lookup.notes_key,
+            model_id=lookup.model.model_id,
+            expires_at__gt=timezone.now(),
+        )
+        .order_by('-created_at')
+        .only('id', 'embedding', 'answer', 'generation_seconds')[
+            :getattr(settings, 'CHAT_ANSWER_CACHE_CANDIDATES', 100)
+        ]
+    )
+    best, best_similarity = None, getattr(settings, 'CHAT_ANSWER_CACHE_THRESHOLD', 0.92)
+    query_norm = np.linalg.norm(lookup.embedding)
+    for candidate in candidates:
+        embedding = candidate.get_embedding()
+        similarity = float(embedding @ lookup.embedding / (np.linalg.norm(embedding) * query_norm + 1e-12))
+        if similarity >= best_similarity:
+            best, best_similarity = candidate, similarity
+
+    if best is None:
+        answer_cache_stats.record_miss()
+        return None
+    CachedAnswer.objects.filter(pk=best.pk).update(hits=F('hits') + 1)
+    answer_cache_stats.record_hit(best.generation_seconds)
+    return best
+
+
+def store_answer(lookup, answer, generation_seconds):
+    """
+    Garde la réponse générée pour lookup, sauf si une de ses notes a changé
+    pendant la génération ; les réponses expirées sont supprimées au passage.
+    """
+    if Note.objects.filter(id__in=lookup.note_ids, updated_at__gt=lookup.started_at).exists():
+        return None
+    now = timezone.now()
+    CachedAnswer.objects.filter(expires_at__lte=now).delete()
+    cached = CachedAnswer.objects.create(
+        course_id=lookup.course_id,
+        notes_key=lookup.notes_key,
+        query=lookup.query,
+        embedding=encode_embedding(
+            np.asarray(lookup.embedding, dtype=np.float32),
+            dtype=getattr(settings, 'EMBEDDING_STORAGE_DTYPE', 'float16'),
+            model_id=lookup.model.model_id,
+        ),
+        model_id=lookup.model.model_id,
+        answer=answer,
+        generation_seconds=generation_seconds,
+        expires_at=now + timedelta(seconds=getattr(settings, 'CHAT_ANSWER_CACHE_TTL', 86400)),
+    )
+    cached.notes.set(lookup.note_ids)
+    return cached
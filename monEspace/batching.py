@@ -0,0 +1,98 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class BatchStats:
+    """
+    Distribution des tailles de lots et temps d'attente des éléments dans la
+    file avant leur lot.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record(self, size, waits):
+        with self._lock:
+            self.sizes[size] += 1
+            self.items += size
+            self.wait_total += sum(waits)
+            self.wait_max = max(self.wait_max, max(waits))
+
+    def snapshot(self):
+        with self._lock:
+            batches = sum(self.sizes.values())
+            return {
+                'batches': batches,
+                'items': self.items,
+                'mean_batch_size': self.items / batches if batches else 0.0,
+                'batch_sizes': dict(sorted(self.sizes.items())),
+                'mean_wait_ms': 1000 * self.wait_total / self.items if self.items else 0.0,
+                'max_wait_ms': 1000 * self.wait_max,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.sizes = Counter()
+            self.items = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+
+class MicroBatcher:
+    """
+    Regroupe des appels unitaires concurrents en lots.
+
+    Chaque appel à submit() place un élément dans une file ; un thread de fond
+    attend au plus max_latency secondes (ou jusqu'à max_batch_size éléments)
+    puis appelle fn(liste_d_elements) une seule fois et résout le Future de
+    chaque appelant avec le résultat correspondant.
+    """
+
+    def __init__(self, fn, max_batch_size=32, max_latency=0.005, name='micro-batcher'):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        self.stats = BatchStats()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def submit_many(self, items):
+        return [self.submit(item) for item in items]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            self.stats.record(len(batch), [started - queued_at for _, _, queued_at in batch])
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.fn(items)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
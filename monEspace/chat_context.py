@@ -0,0 +1,272 @@
+"""
+Contexte envoyé au modèle de langage pour un message du chat.
+
+Le prompt tient dans un budget fixe de CHAT_CONTEXT_TOKENS tokens, quelle
+que soit la longueur de la session :
+- consigne du tuteur, résumé de la session, extraits des notes (au plus
+  CHAT_NOTES_CONTEXT_TOKENS) et question ;
+- échanges antérieurs en rapport avec la question, retrouvés par embedding
+  parmi ceux qui ne sont plus dans la fenêtre (au plus CHAT_RECALL_TOKENS) ;
+- derniers échanges, du plus récent au plus ancien, dans ce qui reste.
+
+Les échanges sortis de la fenêtre sont résumés par lots (update_summary),
+après la réponse, dans ChatSession.summary.
+
+Les tokens sont comptés avec le tokenizer CHAT_TOKENIZER (transformers)
+s'il est configuré, sinon estimés à CHAT_CHARS_PER_TOKEN caractères par
+token.
+"""
+import logging
+import threading
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .admission import AdmissionRejected, generation_limiter
+from .llm_client import llm_client
+from .models import ChatSession
+from .services import embed_messages, embed_query
+
+logger = logging.getLogger(__name__)
+
+TUTOR_PROMPT = """\
+Tu es un tuteur en ligne. Ton rôle est d'aider les étudiants à apprendre en posant des questions et en les guidant, sans donner directement les réponses. Voici comment tu dois te comporter :
+
+1. **Poser des questions** :
+- Demande des questions pour faire réfléchir l'étudiant et l'aider à trouver les réponses par lui-même.
+- Adapte tes questions en fonction du niveau de l'étudiant.
+
+2. **Découper les problèmes** :
+- Décompose les problèmes en petites étapes compréhensibles.
+- Demande à l'étudiant de résoudre chaque étape une par une.
+
+3. **Encourager les efforts** :
+- Rappelle à l'étudiant que faire des erreurs est normal et fait partie de l'apprentissage.
+- Encourage l'étudiant à persévérer et félicite ses efforts.
+
+4. **Fournir des ressources** :
+- Propose des vidéos, articles, ou autres ressources pour aider l'étudiant à comprendre les sujets.
+- Utilise des sources fiables et éducatives.
+
+5. **Vérifier les réponses** :
+- Utilise des outils pour vérifier les calculs et t'assurer que tout est correct.
+- Si une erreur est détectée, demande à l'étudiant de réévaluer son travail et guide-le pour trouver l'erreur.
+
+6. **Ne jamais donner directement la réponse** :
+- Aide l'étudiant à réfléchir et à arriver à la solution par lui-même.
+- Si l'étudiant est bloqué, donne des indices ou pose des questions supplémentaires pour le débloquer."""
+
+SUMMARY_PROMPT = (
+    "Tu résumes une conversation entre un étudiant et son tuteur. Mets à jour le résumé "
+    "ci-dessous avec les nouveaux échanges : sujets abordés, notions comprises, difficultés "
+    "et questions restées ouvertes. Réponds uniquement par le résumé, en quelques phrases."
+)
+
+# Tokens de mise en forme comptés en plus du contenu de chaque message
+MESSAGE_OVERHEAD = 4
+
+ROLE_LABELS = {'user': 'Étudiant', 'assistant': 'Tuteur'}
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+def _get_tokenizer():
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        with _tokenizer_lock:
+            if not _tokenizer_loaded:
+                name = getattr(settings, 'CHAT_TOKENIZER', None)
+                if name:
+                    try:
+                        from transformers import AutoTokenizer
+                        _tokenizer = AutoTokenizer.from_pretrained(name)
+                    except Exception:
+                        logger.warning("Tokenizer %s indisponible, nombre de tokens estimé", name, exc_info=True)
+                _tokenizer_loaded = True
+    return _tokenizer
+
+
+def count_tokens(text):
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return int(len(text) / getattr(settings, 'CHAT_CHARS_PER_TOKEN', 3.5)) + 1
+
+
+def truncate_tokens(text, budget):
+    """
+    Début de text tenant dans budget tokens.
+    """
+    if budget <= 0:
+        return ''
+    if count_tokens(text) <= budget:
+        return text
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return tokenizer.decode(tokenizer.encode(text, add_special_tokens=False)[:budget]) + '…'
+    return text[:int(budget * getattr(settings, 'CHAT_CHARS_PER_TOKEN', 3.5))] + '…'
+
+
+def _message_tokens(content):
+    return count_tokens(content) + MESSAGE_OVERHEAD
+
+
+def _truncated_turn(content, budget):
+    content = truncate_tokens(content, budget)
+    return content, _message_tokens(content)
+
+
+def _format_turns(turns):
+    return "\n".join(f"{ROLE_LABELS.get(turn['role'], turn['role'])} : {turn['content']}" for turn in turns)
+
+
+class ChatContext:
+    """
+    Messages à envoyer au modèle, et premier message (id) de la fenêtre des
+    derniers échanges : les précédents sont à résumer.
+    """
+
+    def __init__(self, messages, window_start_id, tokens):
+        self.messages = messages
+        self.window_start_id = window_start_id
+        self.tokens = tokens
+
+
+def _recall(query, candidates, budget):
+    """
+    Échanges de candidates les plus proches de la question, dans l'ordre
+    de la conversation.
+    """
+    min_similarity = getattr(settings, 'CHAT_RECALL_MIN_SIMILARITY', 0.5)
+    embeddings = embed_messages([turn['content'] for turn in candidates])
+    query_embedding = embed_query(query)
+    similarities = embeddings @ query_embedding / (
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_embedding) + 1e-12
+    )
+    recalled = []
+    for i in np.argsort(-similarities)[:getattr(settings, 'CHAT_RECALL_TURNS', 3)]:
+        if similarities[i] < min_similarity:
+            break
+        cost = _message_tokens(candidates[i]['content'])
+        if cost > budget:
+            continue
+        budget -= cost
+        recalled.append(candidates[i])
+    return sorted(recalled, key=lambda turn: turn['id'])
+
+
+def build_chat_context(chat_session, query, notes_context, before_id):
+    """
+    Messages du prompt pour la question query, avec les extraits de notes
+    notes_context, à partir des messages de chat_session antérieurs au
+    message before_id (la question enregistrée).
+    """
+    budget = getattr(settings, 'CHAT_CONTEXT_TOKENS', 3000)
+    recall_budget = getattr(settings, 'CHAT_RECALL_TOKENS', 400)
+    notes_context = truncate_tokens(notes_context, getattr(settings, 'CHAT_NOTES_CONTEXT_TOKENS', 800))
+
+    head = [{"role": "system", "content": TUTOR_PROMPT}]
+    if chat_session.summary:
+        head.append({"role": "system", "content": f"Résumé de la conversation jusqu'ici : {chat_session.summary}"})
+    notes = {"role": "system", "content": f"Contexte des notes pertinentes : {notes_context}"}
+    used = sum(_message_tokens(m['content']) for m in head) + _message_tokens(notes['content']) + _message_tokens(query)
+
+    # Derniers échanges, du plus récent au plus ancien ; les échanges déjà
+    # résumés n'y reviennent pas
+    previous = chat_session.messages.filter(is_complete=True, id__lt=before_id).exclude(content='')
+    recent = previous
+    if chat_session.summary_until:
+        recent = recent.filter(id__gt=chat_session.summary_until)
+    history_budget = budget - used - recall_budget
+    history = []
+    window_start_id = before_id
+    for turn in recent.order_by('-id').values('id', 'role', 'content')[:getattr(settings, 'CHAT_HISTORY_MAX_MESSAGES', 50)]:
+        cost = _message_tokens(turn['content'])
+        if cost > history_budget:
+            break
+        history_budget -= cost
+        history.append(turn)
+        window_start_id = turn['id']
+    history.reverse()
+    used = budget - recall_budget - history_budget
+
+    # Échanges plus anciens en rapport avec la question
+    recalled = []
+    candidates = list(
+        previous.filter(id__lt=window_start_id)
+        .order_by('-id')
+        .values('id', 'role', 'content')[:getattr(settings, 'CHAT_RECALL_CANDIDATES', 200)]
+    )
+    if candidates and recall_budget > 0:
+        try:
+            recalled = _recall(query, candidates, recall_budget - MESSAGE_OVERHEAD)
+        except Exception:
+            logger.warning("Rappel des échanges antérieurs impossible", exc_info=True)
+    if recalled:
+        content = f"Échanges antérieurs en rapport avec la question :\n{_format_turns(recalled)}"
+        head.append({"role": "system", "content": content})
+        used += _message_tokens(content)
+
+    messages = head + [notes]
+    messages += [{"role": turn['role'], "content": turn['content']} for turn in history]
+    messages.append({"role": "user", "content": query})
+    return ChatContext(messages, window_start_id, used)
+
+
+async def update_summary(session_id, window_start_id):
+    """
+    Ajoute au résumé de la session les échanges sortis de la fenêtre
+    (antérieurs à window_start_id), une fois qu'ils dépassent
+    CHAT_SUMMARY_TRIGGER_TOKENS. L'appel au modèle passe par le contrôle
+    d'admission comme les réponses ; s'il est refusé, le résumé attend le
+    message suivant.
+    """
+    lock = f'chat_summary:{session_id}'
+    if not await cache.aadd(lock, 1, timeout=120):
+        return
+    try:
+        session = await ChatSession.objects.aget(id=session_id)
+        overflow = session.messages.filter(is_complete=True, id__lt=window_start_id).exclude(content='')
+        if session.summary_until:
+            overflow = overflow.filter(id__gt=session.summary_until)
+        turns, tokens = [], 0
+        max_tokens = getattr(settings, 'CHAT_SUMMARY_INPUT_TOKENS', 2000)
+        async for turn in overflow.order_by('id').values('id', 'role', 'content'):
+            # Le tokenizer est bloquant : hors de la boucle d'événements
+            turn['content'], cost = await sync_to_async(_truncated_turn, thread_sensitive=False)(
+                turn['content'], max_tokens // 2
+            )
+            if turns and tokens + cost > max_tokens:
+                break
+            turns.append(turn)
+            tokens += cost
+        if tokens < getattr(settings, 'CHAT_SUMMARY_TRIGGER_TOKENS', 600):
+            return
+
+        prompt = (
+            f"[INST] {SUMMARY_PROMPT}\n\nRésumé actuel : {session.summary or '(vide)'}\n\n"
+            f"Nouveaux échanges :\n{_format_turns(turns)} [/INST]"
+        )
+        try:
+            await generation_limiter.acquire()
+        except AdmissionRejected as e:
+            logger.info("Résumé de la session %s reporté (%s)", session_id, e.reason)
+            return
+        try:
+            chunks = [chunk async for chunk in llm_client.stream(
+                prompt, max_new_tokens=getattr(settings, 'CHAT_SUMMARY_TOKENS', 250), temperature=0.3,
+            )]
+        finally:
+            generation_limiter.release()
+        summary = ''.join(chunks).strip()
+        if summary:
+            await ChatSession.objects.filter(id=session_id).aupdate(summary=summary, summary_until=turns[-1]['id'])
+    except Exception:
+        logger.warning("Résumé de la session %s non mis à jour", session_id, exc_info=True)
+    finally:
+        await cache.adelete(lock)
+
@@ -0,0 +1,197 @@
+"""
+Réponses du chat qui survivent à la connexion du navigateur.
+
+La génération d'une réponse tourne dans une tâche de fond (start_stream),
+indépendante de la requête HTTP. Ses événements sont numérotés et gardés en
+mémoire dans le processus producteur, et recopiés régulièrement dans le cache
+Django (CHAT_STREAM_FLUSH_INTERVAL) pour qu'un autre processus puisse les
+relire. Un lecteur (read_stream) reprend après le dernier numéro reçu : le
+navigateur se reconnecte avec l'en-tête Last-Event-ID sans relancer le
+modèle. Sans aucun lecteur pendant CHAT_STREAM_ORPHAN_TIMEOUT secondes, la
+génération est abandonnée ; un lecteur d'un autre processus se signale par
+un battement de cœur dans le cache.
+
+Reprendre depuis un autre processus suppose un cache partagé (Redis,
+Memcached) ; sinon seul le processus producteur peut servir la reprise.
+
+La tâche de fond suppose un serveur ASGI, dont la boucle d'événements dure
+autant que le processus. Sous WSGI, la boucle de la vue est fermée dès
+qu'elle a répondu : run_stream fait alors tourner la production dans la
+boucle qui lit la réponse.
+"""
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .llm_client import llm_client
+
+logger = logging.getLogger(__name__)
+
+_streams = {}
+
+
+def _cache_key(stream_id):
+    return f'chat_stream:{stream_id}'
+
+
+def _reader_key(stream_id):
+    return f'chat_stream_reader:{stream_id}'
+
+
+class LiveStream:
+    """
+    Événements d'une génération en cours, dans le processus qui la produit.
+    """
+
+    def __init__(self, stream_id, user_id):
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.events = []
+        self.done = False
+        self.readers = 0
+        self.unread_since = time.monotonic()
+        self.flushed_at = 0.0
+        self.changed = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.task = None
+
+    def publish(self, event):
+        self.events.append(event)
+        self._notify()
+
+    def _notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def is_orphaned(self):
+        timeout = getattr(settings, 'CHAT_STREAM_ORPHAN_TIMEOUT', 30)
+        if self.readers or time.monotonic() - self.unread_since <= timeout:
+            return False
+        # Lecteur dans un autre processus (reprise) : battement de cœur récent
+        beat = await cache.aget(_reader_key(self.stream_id))
+        if beat is not None and time.time() - beat <= timeout:
+            self.unread_since = time.monotonic()
+            return False
+        return True
+
+    async def flush(self):
+        self.flushed_at = time.monotonic()
+        await cache.aset(
+            _cache_key(self.stream_id),
+            {'user_id': self.user_id, 'events': list(self.events), 'done': self.done},
+            timeout=getattr(settings, 'CHAT_STREAM_TTL', 600),
+        )
+
+
+async def _produce(stream, events, on_done=None):
+    flush_interval = getattr(settings, 'CHAT_STREAM_FLUSH_INTERVAL', 0.5)
+    try:
+        # Le flux existe dans le cache dès son début pour les autres processus
+        await stream.flush()
+        async for event in events:
+            stream.publish(event)
+            if await stream.is_orphaned():
+                logger.info("Réponse %s abandonnée : plus aucun lecteur", stream.stream_id)
+                break
+            if time.monotonic() - stream.flushed_at >= flush_interval:
+                await stream.flush()
+    except Exception:
+        logger.exception("Erreur dans la génération %s", stream.stream_id)
+    finally:
+        # Le générateur enregistre la réponse partielle en se fermant
+        await events.aclose()
+        stream.done = True
+        stream._notify()
+        try:
+            await stream.flush()
+        finally:
+            _streams.pop(stream.stream_id, None)
+            if on_done is not None:
+                await on_done()
+
+
+def start_stream(stream_id, user_id, events, on_done=None):
+    """
+    Lance en tâche de fond la production des événements (générateur
+    asynchrone de dictionnaires) d'une réponse. on_done (coroutine sans
+    argument) est appelée quand la production se termine, quelle qu'en soit
+    la raison.
+    """
+    stream = LiveStream(stream_id, user_id)
+    _streams[stream_id] = stream
+    stream.task = asyncio.create_task(_produce(stream, events, on_done))
+    return stream
+
+
+async def run_stream(stream_id, user_id, events, on_done=None):
+    """
+    Pour un serveur WSGI : lance la production dans la boucle d'événements
+    qui lit la réponse, et renvoie ses (numéro, événement) comme read_stream.
+    La boucle est fermée après la réponse : on attend la fin de la production
+    (on_done compris), puis on ferme le client du modèle de cette boucle.
+    """
+    stream = start_stream(stream_id, user_id, events, on_done)
+    try:
+        async for item in read_stream(stream_id):
+            yield item
+        await stream.task
+    finally:
+        await llm_client.aclose_loop_client()
+
+
+async def stream_owner(stream_id):
+    """
+    Utilisateur à qui appartient la réponse, None si elle est inconnue ou
+    expirée.
+    """
+    stream = _streams.get(stream_id)
+    if stream is not None:
+        return stream.user_id
+    state = await cache.aget(_cache_key(stream_id))
+    return state['user_id'] if state else None
+
+
+async def read_stream(stream_id, after=0):
+    """
+    Événements de la réponse de numéro supérieur à after, en attendant les
+    suivants jusqu'à la fin : générateur de (numéro, événement).
+    """
+    stream = _streams.get(stream_id)
+    seq = after
+    # Les événements d'attente d'un flux ne servent que dans sa boucle
+    if stream is not None and stream.loop is asyncio.get_running_loop():
+        stream.readers += 1
+        try:
+            while True:
+                changed = stream.changed
+                while seq < len(stream.events):
+                    seq += 1
+                    yield seq, stream.events[seq - 1]
+                if stream.done:
+                    return
+                await changed.wait()
+        finally:
+            stream.readers -= 1
+            stream.unread_since = time.monotonic()
+
+    # Réponse produite par un autre processus : relecture du cache
+    poll_interval = getattr(settings, 'CHAT_STREAM_POLL_INTERVAL', 0.25)
+    beat_interval = getattr(settings, 'CHAT_STREAM_ORPHAN_TIMEOUT', 30) / 3
+    beat_at = None
+    while True:
+        if beat_at is None or time.monotonic() - beat_at >= beat_interval:
+            beat_at = time.monotonic()
+            await cache.aset(_reader_key(stream_id), time.time(), timeout=getattr(settings, 'CHAT_STREAM_TTL', 600))
+        state = await cache.aget(_cache_key(stream_id))
+        if state is None:
+            return
+        events = state['events']
+        while seq < len(events):
+            seq += 1
+            yield seq, events[seq - 1]
+        if state['done']:
+            return
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Caches propres à chaque processus
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    La limite de générations par utilisateur, la reprise des réponses du
+    chat et les versions des index de recherche passent par le cache Django,
+    qui doit être commun à tous les processus.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend in LOCAL_CACHE_BACKENDS:
+        return [Warning(
+            "Le cache par défaut n'est pas partagé entre les processus.",
+            hint="Configurer CACHES avec Redis (REDIS_URL) ou la table du cache en base "
+                 "(manage.py createcachetable).",
+            id='monEspace.W001',
+        )]
+    return []
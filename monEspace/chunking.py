@@ -0,0 +1,38 @@
+import re
+
+from django.conf import settings
+
+_WORD = re.compile(r'\S+')
+
+
+def split_into_chunks(text, size=None, overlap=None):
+    """
+    Découpe un texte en passages qui se chevauchent, sur des frontières de
+    mots. Renvoie une liste de (début, fin, passage), les positions étant des
+    indices de caractères dans text. Un texte court donne un seul passage.
+    """
+    size = size or getattr(settings, 'NOTE_CHUNK_SIZE', 1000)
+    overlap = overlap if overlap is not None else getattr(settings, 'NOTE_CHUNK_OVERLAP', 200)
+
+    words = [(match.start(), match.end()) for match in _WORD.finditer(text)]
+    if not words:
+        return []
+
+    chunks = []
+    first = 0
+    while first < len(words):
+        start = words[first][0]
+        last = first
+        while last + 1 < len(words) and words[last + 1][1] - start <= size:
+            last += 1
+        end = words[last][1]
+        chunks.append((start, end, text[start:end]))
+        if last + 1 >= len(words):
+            break
+
+        # Le passage suivant reprend les derniers mots sur environ overlap caractères
+        next_first = last + 1
+        while next_first - 1 > first and end - words[next_first - 1][0] <= overlap:
+            next_first -= 1
+        first = next_first
+    return chunks
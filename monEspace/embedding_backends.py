@@ -0,0 +1,204 @@
+"""
+Moteurs d'embeddings interchangeables, choisis par EMBEDDING_BACKEND.
+
+Un moteur expose model_id (l'espace vectoriel produit : deux moteurs de même
+model_id donnent des vecteurs comparables), dim et encode(texts, batch_size)
+qui renvoie une matrice float32 (n, dim). Le modèle n'est chargé qu'au premier
+encodage : créer un moteur ne coûte rien. name et config() permettent de le
+recréer (create_backend(name, **config)), par exemple depuis EmbeddingModel.
+"""
+import hashlib
+import json
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+
+class SentenceTransformerBackend:
+    """
+    Modèle sentence-transformers (torch), sur GPU s'il y en a un.
+    """
+    name = 'sentence-transformers'
+
+    def __init__(self, model_name=None):
+        self.model_id = model_name or getattr(settings, 'EMBEDDING_MODEL_NAME', 'all-mpnet-base-v2')
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_id)
+        return self._model
+
+    def config(self):
+        return {'model_name': self.model_id}
+
+    @property
+    def dim(self):
+        return self._load().get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size=32):
+        return np.asarray(self._load().encode(list(texts), batch_size=batch_size), dtype=np.float32)
+
+
+class OnnxBackend:
+    """
+    Modèle exporté en ONNX par la commande export_onnx_model, exécuté par
+    ONNX Runtime sans torch. La version quantifiée int8 (quantification
+    dynamique des poids) est la plus rapide sur CPU ; ses vecteurs restent
+    dans l'espace du modèle d'origine, dont elle garde le model_id.
+
+    Le répertoire contient model.onnx, model.int8.onnx, tokenizer.json et
+    embedding.json (model_id, dim, max_length, normalize).
+    """
+    name = 'onnx'
+
+    def __init__(self, model_dir=None, quantized=None, threads=None):
+        self.model_dir = model_dir or getattr(settings, 'EMBEDDING_ONNX_DIR', None)
+        if not self.model_dir or not os.path.isdir(self.model_dir):
+            raise ValueError(
+                f"Modèle ONNX introuvable ({self.model_dir}) : lancer manage.py export_onnx_model"
+            )
+        self.quantized = getattr(settings, 'EMBEDDING_ONNX_QUANTIZED', True) if quantized is None else quantized
+        self.threads = getattr(settings, 'EMBEDDING_ONNX_THREADS', 0) if threads is None else threads
+        with open(os.path.join(self.model_dir, 'embedding.json')) as f:
+            self.meta = json.load(f)
+        self.model_id = self.meta['model_id']
+        self.dim = self.meta['dim']
+        self._session = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def config(self):
+        return {'model_dir': self.model_dir, 'quantized': self.quantized}
+
+    def _load(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import onnxruntime
+                    from tokenizers import Tokenizer
+
+                    tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, 'tokenizer.json'))
+                    tokenizer.enable_truncation(max_length=self.meta.get('max_length', 384))
+                    tokenizer.enable_padding(pad_id=self.meta.get('pad_id', 1))
+
+                    options = onnxruntime.SessionOptions()
+                    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    if self.threads:
+                        options.intra_op_num_threads = self.threads
+                    filename = 'model.int8.onnx' if self.quantized else 'model.onnx'
+                    session = onnxruntime.InferenceSession(
+                        os.path.join(self.model_dir, filename), options, providers=['CPUExecutionProvider'],
+                    )
+                    self._input_names = {item.name for item in session.get_inputs()}
+                    self._tokenizer = tokenizer
+                    self._session = session
+        return self._session
+
+    def _encode_batch(self, texts):
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self._input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        hidden = self._session.run(None, feeds)[0]
+
+        # Moyenne des tokens (hors remplissage), comme le pooling du modèle d'origine
+        mask = attention_mask[:, :, None].astype(np.float32)
+        vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.meta.get('normalize', True):
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.astype(np.float32)
+
+    def encode(self, texts, batch_size=32):
+        self._load()
+        texts = list(texts)
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        # Textes triés par longueur : moins de remplissage dans chaque lot
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            vectors[indices] = self._encode_batch([texts[i] for i in indices])
+        return vectors
+
+
+@lru_cache(maxsize=100_000)
+def _word_vector(word, dim):
+    seed = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+class HashBackend:
+    """
+    Moteur déterministe sans modèle, pour les tests et les benchmarks hors
+    ligne : chaque mot a un vecteur pseudo-aléatoire fixé par son hash, un
+    texte est la somme normalisée de ses mots. Des textes qui partagent des
+    mots sont proches, ce qui garde un sens au recall des index approchés.
+    """
+    name = 'hash'
+
+    def __init__(self, dim=None):
+        self.dim = dim or getattr(settings, 'EMBEDDING_HASH_DIM', 768)
+        self.model_id = f'hash-stub-{self.dim}'
+
+    def config(self):
+        return {'dim': self.dim}
+
+    def encode(self, texts, batch_size=32):
+        texts = list(texts)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.split():
+                vectors[i] += _word_vector(word, self.dim)
+            norm = np.linalg.norm(vectors[i])
+            if norm:
+                vectors[i] /= norm
+        return vectors
+
+
+BACKENDS = {
+    'sentence-transformers': SentenceTransformerBackend,
+    'onnx': OnnxBackend,
+    'hash': HashBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name=None, **config):
+    name = name or getattr(settings, 'EMBEDDING_BACKEND', 'sentence-transformers')
+    if name not in BACKENDS:
+        raise ValueError(f"Moteur d'embeddings inconnu : {name} (choix : {', '.join(BACKENDS)})")
+    return BACKENDS[name](**config)
+
+
+def get_backend():
+    """
+    Moteur configuré (EMBEDDING_BACKEND) : celui vers lequel on migre. Les
+    recherches utilisent le moteur du modèle actif (voir embedding_models).
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Remplace le moteur du processus (tests, benchmarks) et renvoie le précédent.
+    """
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
@@ -0,0 +1,138 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+
+def normalize_query(text):
+    return ' '.join(text.lower().split())
+
+
+class EmbeddingCache:
+    """
+    Cache LRU borné avec expiration (TTL) pour des vecteurs, partagé entre les
+    threads du processus. Si un alias de cache Django est configuré, il sert de
+    second niveau partagé entre processus.
+    """
+
+    def __init__(self, namespace, max_entries, ttl, cache_alias=None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _shared_key(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return f'{self.namespace}:{digest}'
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, vector = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+
+        if self.cache_alias:
+            data = caches[self.cache_alias].get(self._shared_key(key))
+            if data is not None:
+                vector = np.frombuffer(data, dtype=np.float32)
+                self._store(key, vector, now)
+                with self._lock:
+                    self.hits += 1
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _store(self, key, vector, now):
+        with self._lock:
+            self._entries[key] = (now + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        self._store(key, vector, time.monotonic())
+        if self.cache_alias:
+            caches[self.cache_alias].set(self._shared_key(key), vector.tobytes(), timeout=self.ttl)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+query_embedding_cache = EmbeddingCache(
+    'query_embedding',
+    max_entries=getattr(settings, 'QUERY_EMBEDDING_CACHE_SIZE', 2048),
+    ttl=getattr(settings, 'QUERY_EMBEDDING_CACHE_TTL', 3600),
+    cache_alias=getattr(settings, 'QUERY_EMBEDDING_CACHE_ALIAS', None),
+)
+
+
+class EncodeStats:
+    """
+    Compteurs des embeddings de notes : recalculs évités parce que le texte
+    n'a pas changé, vecteurs trouvés dans le cache par contenu, et appels
+    réels au modèle.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record(self, unchanged=0, cache_hits=0, encoded=0):
+        with self._lock:
+            self.unchanged += unchanged
+            self.cache_hits += cache_hits
+            self.encoded += encoded
+
+    def snapshot(self):
+        with self._lock:
+            total = self.unchanged + self.cache_hits + self.encoded
+            return {
+                'unchanged': self.unchanged,
+                'cache_hits': self.cache_hits,
+                'encoded': self.encoded,
+                'avoided_rate': (self.unchanged + self.cache_hits) / total if total else 0.0,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.unchanged = 0
+            self.cache_hits = 0
+            self.encoded = 0
+
+
+content_embedding_cache = EmbeddingCache(
+    'content_embedding',
+    max_entries=getattr(settings, 'CONTENT_EMBEDDING_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'CONTENT_EMBEDDING_CACHE_TTL', 24 * 3600),
+)
+encode_stats = EncodeStats()
@@ -0,0 +1,121 @@
+"""
+Format binaire versionné des embeddings stockés (NoteChunk.embedding,
+ContentEmbedding, CachedAnswer).
+
+En-tête (little-endian) :
+  magic   3 octets  b'MFE'
+  version 1 octet   1
+  dtype   1 octet   0 = float32, 1 = float16, 2 = int8 (quantification scalaire)
+  dim     4 octets  dimension du vecteur
+  n       1 octet   longueur de l'identifiant du modèle
+  model   n octets  identifiant du modèle (utf-8)
+  scale   4 octets  float32, uniquement pour int8 : x ≈ q * scale
+puis les dim valeurs du vecteur.
+
+Les anciennes valeurs, float32 bruts sans en-tête, restent lisibles.
+"""
+import struct
+
+import numpy as np
+
+MAGIC = b'MFE'
+FORMAT_VERSION = 1
+
+FLOAT32 = 'float32'
+FLOAT16 = 'float16'
+INT8 = 'int8'
+
+_DTYPE_CODES = {FLOAT32: 0, FLOAT16: 1, INT8: 2}
+_DTYPES = {0: np.float32, 1: np.float16, 2: np.int8}
+_CODE_NAMES = {code: name for name, code in _DTYPE_CODES.items()}
+
+_HEADER = struct.Struct('<3sBBIB')
+_SCALE = struct.Struct('<f')
+
+
+class EmbeddingHeader:
+    __slots__ = ('dtype', 'dim', 'model_id', 'scale', 'offset')
+
+    def __init__(self, dtype, dim, model_id, scale, offset):
+        self.dtype = dtype
+        self.dim = dim
+        self.model_id = model_id
+        self.scale = scale
+        self.offset = offset
+
+
+def encode_embedding(vector, dtype=FLOAT32, model_id=''):
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"Type de stockage d'embedding inconnu : {dtype}")
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    model_bytes = model_id.encode('utf-8')
+    parts = [_HEADER.pack(MAGIC, FORMAT_VERSION, _DTYPE_CODES[dtype], vector.shape[0], len(model_bytes)), model_bytes]
+
+    if dtype == INT8:
+        max_abs = float(np.abs(vector).max()) if vector.size else 0.0
+        scale = max_abs / 127 if max_abs else 1.0
+        parts.append(_SCALE.pack(scale))
+        parts.append(np.clip(np.rint(vector / scale), -127, 127).astype(np.int8).tobytes())
+    else:
+        parts.append(vector.astype(_DTYPES[_DTYPE_CODES[dtype]]).tobytes())
+    return b''.join(parts)
+
+
+def decode_header(data):
+    """
+    Lit l'en-tête d'un embedding stocké. Les valeurs sans en-tête (ancien
+    format) sont décrites comme float32 sans modèle connu.
+    """
+    data = memoryview(data)
+    if len(data) < _HEADER.size or bytes(data[:3]) != MAGIC:
+        return EmbeddingHeader(FLOAT32, len(data) // 4, '', 1.0, 0)
+
+    _, version, code, dim, model_len = _HEADER.unpack_from(data)
+    if version != FORMAT_VERSION or code not in _DTYPES:
+        raise ValueError(f"Format d'embedding non supporté (version {version}, type {code})")
+    offset = _HEADER.size
+    model_id = bytes(data[offset:offset + model_len]).decode('utf-8')
+    offset += model_len
+    scale = 1.0
+    if code == _DTYPE_CODES[INT8]:
+        (scale,) = _SCALE.unpack_from(data, offset)
+        offset += _SCALE.size
+    return EmbeddingHeader(_CODE_NAMES[code], dim, model_id, scale, offset)
+
+
+def decode_embedding(data, out=None):
+    """
+    Décode un embedding stocké en float32. Si out (vecteur float32 de la bonne
+    dimension, par exemple une ligne d'une matrice préallouée) est fourni, le
+    résultat y est écrit sans allocation intermédiaire ; pour le float32 sans
+    out, le tableau renvoyé est une vue sur data (lecture seule).
+    """
+    header = decode_header(data)
+    values = np.frombuffer(data, dtype=_DTYPES[_DTYPE_CODES[header.dtype]], count=header.dim, offset=header.offset)
+
+    if header.dtype == FLOAT32 and out is None:
+        return values
+    if out is None:
+        out = np.empty(header.dim, dtype=np.float32)
+    if header.dtype == INT8:
+        np.multiply(values, header.scale, out=out, casting='unsafe')
+    else:
+        out[:] = values
+    return out
+
+
+def decode_matrix(blobs, dim=None):
+    """
+    Décode une liste d'embeddings stockés dans une matrice float32 (n, dim)
+    allouée une seule fois. Renvoie la matrice et le masque des lignes valides
+    (les embeddings d'une autre dimension sont ignorés).
+    """
+    if dim is None:
+        dim = decode_header(blobs[0]).dim if blobs else 0
+    matrix = np.empty((len(blobs), dim), dtype=np.float32)
+    valid = np.zeros(len(blobs), dtype=bool)
+    for i, data in enumerate(blobs):
+        if decode_header(data).dim == dim:
+            decode_embedding(data, out=matrix[i])
+            valid[i] = True
+    return matrix, valid
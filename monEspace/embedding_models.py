@@ -0,0 +1,201 @@
+"""
+Modèle d'embeddings actif et migration en ligne vers un nouveau modèle.
+
+Chaque passage (NoteChunk) garde le model_id et la dimension de son vecteur ;
+les recherches ne comparent la requête qu'aux passages du modèle actif.
+Pendant une migration, les passages du nouveau modèle sont calculés en
+arrière-plan (migrate_embeddings run) et tenus à jour à chaque modification
+de note, alors que les recherches continuent sur les anciens vecteurs.
+Quand toutes les notes sont couvertes, activate() bascule les deux modèles
+dans une seule transaction.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .embedding_backends import create_backend, get_backend
+from .models import EmbeddingModel, Note, NoteChunk
+
+# Modèles actif et en cours de migration du processus, relus au plus toutes
+# les EMBEDDING_MODEL_REFRESH secondes : après une bascule, chaque processus
+# change de modèle à sa prochaine relecture
+_active = None
+_active_expires = 0.0
+_migrating = None
+_migrating_expires = 0.0
+_override = None
+_backends = {}
+_lock = threading.Lock()
+
+
+def _register(backend, status):
+    model, created = EmbeddingModel.objects.get_or_create(
+        model_id=backend.model_id,
+        defaults={
+            'backend': backend.name,
+            'config': backend.config(),
+            'dim': backend.dim,
+            'status': status,
+            'activated_at': timezone.now() if status == EmbeddingModel.ACTIVE else None,
+        },
+    )
+    if not created and model.status != status:
+        model.backend, model.config, model.status = backend.name, backend.config(), status
+        model.save(update_fields=['backend', 'config', 'status'])
+    return model
+
+
+def active_model():
+    """
+    Modèle qui sert les recherches. Sans aucun modèle enregistré (base neuve),
+    le modèle configuré (EMBEDDING_BACKEND) devient le modèle actif.
+    """
+    global _active, _active_expires
+    if _override is not None:
+        return _override
+    now = time.monotonic()
+    if _active is None or _active_expires <= now:
+        model = EmbeddingModel.objects.filter(status=EmbeddingModel.ACTIVE).first()
+        if model is None:
+            try:
+                with transaction.atomic():
+                    model = _register(get_backend(), EmbeddingModel.ACTIVE)
+            except IntegrityError:
+                # Enregistré au même moment par un autre processus
+                model = EmbeddingModel.objects.get(status=EmbeddingModel.ACTIVE)
+        _active = model
+        _active_expires = now + getattr(settings, 'EMBEDDING_MODEL_REFRESH', 5)
+    return _active
+
+
+def migrating_model():
+    global _migrating, _migrating_expires
+    if _override is not None:
+        return None
+    now = time.monotonic()
+    if _migrating_expires <= now:
+        _migrating = EmbeddingModel.objects.filter(status=EmbeddingModel.MIGRATING).first()
+        _migrating_expires = now + getattr(settings, 'EMBEDDING_MODEL_REFRESH', 5)
+    return _migrating
+
+
+def serving_models():
+    """
+    Modèles dont les passages doivent suivre les modifications de notes : le
+    modèle actif et, pendant une migration, le nouveau modèle.
+    """
+    models = [active_model()]
+    migrating = migrating_model()
+    if migrating is not None:
+        models.append(migrating)
+    return models
+
+
+def reset():
+    global _active, _active_expires, _migrating, _migrating_expires
+    with _lock:
+        _active, _active_expires = None, 0.0
+        _migrating, _migrating_expires = None, 0.0
+
+
+def backend_for(model):
+    """
+    Moteur qui produit les vecteurs de model, créé une fois par processus.
+    """
+    backend = _backends.get(model.model_id)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(model.model_id)
+            if backend is None:
+                configured = get_backend()
+                if configured.model_id == model.model_id:
+                    backend = configured
+                else:
+                    backend = create_backend(model.backend, **model.config)
+                _backends[model.model_id] = backend
+    return backend
+
+
+def start_migration(backend=None):
+    """
+    Enregistre le modèle configuré (ou backend) comme modèle en cours de
+    migration. Ses passages sont calculés par notes_to_migrate().
+    """
+    backend = backend or get_backend()
+    active = active_model()
+    if backend.model_id == active.model_id:
+        raise ValueError(f"{backend.model_id} est déjà le modèle actif")
+    with transaction.atomic():
+        current = EmbeddingModel.objects.select_for_update().filter(status=EmbeddingModel.MIGRATING).first()
+        if current is not None and current.model_id != backend.model_id:
+            raise ValueError(f"Migration vers {current.model_id} déjà en cours")
+        model = _register(backend, EmbeddingModel.MIGRATING)
+    _backends[model.model_id] = backend
+    reset()
+    return model
+
+
+def _has_chunks(model):
+    return Exists(NoteChunk.objects.filter(note=OuterRef('pk'), model_id=model.model_id))
+
+
+def notes_to_migrate(model):
+    """
+    Notes indexées par le modèle actif qui n'ont pas encore de passages du
+    modèle en cours de migration.
+    """
+    return Note.objects.filter(_has_chunks(active_model())).exclude(_has_chunks(model))
+
+
+def coverage(model):
+    """
+    (notes couvertes par model, notes indexées par le modèle actif).
+    """
+    total = Note.objects.filter(_has_chunks(active_model())).count()
+    return total - notes_to_migrate(model).count(), total
+
+
+def activate(model, force=False):
+    """
+    Bascule : model devient actif, l'ancien modèle est retiré. Refusé tant
+    qu'une note indexée n'a pas de passages du nouveau modèle, sauf force
+    (ces notes ne sortent plus dans les recherches jusqu'à leur ré-indexation).
+    """
+    with transaction.atomic():
+        model = EmbeddingModel.objects.select_for_update().get(pk=model.pk)
+        if model.status != EmbeddingModel.MIGRATING:
+            raise ValueError(f"{model.model_id} n'est pas en cours de migration")
+        if not force and notes_to_migrate(model).exists():
+            done, total = coverage(model)
+            raise ValueError(f"Migration incomplète : {done}/{total} note(s) couverte(s)")
+        EmbeddingModel.objects.filter(status=EmbeddingModel.ACTIVE).update(status=EmbeddingModel.RETIRED)
+        model.status = EmbeddingModel.ACTIVE
+        model.activated_at = timezone.now()
+        model.save(update_fields=['status', 'activated_at'])
+    reset()
+    return model
+
+
+@contextmanager
+def override_active_model(backend):
+    """
+    Sert les recherches et les mises à jour de ce processus avec backend, sans
+    toucher aux modèles enregistrés (benchmarks).
+    """
+    global _override
+    previous = _override
+    _override = EmbeddingModel(
+        model_id=backend.model_id, backend=backend.name, config=backend.config(),
+        dim=backend.dim, status=EmbeddingModel.ACTIVE,
+    )
+    _backends[backend.model_id] = backend
+    try:
+        yield _override
+    finally:
+        _override = previous
+        _backends.pop(backend.model_id, None)
@@ -0,0 +1,107 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import EmbeddingJob, Note
+from .services import update_note_embedding, update_note_embeddings, update_search_vector
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def schedule_note_embedding(note):
+    """
+    Planifie le recalcul de l'embedding d'une note.
+
+    Les sauvegardes successives d'une même note sont regroupées : chaque
+    modification repousse l'échéance de EMBEDDING_QUEUE_DEBOUNCE secondes,
+    sans dépasser EMBEDDING_QUEUE_MAX_DELAY après la première demande.
+    En attendant, la recherche sémantique continue d'utiliser les anciens
+    passages ; le plein texte est mis à jour tout de suite.
+    """
+    if not _setting('EMBEDDING_ASYNC', True):
+        update_note_embedding(note)
+        return
+
+    update_search_vector(note)
+
+    now = timezone.now()
+    run_after = now + timedelta(seconds=_setting('EMBEDDING_QUEUE_DEBOUNCE', 5))
+    while True:
+        job, created = EmbeddingJob.objects.get_or_create(note=note, defaults={'run_after': run_after})
+        if created:
+            break
+        deadline = job.created_at + timedelta(seconds=_setting('EMBEDDING_QUEUE_MAX_DELAY', 60))
+        updated = EmbeddingJob.objects.filter(pk=job.pk).update(
+            run_after=min(run_after, max(deadline, now)),
+            version=F('version') + 1,
+        )
+        if updated:
+            break
+        # Tâche terminée et supprimée par un worker entre-temps, sur l'ancien
+        # contenu : on en crée une nouvelle pour cette modification
+    Note.objects.filter(pk=note.pk).update(embedding_stale=True)
+
+
+def claim_jobs(batch_size):
+    """
+    Réserve jusqu'à batch_size tâches échues pour ce worker. La réservation est
+    un bail (locked_until) : si le worker meurt, les tâches redeviennent
+    disponibles à son expiration.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=_setting('EMBEDDING_QUEUE_LEASE', 300))
+    with transaction.atomic():
+        jobs = list(
+            EmbeddingJob.objects.select_for_update(skip_locked=True)
+            .filter(run_after__lte=now)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .order_by('run_after')[:batch_size]
+        )
+        EmbeddingJob.objects.filter(pk__in=[job.pk for job in jobs]).update(locked_until=now + lease)
+    return jobs
+
+
+def _release(jobs, error):
+    backoff = _setting('EMBEDDING_QUEUE_RETRY_BACKOFF', 30)
+    now = timezone.now()
+    for job in jobs:
+        EmbeddingJob.objects.filter(pk=job.pk).update(
+            locked_until=None,
+            attempts=F('attempts') + 1,
+            last_error=str(error),
+            run_after=now + timedelta(seconds=backoff * (job.attempts + 1)),
+        )
+
+
+def process_jobs(batch_size=32):
+    """
+    Traite un lot de tâches avec un seul appel au modèle. Retourne le nombre
+    de notes mises à jour.
+    """
+    jobs = claim_jobs(batch_size)
+    if not jobs:
+        return 0
+
+    notes = Note.objects.filter(pk__in=[job.note_id for job in jobs]).prefetch_related('attachments')
+    try:
+        update_note_embeddings(notes, batch_size=batch_size)
+    except Exception as e:
+        logger.exception("Échec du calcul des embeddings")
+        _release(jobs, e)
+        return 0
+
+    for job in jobs:
+        # Une note modifiée pendant le calcul garde sa tâche (version incrémentée)
+        deleted, _ = EmbeddingJob.objects.filter(pk=job.pk, version=job.version).delete()
+        if not deleted:
+            EmbeddingJob.objects.filter(pk=job.pk).update(locked_until=None)
+            Note.objects.filter(pk=job.note_id).update(embedding_stale=True)
+    return len(jobs)
@@ -0,0 +1,169 @@
+"""
+Serveur d'embeddings local partagé par les workers web.
+
+Un seul processus (commande run_embedder) charge le modèle et écoute sur une
+socket Unix ; les workers lui envoient des textes déjà prétraités et reçoivent
+les vecteurs. Les requêtes concurrentes de tous les workers sont regroupées en
+lots avant l'appel au modèle.
+
+Protocole, par trame : 4 octets (longueur, big-endian) puis le contenu.
+  requête : une trame JSON {"texts": [...]}
+  réponse : une trame JSON {"shape": [n, dim], "model": model_id} suivie
+            d'une trame contenant les n * dim float32 bruts, ou une trame
+            JSON {"error": "..."}
+
+Le client ignore les vecteurs d'un serveur qui tourne avec un autre modèle
+que celui demandé (EMBEDDING_BACKEND différent, ou modèle actif pendant une
+migration de modèle) et encode alors lui-même.
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+
+
+class EmbeddingServerError(Exception):
+    """
+    Trame {"error": ...} : le serveur n'a pas pu encoder les textes.
+    """
+
+
+def _send_frame(sock, payload):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connexion fermée par le serveur d'embeddings")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv_frame(sock):
+    (size,) = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return _recv_exactly(sock, size)
+
+
+def socket_path():
+    return getattr(settings, 'EMBEDDING_SOCKET_PATH', None)
+
+
+class _EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = json.loads(_recv_frame(self.request))
+            except (ConnectionError, OSError):
+                return
+            try:
+                futures = self.server.batcher.submit_many(request['texts'])
+                vectors = np.vstack([future.result() for future in futures]).astype(np.float32)
+                header = {'shape': list(vectors.shape), 'model': self.server.model_id}
+                _send_frame(self.request, json.dumps(header).encode())
+                _send_frame(self.request, vectors.tobytes())
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:
+                logger.exception("Erreur d'encodage")
+                _send_frame(self.request, json.dumps({'error': str(e)}).encode())
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, path, batcher, model_id):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.batcher = batcher
+        self.model_id = model_id
+        super().__init__(path, _EmbeddingRequestHandler)
+        os.chmod(path, 0o660)
+
+
+class EmbeddingClient:
+    """
+    Client du serveur d'embeddings. Une connexion persistante par thread ;
+    encode() renvoie None si le serveur n'est pas disponible ou sert un autre
+    modèle, l'appelant encode alors dans son propre processus. Le modèle du
+    serveur est retenu quelques secondes pour ne pas lui envoyer de textes
+    qu'il encoderait pour rien.
+    """
+
+    def __init__(self, timeout=30.0, model_ttl=30.0):
+        self.timeout = timeout
+        self.model_ttl = model_ttl
+        self._local = threading.local()
+        self._server_model = None
+        self._server_model_expires = 0.0
+
+    def _connect(self, path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(path)
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def available(self):
+        path = socket_path()
+        return bool(path) and os.path.exists(path)
+
+    def encode(self, texts, model_id):
+        if not self.available():
+            return None
+        if self._server_model not in (None, model_id) and time.monotonic() < self._server_model_expires:
+            return None
+        # Une connexion réutilisée peut avoir été fermée par un redémarrage du
+        # serveur : on retente une fois avec une connexion neuve.
+        for attempt in range(2):
+            try:
+                sock = getattr(self._local, 'sock', None)
+                if sock is None:
+                    sock = self._local.sock = self._connect(socket_path())
+                _send_frame(sock, json.dumps({'texts': list(texts)}).encode())
+                header = json.loads(_recv_frame(sock))
+                if 'error' in header:
+                    raise EmbeddingServerError(header['error'])
+                data = _recv_frame(sock)
+                self._server_model = header.get('model')
+                self._server_model_expires = time.monotonic() + self.model_ttl
+                if header.get('model') != model_id:
+                    logger.warning(
+                        "Le serveur d'embeddings utilise %s au lieu de %s, encodage local",
+                        header.get('model'), model_id,
+                    )
+                    return None
+                return np.frombuffer(data, dtype=np.float32).reshape(header['shape'])
+            except EmbeddingServerError as e:
+                # La connexion reste utilisable ; réessayer ne changerait rien
+                logger.warning("Échec d'encodage du serveur d'embeddings (%s), encodage local", e)
+                return None
+            except (ConnectionError, OSError) as e:
+                self._close()
+                if attempt:
+                    logger.warning("Serveur d'embeddings indisponible (%s), encodage local", e)
+        return None
+
+
+embedding_client = EmbeddingClient()
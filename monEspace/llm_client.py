@@ -0,0 +1,216 @@
+"""
+Client du modèle de langage du chat, partagé par tout le processus.
+
+Le client parle le protocole de streaming de text-generation-inference
+(API d'inférence Hugging Face) : POST {"inputs", "parameters", "stream": true}
+sur LLM_BASE_URL/<modèle>, réponse en server-sent events dont chaque ligne
+data: porte un token ({"token": {"text", "special"}, ...}) ou une erreur
+({"error": "..."}). La commande fake_llm_server sert le même protocole en
+local pour les tests et les tests de charge.
+
+- Connexions gardées ouvertes (keep-alive) et réutilisées d'un message à
+  l'autre : pas de nouvelle connexion TLS par message.
+- Délais de connexion et de lecture (entre deux tokens) bornés.
+- Tant qu'aucun token n'a été reçu, un échec est retenté quelques fois avec
+  un délai exponentiel aléatoire ; après le premier token, la réponse ne
+  peut plus être rejouée et l'erreur remonte.
+- Un disjoncteur coupe les appels pendant LLM_BREAKER_RESET secondes après
+  LLM_BREAKER_THRESHOLD échecs consécutifs : pendant une panne, les
+  messages échouent tout de suite au lieu d'attendre chacun le délai.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """
+    Échec de la génération.
+    """
+
+
+class LLMUnavailable(LLMError):
+    """
+    Modèle injoignable : disjoncteur ouvert ou tentatives épuisées.
+    """
+
+
+class _RetryableError(LLMError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fermé : les appels passent. Ouvert après threshold échecs consécutifs :
+    les appels sont refusés pendant reset_timeout secondes, puis un seul
+    appel d'essai passe (semi-ouvert) ; son succès referme le disjoncteur,
+    son échec le rouvre.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def release(self):
+        # Appel d'essai abandonné sans résultat (client parti)
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    def __init__(self):
+        self.breaker = CircuitBreaker(
+            threshold=getattr(settings, 'LLM_BREAKER_THRESHOLD', 5),
+            reset_timeout=getattr(settings, 'LLM_BREAKER_RESET', 30),
+        )
+        # Un client httpx (et son pool de connexions) par boucle d'événements
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            max_connections = getattr(settings, 'LLM_MAX_CONNECTIONS', 100)
+            token = getattr(settings, 'LLM_API_TOKEN', None) or os.getenv('HF_TOKEN')
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    getattr(settings, 'LLM_READ_TIMEOUT', 30),
+                    connect=getattr(settings, 'LLM_CONNECT_TIMEOUT', 5),
+                ),
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                headers={'Authorization': f'Bearer {token}'} if token else {},
+            )
+            self._clients[loop] = client
+        return client
+
+    def url(self, model=None):
+        base_url = getattr(settings, 'LLM_BASE_URL', 'https://api-inference.huggingface.co/models')
+        return f"{base_url.rstrip('/')}/{model or getattr(settings, 'LLM_MODEL', 'mistralai/Mixtral-8x7B-Instruct-v0.1')}"
+
+    async def stream(self, prompt, max_new_tokens=300, temperature=0.7, model=None):
+        """
+        Génère la suite de prompt ; renvoie un générateur asynchrone des
+        morceaux de texte. Lève LLMUnavailable si le modèle est injoignable,
+        LLMError pour une autre erreur.
+        """
+        import httpx
+
+        payload = {
+            'inputs': prompt,
+            'parameters': {'max_new_tokens': max_new_tokens, 'temperature': temperature},
+            'stream': True,
+        }
+        retries = getattr(settings, 'LLM_RETRIES', 2)
+        backoff = getattr(settings, 'LLM_RETRY_BACKOFF', 0.2)
+        for attempt in range(retries + 1):
+            if not self.breaker.allow():
+                raise LLMUnavailable("Modèle de langage indisponible (disjoncteur ouvert)")
+            started = False
+            try:
+                async with self._client().stream('POST', self.url(model), json=payload) as response:
+                    if response.status_code == 429 or response.status_code >= 500:
+                        raise _RetryableError(f"HTTP {response.status_code}")
+                    if response.status_code >= 400:
+                        body = (await response.aread()).decode('utf-8', 'replace')
+                        raise LLMError(f"HTTP {response.status_code} : {body[:200]}")
+                    async for line in response.aiter_lines():
+                        if not line.startswith('data:'):
+                            continue
+                        try:
+                            event = json.loads(line[5:])
+                        except ValueError:
+                            raise LLMError(f"Événement illisible : {line[:200]}")
+                        if 'error' in event:
+                            raise (LLMError if started else _RetryableError)(event['error'])
+                        token = event.get('token') or {}
+                        if token.get('special') or not token.get('text'):
+                            continue
+                        if not started:
+                            started = True
+                            self.breaker.record_success()
+                        yield token['text']
+                if not started:
+                    self.breaker.record_success()
+                return
+            except (httpx.TransportError, _RetryableError) as e:
+                self.breaker.record_failure()
+                if started:
+                    raise LLMError(f"Génération interrompue : {e}") from e
+                if attempt == retries:
+                    raise LLMUnavailable(f"Modèle de langage injoignable : {e}") from e
+                delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning("Échec de l'appel au modèle (%s), nouvel essai dans %.2f s", e, delay)
+                await asyncio.sleep(delay)
+            except LLMError:
+                # Le modèle a répondu (requête refusée) : il est joignable
+                if not started:
+                    self.breaker.record_success()
+                raise
+            except asyncio.CancelledError:
+                if not started:
+                    self.breaker.release()
+                raise
+
+    async def aclose_loop_client(self):
+        """
+        Ferme le client de la boucle courante. Sous WSGI, chaque réponse du
+        chat a sa propre boucle (run_stream) : son client est fermé avec elle
+        au lieu de garder un pool de connexions par requête.
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    async def aclose(self):
+        for client in list(self._clients.values()):
+            await client.aclose()
+        self._clients.clear()
+
+
+llm_client = LLMClient()
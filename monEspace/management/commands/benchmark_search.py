@@ -0,0 +1,296 @@
+import json
+import random
+import resource
+import subprocess
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from monEspace import services
+from monEspace.embedding_backends import BACKENDS, create_backend
+from monEspace.embedding_cache import content_embedding_cache, query_embedding_cache
+from monEspace.embedding_format import decode_matrix
+from monEspace.embedding_models import override_active_model
+from monEspace.models import ContentEmbedding, Note, NoteChunk
+from monEspace.search_scope import search_scope
+from monEspace.vector_index import NoteIndex, note_index_cache
+
+TOPICS = {
+    'mathématiques': "intégrale dérivée fonction limite suite série matrice vecteur probabilité théorème "
+                     "démonstration équation polynôme logarithme exponentielle géométrie triangle cercle",
+    'physique': "force énergie vitesse accélération masse gravitation onde fréquence électricité tension "
+                "courant résistance optique lumière thermodynamique pression température mouvement",
+    'histoire': "révolution empire guerre traité roi république siècle bataille colonie monarchie "
+                "constitution parlement réforme croisade renaissance industrialisation frontière",
+    'français': "roman poésie théâtre personnage narrateur métaphore alexandrin dissertation commentaire "
+                "argument tragédie comédie auteur style registre figure strophe",
+    'biologie': "cellule génétique adn protéine enzyme évolution espèce écosystème photosynthèse organe "
+                "neurone hormone immunité chromosome mitose respiration bactérie",
+    'anglais': "vocabulary grammar tense verb essay listening reading speaking preterit present "
+               "perfect modal irregular pronunciation translation idiom",
+}
+FILLER = ("pour le contrôle il faut retenir que la méthode consiste à appliquer la règle vue en cours "
+          "avec un exemple corrigé puis vérifier le résultat et noter les erreurs fréquentes").split()
+
+
+def percentiles(samples):
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        'count': len(samples),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+    }
+
+
+def _max_rss_mb():
+    # ru_maxrss est en kilo-octets sous Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure la latence (p50/p95/p99) et la mémoire de la recherche de notes sur des "
+        "notes synthétiques, et le recall@k des index approchés face à un index exact. "
+        "Écrit un rapport JSON comparable d'un commit à l'autre."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help="Nombres de notes par utilisateur, séparés par des virgules.")
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=3)
+        parser.add_argument('--mode', default='hybrid',
+                            help="Mode de recherche pour NoteViewSet.search et le chat.")
+        parser.add_argument('--backend', choices=list(BACKENDS), default='hash',
+                            help="Moteur d'embeddings ; hash (défaut) : déterministe, hors ligne.")
+        parser.add_argument('--index-types', default='fp16,sq8',
+                            help="Index FAISS approchés dont on mesure le recall.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--threads', type=int, default=8,
+                            help="Threads concurrents pour la mesure de débit d'encodage.")
+        parser.add_argument('--output', help="Fichier du rapport JSON (sinon sur la sortie standard).")
+        parser.add_argument('--keep', action='store_true',
+                            help="Garde les utilisateurs et notes synthétiques.")
+
+    def handle(self, *args, **options):
+        if options['mode'] not in services.SEARCH_MODES:
+            raise CommandError(f"Mode inconnu : {options['mode']}")
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+        report = {
+            'commit': _git_commit(),
+            'embedding_backend': options['backend'],
+            'search_backend': getattr(settings, 'NOTE_SEARCH_BACKEND', 'pgvector'),
+            'database': connection.vendor,
+            'mode': options['mode'],
+            'k': options['k'],
+            'queries': options['queries'],
+            'seed': options['seed'],
+            'sizes': {},
+        }
+
+        backend = create_backend(options['backend'])
+        report['model'] = backend.model_id
+        # Le moteur sert de modèle actif à ce processus seulement : son
+        # model_id sépare ses passages, ses empreintes de contenu et son cache
+        # de requêtes de ceux du modèle de production ; le serveur
+        # d'embeddings partagé n'est pas utilisé
+        try:
+            with override_active_model(backend), override_settings(EMBEDDING_SOCKET_PATH=None):
+                for size in sizes:
+                    self.stdout.write(f"{size} notes...")
+                    report['sizes'][str(size)] = self._run_size(size, options)
+                report['concurrent_encode'] = self._concurrent_encode(options)
+        finally:
+            query_embedding_cache.clear()
+            content_embedding_cache.clear()
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Rapport écrit dans {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def _generate(self, user, size, rng):
+        topics = list(TOPICS)
+        notes = []
+        for i in range(size):
+            topic = rng.choice(topics)
+            vocabulary = TOPICS[topic].split()
+            words = [rng.choice(vocabulary) if rng.random() < 0.6 else rng.choice(FILLER)
+                     for _ in range(rng.randint(30, 120))]
+            text = ' '.join(words)
+            notes.append(Note(
+                user=user, title=f"{topic.capitalize()} — fiche {i}",
+                content=f"<p>{text}</p>", content_text=text,
+            ))
+        Note.objects.bulk_create(notes, batch_size=1000)
+
+    def _embed(self, user, batch_size=512):
+        fingerprints = []
+        notes = Note.objects.filter(user=user).order_by('id').prefetch_related('attachments')
+        for offset in range(0, notes.count(), batch_size):
+            batch = services.NoteEmbeddingBatch(notes[offset:offset + batch_size])
+            embeddings = services.encode_texts(batch.missing_texts, batch_size=64) if batch.missing_texts else []
+            batch.save(embeddings, update_index=False)
+            fingerprints.extend(batch.missing_fingerprints)
+        return fingerprints
+
+    def _queries(self, user, count, rng):
+        texts = list(Note.objects.filter(user=user).values_list('content_text', flat=True)[:2000])
+        queries = []
+        for _ in range(count):
+            words = rng.choice(texts).split()
+            start = rng.randrange(max(len(words) - 6, 1))
+            queries.append(' '.join(words[start:start + rng.randint(3, 6)]))
+        return queries
+
+    def _time(self, fn, queries):
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            samples.append(time.perf_counter() - start)
+        return percentiles(samples)
+
+    def _run_size(self, size, options):
+        rng = random.Random(f"{options['seed']}:{size}")
+        user = User.objects.create(username=f"bench-{size}-{uuid.uuid4().hex[:8]}")
+        fingerprints = []
+        try:
+            start = time.perf_counter()
+            self._generate(user, size, rng)
+            fingerprints = self._embed(user)
+            setup_seconds = time.perf_counter() - start
+            queries = self._queries(user, options['queries'], rng)
+            k, mode = options['k'], options['mode']
+            for query in queries:
+                services.embed_query(query)
+
+            result = {
+                'notes': size,
+                'chunks': NoteChunk.objects.filter(note__user=user).count(),
+                'setup_seconds': round(setup_seconds, 2),
+            }
+
+            rss_before = _max_rss_mb()
+            start = time.perf_counter()
+            index = note_index_cache.get(('user', user.id))
+            result['index'] = {
+                'type': getattr(settings, 'NOTE_INDEX_TYPE', 'flat'),
+                'build_seconds': round(time.perf_counter() - start, 3),
+                'bytes': index.nbytes if index else 0,
+            }
+
+            result['semantic_search'] = self._time(
+                lambda query: services.search_notes(query, user, k=k, mode='semantic'), queries)
+
+            view = _search_view()
+            factory = APIRequestFactory()
+
+            def viewset_search(query):
+                request = factory.get('/api/notes/search/', {'q': query, 'mode': mode, 'k': k})
+                force_authenticate(request, user=user)
+                view(request).render()
+            result['viewset_search'] = self._time(viewset_search, queries)
+
+            chat = _chat_view()
+            result['chat_retrieval'] = self._time(
+                lambda query: chat._process_search_results(services.search_notes(query, user)), queries)
+
+            result['memory'] = {'max_rss_mb': _max_rss_mb(), 'max_rss_growth_mb': round(_max_rss_mb() - rss_before, 1)}
+            result['recall'] = self._recall(user, queries, k, options['index_types'])
+            return result
+        finally:
+            if not options['keep']:
+                note_index_cache.invalidate(('user', user.id))
+                user.delete()
+                ContentEmbedding.objects.filter(fingerprint__in=fingerprints).delete()
+
+    def _concurrent_encode(self, options, count=2000):
+        """
+        Débit d'encodage de textes uniques envoyés un par un depuis plusieurs
+        threads (charge de recherches concurrentes), avec et sans regroupement
+        en lots dans le processus.
+        """
+        rng = random.Random(options['seed'])
+        words = ' '.join(TOPICS.values()).split()
+        texts = [f"{' '.join(rng.sample(words, 4))} {i}" for i in range(count)]
+        result = {'threads': options['threads'], 'texts': count}
+        for enabled in (False, True):
+            with override_settings(EMBEDDING_MICRO_BATCHING=enabled):
+                services.get_batcher().stats.reset()
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                    list(pool.map(lambda text: services.encode_texts([text]), texts))
+                elapsed = time.perf_counter() - start
+            entry = {'texts_per_second': round(count / elapsed, 1)}
+            if enabled:
+                entry['batches'] = services.get_batcher().stats.snapshot()
+            result['micro_batching' if enabled else 'direct'] = entry
+        return result
+
+    def _recall(self, user, queries, k, index_types):
+        """
+        recall@k des notes renvoyées par chaque index approché, par rapport à
+        une recherche exacte (IndexFlatIP) sur les mêmes passages.
+        """
+        rows = list(NoteChunk.objects.filter(note__user=user).values_list('id', 'note_id', 'note__created_at', 'embedding'))
+        chunk_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        note_ids = np.array([row[1] for row in rows], dtype=np.int64)
+        note_meta = {row[1]: (user.id, row[2].timestamp()) for row in rows}
+        vectors, _ = decode_matrix([row[3] for row in rows])
+        query_vectors = [services.embed_query(query) for query in queries]
+
+        def build(index_type):
+            index = NoteIndex(vectors.shape[1], index_type=index_type)
+            index.add(chunk_ids, note_ids, vectors, note_meta)
+            return index
+
+        exact = build('flat')
+        truth = [{note_id for note_id, _, _ in exact.search(vector, k)} for vector in query_vectors]
+
+        def recall(search):
+            found = [len(truth[i] & {note_id for note_id, _, _ in search(vector)}) / max(len(truth[i]), 1)
+                     for i, vector in enumerate(query_vectors)]
+            return round(float(np.mean(found)), 4)
+
+        recalls = {}
+        for index_type in [name for name in index_types.split(',') if name]:
+            index = build(index_type)
+            recalls[index_type] = recall(lambda vector: index.search(vector, k))
+        if connection.vendor == 'postgresql' and vectors.shape[1] == services.EMBEDDING_DIM:
+            scope = search_scope(user)
+            recalls['pgvector_hnsw'] = recall(lambda vector: services._pgvector_hits(vector, scope, k))
+        return recalls
+
+
+def _search_view():
+    from monEspace.views import NoteViewSet
+    return NoteViewSet.as_view({'get': 'search'})
+
+
+def _chat_view():
+    from monEspace.views import ChatStreamView
+    return ChatStreamView()
@@ -0,0 +1,77 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules qui ne doivent jamais être importés au démarrage : ils ne sont
+# chargés qu'au premier encodage / à la première génération.
+HEAVY_MODULES = [
+    'torch',
+    'sentence_transformers',
+    'transformers',
+    'faiss',
+    'onnxruntime',
+    'nltk',
+    'openai',
+    'huggingface_hub',
+    'whisper',
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+import monFocus.urls
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'heavy': [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le temps d'import de Django + des URLs dans un processus neuf et "
+        "échoue si le budget est dépassé ou si une bibliothèque ML est importée."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--budget', type=float,
+                            default=getattr(settings, 'IMPORT_TIME_BUDGET', 2.0),
+                            help="Temps médian maximal en secondes.")
+
+    def _probe(self):
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'monFocus.settings')
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE % (HEAVY_MODULES,)],
+            env=env, cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        try:
+            results = [self._probe() for _ in range(options['runs'])]
+        except subprocess.CalledProcessError as e:
+            raise CommandError(f"L'import a échoué :\n{e.stderr}")
+
+        timings = sorted(result['seconds'] for result in results)
+        median = statistics.median(timings)
+        self.stdout.write(
+            f"import monFocus.urls : médiane {median:.3f} s, min {timings[0]:.3f} s, "
+            f"max {timings[-1]:.3f} s ({len(timings)} essais)"
+        )
+
+        heavy = sorted({name for result in results for name in result['heavy']})
+        if heavy:
+            raise CommandError(f"Modules lourds importés au démarrage : {', '.join(heavy)}")
+        if median > options['budget']:
+            raise CommandError(f"Temps d'import {median:.3f} s supérieur au budget de {options['budget']:.3f} s")
+        self.stdout.write(self.style.SUCCESS("Temps d'import dans le budget"))
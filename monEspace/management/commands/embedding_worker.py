@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from monEspace.embedding_cache import encode_stats
+from monEspace.embedding_queue import process_jobs
+
+
+class Command(BaseCommand):
+    help = "Calcule en arrière-plan les embeddings des notes modifiées (file EmbeddingJob)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Attente en secondes quand la file est vide.")
+        parser.add_argument('--once', action='store_true',
+                            help="Vide la file une fois puis s'arrête.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write(f"Worker d'embeddings démarré (lots de {batch_size})")
+        try:
+            while True:
+                processed = process_jobs(batch_size)
+                if processed:
+                    stats = encode_stats.snapshot()
+                    self.stdout.write(
+                        f"{processed} note(s) traitée(s) ; depuis le démarrage : {stats['encoded']} encodage(s), "
+                        f"{stats['unchanged']} inchangée(s), {stats['cache_hits']} trouvée(s) en cache"
+                    )
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Arrêt du worker")
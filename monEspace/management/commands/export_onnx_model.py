@@ -0,0 +1,104 @@
+import json
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from monEspace.embedding_backends import OnnxBackend, SentenceTransformerBackend
+
+SAMPLE_TEXTS = [
+    "intégrale fonction continue segment théorème fondamental analyse",
+    "révolution française 1789 états généraux serment jeu paume",
+    "photosynthèse chlorophylle lumière glucose dioxyde carbone",
+    "dissertation argument exemple introduction problématique plan",
+] * 16
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporte le modèle sentence-transformers en ONNX (et sa version quantifiée int8) "
+        "pour EMBEDDING_BACKEND = 'onnx', puis compare vecteurs et vitesse sur CPU."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=getattr(settings, 'EMBEDDING_MODEL_NAME', 'all-mpnet-base-v2'))
+        parser.add_argument('--output', default=getattr(settings, 'EMBEDDING_ONNX_DIR', None),
+                            help="Répertoire de sortie (défaut : EMBEDDING_ONNX_DIR).")
+        parser.add_argument('--opset', type=int, default=14)
+
+    def handle(self, *args, **options):
+        output = options['output']
+        if not output:
+            raise CommandError("Aucun répertoire de sortie (EMBEDDING_ONNX_DIR ou --output).")
+        try:
+            import torch
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise CommandError(f"Dépendance manquante pour l'export ONNX : {e.name}")
+
+        os.makedirs(output, exist_ok=True)
+        model = SentenceTransformer(options['model'], device='cpu')
+        transformer = model[0].auto_model
+        transformer.config.return_dict = False
+        transformer.eval()
+        tokenizer = model.tokenizer
+
+        path = os.path.join(output, 'model.onnx')
+        sample = tokenizer(["exemple de phrase"], return_tensors='pt')
+        self.stdout.write(f"Export de {options['model']} vers {path}")
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                (sample['input_ids'], sample['attention_mask']),
+                path,
+                input_names=['input_ids', 'attention_mask'],
+                output_names=['last_hidden_state'],
+                dynamic_axes={
+                    'input_ids': {0: 'batch', 1: 'sequence'},
+                    'attention_mask': {0: 'batch', 1: 'sequence'},
+                    'last_hidden_state': {0: 'batch', 1: 'sequence'},
+                },
+                opset_version=options['opset'],
+            )
+
+        quantized_path = os.path.join(output, 'model.int8.onnx')
+        self.stdout.write(f"Quantification dynamique int8 vers {quantized_path}")
+        quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+
+        tokenizer.save_pretrained(output)
+        with open(os.path.join(output, 'embedding.json'), 'w') as f:
+            json.dump({
+                'model_id': options['model'],
+                'dim': model.get_sentence_embedding_dimension(),
+                'max_length': model.max_seq_length,
+                'pad_id': tokenizer.pad_token_id,
+                'normalize': any(type(module).__name__ == 'Normalize' for module in model),
+            }, f, indent=2)
+
+        self._compare(options['model'], output)
+
+    def _compare(self, model_name, output):
+        reference = SentenceTransformerBackend(model_name)
+        backends = {
+            'sentence-transformers': reference,
+            'onnx': OnnxBackend(output, quantized=False),
+            'onnx-int8': OnnxBackend(output, quantized=True),
+        }
+        vectors, timings = {}, {}
+        for name, backend in backends.items():
+            backend.encode(SAMPLE_TEXTS[:2])
+            start = time.perf_counter()
+            vectors[name] = backend.encode(SAMPLE_TEXTS, batch_size=32)
+            timings[name] = time.perf_counter() - start
+
+        for name in vectors:
+            vectors[name] = vectors[name] / np.linalg.norm(vectors[name], axis=1, keepdims=True)
+        for name in ('onnx', 'onnx-int8'):
+            similarity = np.sum(vectors['sentence-transformers'] * vectors[name], axis=1)
+            self.stdout.write(
+                f"{name} : cosinus min {similarity.min():.4f} avec sentence-transformers, "
+                f"{timings['sentence-transformers'] / timings[name]:.1f}x plus rapide sur CPU"
+            )
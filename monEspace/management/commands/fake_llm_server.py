@@ -0,0 +1,105 @@
+import asyncio
+import json
+import random
+
+from django.core.management.base import BaseCommand
+
+WORDS = (
+    "Bonne question ! Avant de te donner une piste, peux-tu me dire ce que tu as déjà essayé ? "
+    "Relis la définition vue en cours et cherche quelle étape te bloque : on avancera ensemble, "
+    "une étape à la fois, jusqu'à ce que tu trouves la réponse par toi-même."
+).split(' ')
+
+
+class Command(BaseCommand):
+    help = (
+        "Serveur d'inférence factice qui parle le protocole de streaming de "
+        "text-generation-inference, pour le développement, les tests et les tests de "
+        "charge du chat (LLM_BASE_URL = 'http://127.0.0.1:8081/models')."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--first-token-ms', type=float, default=300,
+                            help="Délai avant le premier token (lecture du prompt).")
+        parser.add_argument('--token-ms', type=float, default=30, help="Délai entre deux tokens.")
+        parser.add_argument('--tokens', type=int, default=0,
+                            help="Nombre de tokens par réponse (défaut : max_new_tokens de la requête).")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Proportion de requêtes qui échouent en HTTP 503 (test des reprises).")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.stdout.write(f"Serveur d'inférence factice sur http://{options['host']}:{options['port']}/models/<modèle>")
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+
+    async def _serve(self):
+        server = await asyncio.start_server(self._handle, self.options['host'], self.options['port'])
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        # HTTP/1.1 minimal avec keep-alive : plusieurs requêtes par connexion
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                if method != 'POST' or not path.startswith('/models/'):
+                    await self._send_plain(writer, 404, {'error': 'Not Found'})
+                    continue
+                if random.random() < self.options['error_rate']:
+                    await self._send_plain(writer, 503, {'error': 'Model is overloaded'})
+                    continue
+                await self._stream(writer, json.loads(body or b'{}'))
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_plain(self, writer, status, payload):
+        data = json.dumps(payload).encode()
+        reason = {404: 'Not Found', 503: 'Service Unavailable'}[status]
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+
+    async def _stream(self, writer, request):
+        count = self.options['tokens'] or request.get('parameters', {}).get('max_new_tokens', 50)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n"
+        )
+        await asyncio.sleep(self.options['first_token_ms'] / 1000)
+        generated = []
+        for i in range(count):
+            text = WORDS[i % len(WORDS)] + ' '
+            generated.append(text)
+            last = i == count - 1
+            event = {
+                'token': {'id': i, 'text': text, 'logprob': 0.0, 'special': False},
+                'generated_text': ''.join(generated) if last else None,
+                'details': None,
+            }
+            data = f"data:{json.dumps(event)}\n\n".encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+            if not last:
+                await asyncio.sleep(self.options['token_ms'] / 1000)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
@@ -0,0 +1,118 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from monEspace import embedding_models
+from monEspace.embedding_backends import BACKENDS, create_backend
+from monEspace.models import EmbeddingModel, NoteChunk
+from monEspace.services import NoteEmbeddingBatch, encode_texts
+
+
+class Command(BaseCommand):
+    help = (
+        "Migre les embeddings vers un nouveau modèle sans interrompre la recherche : "
+        "start enregistre le modèle configuré, run calcule ses passages en arrière-plan "
+        "puis bascule quand toutes les notes sont couvertes, cleanup supprime les "
+        "passages des modèles retirés."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['status', 'start', 'run', 'activate', 'abort', 'cleanup'])
+        parser.add_argument('--backend', choices=list(BACKENDS),
+                            help="Moteur du nouveau modèle pour start (défaut : EMBEDDING_BACKEND).")
+        parser.add_argument('--chunk-size', type=int, default=256,
+                            help="Nombre de notes lues et écrites par lot.")
+        parser.add_argument('--batch-size', type=int, default=64,
+                            help="Taille des lots passés au moteur.")
+        parser.add_argument('--no-activate', action='store_true',
+                            help="run : ne bascule pas à la fin, activate le fera.")
+        parser.add_argument('--force', action='store_true',
+                            help="activate : bascule même si des notes ne sont pas couvertes.")
+
+    def handle(self, *args, **options):
+        getattr(self, f"_{options['action']}")(options)
+
+    def _migrating(self):
+        model = embedding_models.migrating_model()
+        if model is None:
+            raise CommandError("Aucune migration en cours (lancer d'abord : migrate_embeddings start)")
+        return model
+
+    def _status(self, options):
+        active = embedding_models.active_model()
+        self.stdout.write(f"Modèle actif : {active.model_id} ({active.backend}, {active.dim} dimensions)")
+        model = embedding_models.migrating_model()
+        if model is not None:
+            done, total = embedding_models.coverage(model)
+            self.stdout.write(
+                f"Migration vers {model.model_id} ({model.backend}, {model.dim} dimensions) : "
+                f"{done}/{total} note(s) couverte(s)"
+            )
+        serving = [item.model_id for item in embedding_models.serving_models()]
+        stale = NoteChunk.objects.exclude(model_id__in=serving).count()
+        if stale:
+            self.stdout.write(f"{stale} passage(s) de modèles retirés (à supprimer avec cleanup)")
+
+    def _start(self, options):
+        backend = create_backend(options['backend']) if options['backend'] else None
+        try:
+            model = embedding_models.start_migration(backend)
+        except ValueError as e:
+            raise CommandError(str(e))
+        done, total = embedding_models.coverage(model)
+        self.stdout.write(self.style.SUCCESS(
+            f"Migration vers {model.model_id} démarrée : {done}/{total} note(s) couverte(s)"
+        ))
+
+    def _run(self, options):
+        model = self._migrating()
+        started = time.monotonic()
+        processed = 0
+        while True:
+            # Les notes traitées sortent de notes_to_migrate : la commande
+            # reprend là où elle s'est arrêtée. Les notes modifiées pendant la
+            # migration sont déjà tenues à jour par la file d'embeddings.
+            notes = list(
+                embedding_models.notes_to_migrate(model).order_by('id')
+                .prefetch_related('attachments')[:options['chunk_size']]
+            )
+            if not notes:
+                break
+            batch = NoteEmbeddingBatch(notes, model=model)
+            embeddings = (
+                encode_texts(batch.missing_texts, batch_size=options['batch_size'], model=model)
+                if batch.missing_texts else []
+            )
+            batch.save(embeddings, update_index=False)
+            processed += len(notes)
+            done, total = embedding_models.coverage(model)
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"{done}/{total} ({processed / elapsed:.1f} notes/s)")
+
+        self.stdout.write(f"{processed} note(s) encodée(s) avec {model.model_id}")
+        if not options['no_activate']:
+            self._activate(options)
+
+    def _activate(self, options):
+        model = self._migrating()
+        try:
+            model = embedding_models.activate(model, force=options['force'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"{model.model_id} est le modèle actif ; "
+            f"supprimer les anciens passages avec : migrate_embeddings cleanup"
+        ))
+
+    def _abort(self, options):
+        model = self._migrating()
+        model.status = EmbeddingModel.RETIRED
+        model.save(update_fields=['status'])
+        embedding_models.reset()
+        deleted, _ = NoteChunk.objects.filter(model_id=model.model_id).delete()
+        self.stdout.write(f"Migration vers {model.model_id} abandonnée, {deleted} passage(s) supprimé(s)")
+
+    def _cleanup(self, options):
+        serving = [model.model_id for model in embedding_models.serving_models()]
+        deleted, _ = NoteChunk.objects.exclude(model_id__in=serving).delete()
+        self.stdout.write(f"{deleted} passage(s) de modèles retirés supprimé(s)")
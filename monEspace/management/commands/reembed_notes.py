@@ -0,0 +1,133 @@
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from monEspace.models import Note
+from monEspace.embedding_cache import encode_stats
+from monEspace.services import NoteEmbeddingBatch, encode_texts
+from monEspace.vector_index import note_index_cache
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _encode(texts, batch_size):
+    from monEspace.services import encode_texts
+    return np.asarray(encode_texts(texts, batch_size=batch_size), dtype=np.float32)
+
+
+class Command(BaseCommand):
+    help = "Recalcule par lots les embeddings des notes (changement de modèle, migration)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Reprend toutes les notes, pas seulement celles sans embedding à jour.")
+        parser.add_argument('--force', action='store_true',
+                            help="Ré-encode même les notes dont le texte n'a pas changé.")
+        parser.add_argument('--user', type=int, help="Limite aux notes d'un utilisateur.")
+        parser.add_argument('--chunk-size', type=int, default=512,
+                            help="Nombre de notes lues et écrites par lot.")
+        parser.add_argument('--batch-size', type=int, default=64,
+                            help="Taille des lots passés à model.encode.")
+        parser.add_argument('--workers', type=int, default=0,
+                            help="Nombre de processus d'encodage (0 : dans ce processus).")
+        parser.add_argument('--start-after', type=int, default=0,
+                            help="Ignore les notes dont l'id est inférieur ou égal.")
+        parser.add_argument('--checkpoint',
+                            help="Fichier où enregistrer le dernier id traité, relu au redémarrage.")
+
+    def handle(self, *args, **options):
+        checkpoint = Path(options['checkpoint']) if options['checkpoint'] else None
+        start_after = options['start_after']
+        if checkpoint and checkpoint.exists():
+            start_after = max(start_after, int(checkpoint.read_text().strip() or 0))
+            self.stdout.write(f"Reprise après la note {start_after}")
+
+        notes = Note.objects.filter(id__gt=start_after)
+        if not options['all']:
+            notes = notes.filter(embedding_stale=True)
+        if options['user']:
+            notes = notes.filter(user_id=options['user'])
+        notes = notes.order_by('id').prefetch_related('attachments')
+
+        total = notes.count()
+        if not total:
+            self.stdout.write("Aucune note à traiter")
+            return
+        self.stdout.write(f"{total} note(s) à traiter")
+
+        encode_stats.reset()
+        self.processed = 0
+        self.index_keys = set()
+        self.started = time.monotonic()
+        self.checkpoint = checkpoint
+        self.total = total
+
+        chunks = self._chunks(notes, options['chunk_size'])
+        batch_size = options['batch_size']
+        self.force = options['force']
+        try:
+            if options['workers'] > 0:
+                self._run_pool(chunks, batch_size, options['workers'])
+            else:
+                for chunk in chunks:
+                    batch = NoteEmbeddingBatch(chunk, force=self.force)
+                    embeddings = encode_texts(batch.missing_texts, batch_size=batch_size) if batch.missing_texts else []
+                    self._write(batch, embeddings)
+        except KeyboardInterrupt:
+            raise CommandError(f"Interrompu après {self.processed} note(s) ; relancer avec le même --checkpoint pour reprendre.")
+        finally:
+            for key in self.index_keys:
+                note_index_cache.invalidate(key)
+
+        elapsed = time.monotonic() - self.started
+        stats = encode_stats.snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.processed} note(s) ré-indexée(s) en {elapsed:.1f} s ({self.processed / elapsed:.1f} notes/s) ; "
+            f"{stats['encoded']} encodage(s), {stats['unchanged']} inchangée(s), {stats['cache_hits']} trouvée(s) en cache"
+        ))
+
+    def _chunks(self, notes, chunk_size):
+        chunk = []
+        for note in notes.iterator(chunk_size=chunk_size):
+            chunk.append(note)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _run_pool(self, chunks, batch_size, workers):
+        # Les lots sont écrits dans l'ordre de soumission pour que le point de
+        # reprise reste valide ; au plus deux lots en vol par processus.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+            pending = deque()
+            for chunk in chunks:
+                batch = NoteEmbeddingBatch(chunk, force=self.force)
+                future = pool.submit(_encode, batch.missing_texts, batch_size) if batch.missing_texts else None
+                pending.append((batch, future))
+                if len(pending) >= workers * 2:
+                    batch, future = pending.popleft()
+                    self._write(batch, future.result() if future else [])
+            while pending:
+                batch, future = pending.popleft()
+                self._write(batch, future.result() if future else [])
+
+    def _write(self, batch, embeddings):
+        # Les index en mémoire sont invalidés en une fois à la fin
+        for note in batch.save(embeddings, update_index=False):
+            self.index_keys.update(note_index_cache.keys_for(note))
+
+        self.processed += len(batch.notes)
+        if self.checkpoint:
+            self.checkpoint.write_text(str(batch.notes[-1].id))
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f"{self.processed}/{self.total} ({self.processed / elapsed:.1f} notes/s)")
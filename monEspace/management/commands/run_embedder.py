@@ -0,0 +1,49 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from monEspace.batching import MicroBatcher
+from monEspace.embedding_server import EmbeddingServer, socket_path
+from monEspace.embedding_backends import get_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Lance le serveur d'embeddings partagé : charge le modèle une seule fois "
+        "et répond aux workers web sur une socket Unix."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', help="Chemin de la socket (défaut : EMBEDDING_SOCKET_PATH).")
+        parser.add_argument('--max-batch-size', type=int, default=64)
+        parser.add_argument('--max-latency-ms', type=float, default=5.0,
+                            help="Attente maximale pour compléter un lot.")
+
+    def handle(self, *args, **options):
+        path = options['socket'] or socket_path()
+        if not path:
+            raise CommandError("Aucune socket configurée (EMBEDDING_SOCKET_PATH ou --socket).")
+
+        backend = get_backend()
+        backend.encode(["préchauffage"])
+        batcher = MicroBatcher(
+            lambda texts: backend.encode(texts, batch_size=len(texts)),
+            max_batch_size=options['max_batch_size'],
+            max_latency=options['max_latency_ms'] / 1000,
+            name='embedder-batcher',
+        )
+
+        server = EmbeddingServer(path, batcher, backend.model_id)
+        self.stdout.write(f"Serveur d'embeddings ({backend.model_id}) à l'écoute sur {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            stats = batcher.stats.snapshot()
+            self.stdout.write(
+                f"Arrêt du serveur d'embeddings : {stats['items']} texte(s) en {stats['batches']} lot(s), "
+                f"taille moyenne {stats['mean_batch_size']:.1f}, attente moyenne {stats['mean_wait_ms']:.1f} ms"
+            )
+        finally:
+            server.server_close()
+            if os.path.exists(path):
+                os.unlink(path)
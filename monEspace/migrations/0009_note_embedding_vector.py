@@ -0,0 +1,51 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:12
+
+import numpy as np
+import pgvector.django
+from django.db import migrations
+
+
+EMBEDDING_DIM = 768
+
+
+def copy_embeddings_to_vector(apps, schema_editor):
+    Note = apps.get_model("monEspace", "Note")
+    batch = []
+    notes = Note.objects.filter(embedding__isnull=False).only("id", "embedding")
+    for note in notes.iterator(chunk_size=500):
+        vector = np.frombuffer(bytes(note.embedding), dtype=np.float32)
+        if vector.shape[0] != EMBEDDING_DIM:
+            continue
+        note.embedding_vector = vector
+        batch.append(note)
+        if len(batch) >= 500:
+            Note.objects.bulk_update(batch, ["embedding_vector"])
+            batch = []
+    if batch:
+        Note.objects.bulk_update(batch, ["embedding_vector"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0008_chatsession_chatmessage"),
+    ]
+
+    operations = [
+        pgvector.django.VectorExtension(),
+        migrations.AddField(
+            model_name="note",
+            name="embedding_vector",
+            field=pgvector.django.VectorField(blank=True, dimensions=768, null=True),
+        ),
+        migrations.RunPython(copy_embeddings_to_vector, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="note",
+            index=pgvector.django.HnswIndex(
+                ef_construction=64,
+                fields=["embedding_vector"],
+                m=16,
+                name="note_embedding_hnsw",
+                opclasses=["vector_cosine_ops"],
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.0.6 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def mark_existing_embeddings_fresh(apps, schema_editor):
+    Note = apps.get_model("monEspace", "Note")
+    Note.objects.filter(embedding__isnull=False).update(embedding_stale=False)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0009_note_embedding_vector"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="note",
+            name="embedding_stale",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(mark_existing_embeddings_fresh, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name="EmbeddingJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveIntegerField(default=1)),
+                ("run_after", models.DateTimeField(db_index=True)),
+                ("locked_until", models.DateTimeField(blank=True, null=True)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "note",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="embedding_job",
+                        to="monEspace.note",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0010_note_embedding_stale_embeddingjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ContentEmbedding",
+            fields=[
+                (
+                    "fingerprint",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("embedding", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="note",
+            name="embedding_fingerprint",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,111 @@
+# Generated by Django 5.0.6 on 2026-10-18 16:40
+
+import django.db.models.deletion
+import pgvector.django.indexes
+import pgvector.django.vector
+from bs4 import BeautifulSoup
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_whole_note_chunks(apps, schema_editor):
+    # Un passage couvrant toute la note, avec l'embedding existant, pour que la
+    # recherche fonctionne tout de suite ; les notes sont marquées à recalculer
+    # et une tâche est créée pour chacune, pour qu'embedding_worker les
+    # découpe (ou reembed_notes, plus rapide sur une grosse base).
+    Note = apps.get_model("monEspace", "Note")
+    NoteChunk = apps.get_model("monEspace", "NoteChunk")
+    EmbeddingJob = apps.get_model("monEspace", "EmbeddingJob")
+    notes = Note.objects.filter(embedding__isnull=False).only(
+        "id", "content", "embedding", "embedding_vector"
+    )
+    batch = []
+    for note in notes.iterator(chunk_size=500):
+        text = BeautifulSoup(note.content, "html.parser").get_text()
+        batch.append(
+            NoteChunk(
+                note_id=note.id,
+                position=0,
+                start=0,
+                end=len(text),
+                text=text,
+                embedding=note.embedding,
+                embedding_vector=note.embedding_vector,
+            )
+        )
+        if len(batch) >= 500:
+            NoteChunk.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        NoteChunk.objects.bulk_create(batch)
+    Note.objects.update(embedding_stale=True, embedding_fingerprint="")
+    now = timezone.now()
+    jobs = []
+    for note_id in Note.objects.values_list("id", flat=True).iterator(chunk_size=500):
+        jobs.append(EmbeddingJob(note_id=note_id, run_after=now))
+        if len(jobs) >= 500:
+            EmbeddingJob.objects.bulk_create(jobs, ignore_conflicts=True)
+            jobs = []
+    if jobs:
+        EmbeddingJob.objects.bulk_create(jobs, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0011_note_embedding_fingerprint_contentembedding"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NoteChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("position", models.PositiveIntegerField()),
+                ("start", models.PositiveIntegerField()),
+                ("end", models.PositiveIntegerField()),
+                ("text", models.TextField()),
+                ("embedding", models.BinaryField(blank=True, null=True)),
+                (
+                    "embedding_vector",
+                    pgvector.django.vector.VectorField(
+                        blank=True, dimensions=768, null=True
+                    ),
+                ),
+                (
+                    "note",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="chunks",
+                        to="monEspace.note",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["note", "position"],
+                "indexes": [
+                    pgvector.django.indexes.HnswIndex(
+                        ef_construction=64,
+                        fields=["embedding_vector"],
+                        m=16,
+                        name="notechunk_embedding_hnsw",
+                        opclasses=["vector_cosine_ops"],
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="notechunk",
+            constraint=models.UniqueConstraint(
+                fields=("note", "position"), name="unique_note_chunk_position"
+            ),
+        ),
+        migrations.RunPython(create_whole_note_chunks, migrations.RunPython.noop),
+    ]
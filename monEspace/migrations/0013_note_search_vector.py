@@ -0,0 +1,55 @@
+# Generated by Django 5.0.6 on 2026-10-19 09:30
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from bs4 import BeautifulSoup
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import Value
+
+
+def populate_search_vector(apps, schema_editor):
+    Note = apps.get_model("monEspace", "Note")
+    Attachment = apps.get_model("monEspace", "Attachment")
+    attachments = {}
+    for note_id, file_type, name in Attachment.objects.values_list(
+        "note_id", "file_type", "file"
+    ):
+        attachments.setdefault(note_id, []).append(f"{file_type} {name}")
+
+    for note in Note.objects.only("id", "title", "content").iterator(chunk_size=500):
+        text = BeautifulSoup(note.content, "html.parser").get_text()
+        Note.objects.filter(pk=note.pk).update(
+            search_vector=(
+                SearchVector(Value(note.title), weight="A", config="french")
+                + SearchVector(Value(text), weight="B", config="french")
+                + SearchVector(
+                    Value(" ".join(attachments.get(note.pk, []))),
+                    weight="C",
+                    config="french",
+                )
+            )
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0012_notechunk"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="note",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                blank=True, null=True
+            ),
+        ),
+        migrations.RunPython(populate_search_vector, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="note",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="note_search_vector_gin"
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-19 10:15
+
+from bs4 import BeautifulSoup
+from django.db import migrations, models
+
+
+def populate_content_text(apps, schema_editor):
+    Note = apps.get_model("monEspace", "Note")
+    batch = []
+    for note in Note.objects.only("id", "content").iterator(chunk_size=500):
+        note.content_text = BeautifulSoup(note.content or "", "html.parser").get_text()
+        batch.append(note)
+        if len(batch) >= 500:
+            Note.objects.bulk_update(batch, ["content_text"])
+            batch = []
+    if batch:
+        Note.objects.bulk_update(batch, ["content_text"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0013_note_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="note",
+            name="content_text",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.RunPython(populate_content_text, migrations.RunPython.noop),
+    ]
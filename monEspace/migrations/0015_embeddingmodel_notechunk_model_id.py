@@ -0,0 +1,145 @@
+# Generated by Django 5.0.6 on 2026-10-19 14:05
+
+import struct
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+# En-tête des embeddings stockés, tel qu'écrit à cette migration : magic,
+# version, dtype, dimension, longueur de l'identifiant du modèle (suivi de
+# l'identifiant). Recopié ici pour que la migration ne dépende pas du code
+# de l'application.
+EMBEDDING_HEADER = struct.Struct("<3sBBIB")
+
+
+def read_embedding_header(data):
+    """
+    (model_id, dim) d'un embedding stocké ; les float32 bruts sans en-tête
+    n'ont pas de modèle connu.
+    """
+    data = bytes(data)
+    if len(data) < EMBEDDING_HEADER.size or data[:3] != b"MFE":
+        return "", len(data) // 4
+    _, _, _, dim, model_len = EMBEDDING_HEADER.unpack_from(data)
+    offset = EMBEDDING_HEADER.size
+    return data[offset:offset + model_len].decode("utf-8"), dim
+
+
+def populate_chunk_models(apps, schema_editor):
+    # Le modèle et la dimension de chaque passage sont lus dans l'en-tête de
+    # son embedding ; le modèle le plus fréquent devient le modèle actif.
+    NoteChunk = apps.get_model("monEspace", "NoteChunk")
+    EmbeddingModel = apps.get_model("monEspace", "EmbeddingModel")
+    default_model = getattr(settings, "EMBEDDING_MODEL_NAME", "all-mpnet-base-v2")
+    counts = Counter()
+    dims = {}
+    batch = []
+    for chunk in NoteChunk.objects.only("id", "embedding").iterator(chunk_size=500):
+        model_id, dim = read_embedding_header(chunk.embedding) if chunk.embedding else ("", 768)
+        chunk.model_id = model_id or default_model
+        chunk.dim = dim
+        counts[chunk.model_id] += 1
+        dims.setdefault(chunk.model_id, chunk.dim)
+        batch.append(chunk)
+        if len(batch) >= 500:
+            NoteChunk.objects.bulk_update(batch, ["model_id", "dim"])
+            batch = []
+    if batch:
+        NoteChunk.objects.bulk_update(batch, ["model_id", "dim"])
+
+    if counts:
+        model_id, _ = counts.most_common(1)[0]
+        EmbeddingModel.objects.create(
+            model_id=model_id,
+            backend="sentence-transformers",
+            config={"model_name": model_id},
+            dim=dims[model_id],
+            status="active",
+            activated_at=timezone.now(),
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0014_note_content_text"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmbeddingModel",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model_id", models.CharField(max_length=100, unique=True)),
+                ("backend", models.CharField(max_length=50)),
+                ("config", models.JSONField(default=dict)),
+                ("dim", models.PositiveIntegerField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("active", "Actif"),
+                            ("migrating", "En cours de migration"),
+                            ("retired", "Retiré"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("activated_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("status", "active")),
+                        fields=("status",),
+                        name="single_active_embedding_model",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("status", "migrating")),
+                        fields=("status",),
+                        name="single_migrating_embedding_model",
+                    ),
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="notechunk",
+            name="model_id",
+            field=models.CharField(default="", max_length=100),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="notechunk",
+            name="dim",
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_chunk_models, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name="notechunk",
+            name="unique_note_chunk_position",
+        ),
+        migrations.AddConstraint(
+            model_name="notechunk",
+            constraint=models.UniqueConstraint(
+                fields=("note", "model_id", "position"),
+                name="unique_note_chunk_model_position",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notechunk",
+            index=models.Index(
+                fields=["model_id", "note"], name="notechunk_model_note_idx"
+            ),
+        ),
+    ]
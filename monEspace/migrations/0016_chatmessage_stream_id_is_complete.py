@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-19 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0015_embeddingmodel_notechunk_model_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="stream_id",
+            field=models.UUIDField(blank=True, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name="chatmessage",
+            name="is_complete",
+            field=models.BooleanField(default=True),
+        ),
+    ]
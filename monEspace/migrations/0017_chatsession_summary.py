@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0016_chatmessage_stream_id_is_complete"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatsession",
+            name="summary",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="chatsession",
+            name="summary_until",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.0.6 on 2026-10-19 18:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounts", "0005_visitorsubjectcourse_teacher"),
+        ("monEspace", "0017_chatsession_summary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CachedAnswer",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("notes_key", models.CharField(max_length=64)),
+                ("query", models.TextField()),
+                ("embedding", models.BinaryField()),
+                ("model_id", models.CharField(max_length=100)),
+                ("answer", models.TextField()),
+                ("generation_seconds", models.FloatField(default=0.0)),
+                ("hits", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("expires_at", models.DateTimeField()),
+                (
+                    "course",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="accounts.visitorsubjectcourse",
+                    ),
+                ),
+                (
+                    "notes",
+                    models.ManyToManyField(
+                        related_name="cached_answers", to="monEspace.note"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["course", "notes_key", "expires_at"],
+                        name="cachedanswer_lookup_idx",
+                    )
+                ],
+            },
+        ),
+    ]
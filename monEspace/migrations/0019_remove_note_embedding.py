@@ -0,0 +1,24 @@
+# Generated by Django 5.0.6 on 2026-10-20 09:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0018_cachedanswer"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="note",
+            name="note_embedding_hnsw",
+        ),
+        migrations.RemoveField(
+            model_name="note",
+            name="embedding_vector",
+        ),
+        migrations.RemoveField(
+            model_name="note",
+            name="embedding",
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-20 11:05
+
+import pgvector.django.halfvec
+import pgvector.django.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("monEspace", "0019_remove_note_embedding"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="notechunk",
+            name="notechunk_embedding_hnsw",
+        ),
+        migrations.AlterField(
+            model_name="notechunk",
+            name="embedding_vector",
+            field=pgvector.django.halfvec.HalfVectorField(blank=True, dimensions=768, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="notechunk",
+            index=pgvector.django.indexes.HnswIndex(
+                ef_construction=64,
+                fields=["embedding_vector"],
+                m=16,
+                name="notechunk_embedding_hnsw",
+                opclasses=["halfvec_cosine_ops"],
+            ),
+        ),
+    ]
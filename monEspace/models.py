@@ -1,28 +1,178 @@
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from accounts.models import VisitorSubjectCourse
+from pgvector.django import HalfVectorField, HnswIndex
 import numpy as np
+from .embedding_format import decode_embedding, encode_embedding
+from .text import html_to_text
+
+# Dimension des embeddings produits par all-mpnet-base-v2
+EMBEDDING_DIM = 768
 
 class Note(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
     content = models.TextField(blank=True)
+    # Contenu sans HTML, recalculé à chaque sauvegarde (indexation, extraits, chat)
+    content_text = models.TextField(blank=True, default='', editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    embedding = models.BinaryField(null=True, blank=True)
+    # Les embeddings sont ceux des passages (NoteChunk), seuls lus par la recherche.
+    # True tant que les passages ne reflètent pas la dernière version de la note
+    embedding_stale = models.BooleanField(default=True)
+    # Empreinte (sha256) du texte à partir duquel les passages ont été calculés
+    embedding_fingerprint = models.CharField(max_length=64, blank=True, default='')
+    # tsvector 'french' : titre (poids A), contenu sans HTML (B), pièces jointes (C)
+    search_vector = SearchVectorField(null=True, blank=True)
     course = models.ForeignKey(VisitorSubjectCourse, on_delete=models.CASCADE, related_name='notes', null=True)
 
-    def set_embedding(self, embedding):
-        self.embedding = np.array(embedding).tobytes()
+    class Meta:
+        indexes = [
+            GinIndex(name='note_search_vector_gin', fields=['search_vector']),
+        ]
 
-    def get_embedding(self):
-        return np.frombuffer(self.embedding, dtype=np.float32) if self.embedding else None
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.content_text = html_to_text(self.content)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'content_text'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
+@receiver(post_delete, sender=Note)
+def remove_note_from_index(sender, instance, **kwargs):
+    from .vector_index import note_index_cache
+    note_index_cache.remove(instance)
+
+class EmbeddingModel(models.Model):
+    """
+    Modèle d'embeddings connu de l'application. Un seul est actif : c'est lui
+    qui sert les recherches. Pendant une migration vers un nouveau modèle
+    (commande migrate_embeddings), celui-ci est en cours de migration : ses
+    passages sont calculés en arrière-plan et tenus à jour, puis il devient
+    actif d'un coup quand toutes les notes sont couvertes.
+    """
+    ACTIVE = 'active'
+    MIGRATING = 'migrating'
+    RETIRED = 'retired'
+    STATUS_CHOICES = (
+        (ACTIVE, 'Actif'),
+        (MIGRATING, 'En cours de migration'),
+        (RETIRED, 'Retiré'),
+    )
+
+    model_id = models.CharField(max_length=100, unique=True)
+    # Moteur et paramètres pour recréer le modèle : create_backend(backend, **config)
+    backend = models.CharField(max_length=50)
+    config = models.JSONField(default=dict)
+    dim = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['status'], condition=models.Q(status='active'), name='single_active_embedding_model'
+            ),
+            models.UniqueConstraint(
+                fields=['status'], condition=models.Q(status='migrating'), name='single_migrating_embedding_model'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.model_id} ({self.status})"
+
+class NoteChunk(models.Model):
+    """
+    Passage d'une note (texte brut, sans HTML) indexé avec son propre
+    embedding. start et end sont des positions de caractères dans le texte
+    brut de la note ; les passages successifs se chevauchent. Pendant une
+    migration de modèle, une note a un jeu de passages par modèle.
+    """
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='chunks')
+    # Modèle et dimension de l'embedding : seuls des vecteurs du même modèle sont comparés
+    model_id = models.CharField(max_length=100)
+    dim = models.PositiveIntegerField()
+    position = models.PositiveIntegerField()
+    start = models.PositiveIntegerField()
+    end = models.PositiveIntegerField()
+    text = models.TextField()
+    embedding = models.BinaryField(null=True, blank=True)
+    # Copie en demi-précision pour la recherche dans PostgreSQL (pgvector >= 0.7)
+    embedding_vector = HalfVectorField(dimensions=EMBEDDING_DIM, null=True, blank=True)
+
+    class Meta:
+        ordering = ['note', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['note', 'model_id', 'position'], name='unique_note_chunk_model_position'),
+        ]
+        indexes = [
+            models.Index(fields=['model_id', 'note'], name='notechunk_model_note_idx'),
+            HnswIndex(
+                name='notechunk_embedding_hnsw',
+                fields=['embedding_vector'],
+                m=16,
+                ef_construction=64,
+                opclasses=['halfvec_cosine_ops'],
+            ),
+        ]
+
+    def set_embedding(self, embedding, model_id):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        self.embedding = encode_embedding(
+            embedding,
+            dtype=getattr(settings, 'EMBEDDING_STORAGE_DTYPE', 'float16'),
+            model_id=model_id,
+        )
+        self.embedding_vector = embedding if embedding.shape[0] == EMBEDDING_DIM else None
+        self.model_id = model_id
+        self.dim = embedding.shape[0]
+
+    def get_embedding(self):
+        return decode_embedding(self.embedding) if self.embedding else None
+
+    def __str__(self):
+        return f"{self.note.title} [{self.start}:{self.end}]"
+
+class ContentEmbedding(models.Model):
+    """
+    Cache global adressé par contenu : empreinte du texte prétraité (modèle
+    compris) -> embedding. Un même support de cours copié dans les notes de
+    plusieurs élèves n'est encodé qu'une fois.
+    """
+    fingerprint = models.CharField(max_length=64, primary_key=True)
+    embedding = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def get_embedding(self):
+        return decode_embedding(self.embedding)
+
+class EmbeddingJob(models.Model):
+    """
+    Demande de (re)calcul de l'embedding d'une note, traitée par la commande
+    embedding_worker. Une seule tâche par note : les modifications successives
+    repoussent run_after au lieu de créer de nouvelles tâches.
+    """
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, related_name='embedding_job')
+    version = models.PositiveIntegerField(default=1)
+    run_after = models.DateTimeField(db_index=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Embedding job for note {self.note_id}"
+
 class Attachment(models.Model):
     note = models.ForeignKey(Note, related_name='attachments', on_delete=models.CASCADE)
     file = models.FileField(upload_to='attachments/')
@@ -52,6 +202,10 @@ class ChatSession(models.Model):
     course = models.ForeignKey(VisitorSubjectCourse, on_delete=models.CASCADE, null=True, blank=True)
     started_at = models.DateTimeField(auto_now_add=True)
     ended_at = models.DateTimeField(null=True, blank=True)
+    # Résumé des échanges sortis de la fenêtre envoyée au modèle, mis à jour
+    # par lots (chat_context), jusqu'au message summary_until (id) inclus
+    summary = models.TextField(blank=True, default='')
+    summary_until = models.BigIntegerField(null=True, blank=True)
 
 class ChatMessage(models.Model):
     ROLE_CHOICES = (
@@ -62,4 +216,51 @@ class ChatMessage(models.Model):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    related_note = models.ForeignKey(Note, on_delete=models.SET_NULL, null=True, blank=True)
\ No newline at end of file
+    related_note = models.ForeignKey(Note, on_delete=models.SET_NULL, null=True, blank=True)
+    # Réponse en streaming : identifiant du flux (reprise avec Last-Event-ID)
+    # et état, le contenu étant enregistré au fil de la génération
+    stream_id = models.UUIDField(null=True, blank=True, unique=True)
+    is_complete = models.BooleanField(default=True)
+
+class CachedAnswer(models.Model):
+    """
+    Réponse du chat réutilisable pour une question proche (similarité des
+    embeddings) posée dans le même cours, avec le même ensemble de notes
+    retrouvées (notes_key). Supprimée dès qu'une de ces notes change, et
+    ignorée après expires_at.
+    """
+    course = models.ForeignKey(VisitorSubjectCourse, on_delete=models.CASCADE, null=True, blank=True)
+    notes = models.ManyToManyField(Note, related_name='cached_answers')
+    # Empreinte des identifiants des notes retrouvées, triés
+    notes_key = models.CharField(max_length=64)
+    query = models.TextField()
+    embedding = models.BinaryField()
+    model_id = models.CharField(max_length=100)
+    answer = models.TextField()
+    # Durée de la génération d'origine : temps gagné à chaque réutilisation
+    generation_seconds = models.FloatField(default=0.0)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['course', 'notes_key', 'expires_at'], name='cachedanswer_lookup_idx'),
+        ]
+
+    def get_embedding(self):
+        return decode_embedding(self.embedding)
+
+    def __str__(self):
+        return self.query[:50]
+
+@receiver(post_save, sender=Note)
+@receiver(pre_delete, sender=Note)
+def invalidate_cached_answers(sender, instance, update_fields=None, **kwargs):
+    # Cache des réponses désactivé (par défaut) : rien à invalider
+    if not getattr(settings, 'CHAT_ANSWER_CACHE', False):
+        return
+    # Les sauvegardes qui ne touchent que l'embedding ne changent pas les réponses
+    if update_fields is not None and not {'title', 'content', 'course'} & set(update_fields):
+        return
+    CachedAnswer.objects.filter(notes=instance).delete()
@@ -0,0 +1,77 @@
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+class SearchScope:
+    """
+    Notes sur lesquelles porte une recherche.
+
+    shards : clés des index à interroger, ('user', id) pour toutes les notes
+    d'un utilisateur ou ('course', id) pour toutes les notes d'un cours.
+    Les filtres (auteur, période de création) sont appliqués dans chaque
+    shard, au moment de la recherche : ils réduisent les candidats au lieu
+    de trier les k premiers résultats.
+    """
+
+    def __init__(self, shards, author_id=None, date_from=None, date_to=None):
+        self.shards = list(shards)
+        self.author_id = author_id
+        # Bornes [created_after, created_before[ ; date_to est inclus
+        self.created_after = _start_of_day(date_from) if date_from else None
+        self.created_before = _start_of_day(date_to + datetime.timedelta(days=1)) if date_to else None
+
+    @property
+    def has_filters(self):
+        return self.author_id is not None or self.created_after is not None or self.created_before is not None
+
+    def q(self, prefix=''):
+        """
+        Condition équivalente pour l'ORM ; prefix='note__' pour NoteChunk.
+        """
+        user_ids = [key for kind, key in self.shards if kind == 'user']
+        course_ids = [key for kind, key in self.shards if kind == 'course']
+        condition = Q(**{f'{prefix}user_id__in': user_ids}) | Q(**{f'{prefix}course_id__in': course_ids})
+        if self.author_id is not None:
+            condition &= Q(**{f'{prefix}user_id': self.author_id})
+        if self.created_after is not None:
+            condition &= Q(**{f'{prefix}created_at__gte': self.created_after})
+        if self.created_before is not None:
+            condition &= Q(**{f'{prefix}created_at__lt': self.created_before})
+        return condition
+
+    def matches(self, user_id, created_ts):
+        """
+        Même filtre sur les métadonnées gardées par les index en mémoire
+        (auteur, date de création en timestamp).
+        """
+        if self.author_id is not None and user_id != self.author_id:
+            return False
+        if self.created_after is not None and created_ts < self.created_after.timestamp():
+            return False
+        if self.created_before is not None and created_ts >= self.created_before.timestamp():
+            return False
+        return True
+
+
+def search_scope(user, course=None, author=None, date_from=None, date_to=None):
+    """
+    Un enseignant cherche dans les notes des cours qu'il encadre (un shard
+    par cours, résultats fusionnés), un étudiant dans ses propres notes.
+    course restreint à un cours ; author (id d'utilisateur) n'a de sens que
+    pour un enseignant, un étudiant ne voyant que ses notes.
+    """
+    if hasattr(user, 'teacher'):
+        course_ids = user.teacher.taught_courses.values_list('id', flat=True)
+        if course is not None:
+            course_ids = course_ids.filter(id=course.id)
+        return SearchScope([('course', course_id) for course_id in course_ids],
+                           author_id=author, date_from=date_from, date_to=date_to)
+    if course is not None:
+        return SearchScope([('course', course.id)], author_id=user.id, date_from=date_from, date_to=date_to)
+    return SearchScope([('user', user.id)], date_from=date_from, date_to=date_to)
@@ -57,6 +57,13 @@ class NoteSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'content', 'created_at', 'updated_at', 'attachments', 'course', 'todo_items']
         read_only_fields = ['id', 'created_at', 'updated_at', 'attachments', 'todo_items']
 
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sous-ensemble de champs à sérialiser (paramètre fields= de la recherche)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     def create(self, validated_data):
         course = validated_data.pop('course', None)
         note = Note.objects.create(**validated_data)
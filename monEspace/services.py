@@ -1,76 +1,501 @@
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
-from .models import Note
-import re
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-import nltk
-from bs4 import BeautifulSoup
+import hashlib
+import os
+import threading
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Value
+from pgvector import HalfVector
+from pgvector.django import CosineDistance
+from .models import ContentEmbedding, Note, NoteChunk, EMBEDDING_DIM
+from .chunking import split_into_chunks
+from .embedding_format import encode_embedding
+from .search_scope import search_scope
+from .vector_index import best_chunk_per_note, merge_hits, note_index_cache
+from .embedding_cache import content_embedding_cache, encode_stats, normalize_query, query_embedding_cache
+from .embedding_backends import get_backend
+from .embedding_models import active_model, backend_for, serving_models
+from .embedding_server import embedding_client
+from .batching import MicroBatcher
+from .text import normalize_text
+from django.db import transaction
 
 # nltk.download('punkt')
 # nltk.download('stopwords')
 
-model = SentenceTransformer('all-mpnet-base-v2')
+# Regroupe les petits encodages concurrents du processus (recherches, chat,
+# sauvegardes) en un seul appel au moteur, un regroupement par modèle.
+# Recréés après un fork : les threads du processus parent n'existent pas
+# dans l'enfant.
+_batchers = {}
+_batchers_pid = None
+_batcher_lock = threading.Lock()
 
-def clean_html(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    return soup.get_text()
+def get_batcher(model=None):
+    global _batchers, _batchers_pid
+    model = model or active_model()
+    batcher = _batchers.get(model.model_id) if _batchers_pid == os.getpid() else None
+    if batcher is None:
+        with _batcher_lock:
+            if _batchers_pid != os.getpid():
+                _batchers, _batchers_pid = {}, os.getpid()
+            batcher = _batchers.get(model.model_id)
+            if batcher is None:
+                backend = backend_for(model)
+                max_batch_size = getattr(settings, 'EMBEDDING_BATCH_MAX_SIZE', 32)
+                batcher = _batchers[model.model_id] = MicroBatcher(
+                    lambda texts: backend.encode(texts, batch_size=max_batch_size),
+                    max_batch_size=max_batch_size,
+                    max_latency=getattr(settings, 'EMBEDDING_BATCH_MAX_LATENCY_MS', 5) / 1000,
+                    name='embedding-batcher',
+                )
+    return batcher
+
+def encode_texts(texts, batch_size=32, model=None):
+    """
+    Encode des textes déjà prétraités avec model (EmbeddingModel, par défaut
+    le modèle actif), via le serveur d'embeddings partagé (run_embedder) s'il
+    tourne avec ce modèle, sinon avec un moteur chargé dans ce processus.
+    Les petits appels passent par le regroupement en lots du processus ; les
+    gros lots (ré-indexation) vont directement au moteur.
+    """
+    model = model or active_model()
+    embeddings = embedding_client.encode(texts, model.model_id)
+    if embeddings is not None:
+        return embeddings
+    max_batch_size = getattr(settings, 'EMBEDDING_BATCH_MAX_SIZE', 32)
+    if getattr(settings, 'EMBEDDING_MICRO_BATCHING', True) and 0 < len(texts) < max_batch_size:
+        futures = get_batcher(model).submit_many(texts)
+        return np.vstack([future.result() for future in futures])
+    return backend_for(model).encode(texts, batch_size=batch_size)
+
+def warm_up():
+    """
+    Charge le modèle, FAISS et les ressources NLTK avant de servir des requêtes
+    (appelé au démarrage du serveur si EMBEDDING_WARMUP est activé). Si le
+    serveur d'embeddings partagé tourne, le modèle n'est pas chargé ici.
+
+    Appelé à l'import de asgi.py/wsgi.py : aucune requête SQL ici. Sous
+    uvicorn l'import a lieu dans la boucle asyncio (l'ORM y est interdit), et
+    un serveur WSGI qui précharge l'application partagerait la connexion
+    ouverte entre ses workers. On préchauffe donc le moteur configuré, sans
+    passer par active_model() ; backend_for() le réutilise pour le modèle
+    actif quand c'est le même.
+    """
+    import faiss  # noqa: F401
+    backend = get_backend()
+    texts = [preprocess_text("préchauffage")]
+    if embedding_client.encode(texts, backend.model_id) is None:
+        backend.encode(texts)
 
 def preprocess_text(text):
-    # Nettoyer le HTML
-    text = clean_html(text)
-    
-    # Convertir en minuscules et supprimer les caractères spéciaux
-    text = re.sub(r'[^\w\s]', '', text.lower())
-    
-    # Tokenization et suppression des stop words
-    stop_words = set(stopwords.words('french'))
-    word_tokens = word_tokenize(text)
-    filtered_text = [w for w in word_tokens if not w in stop_words]
-    
-    return ' '.join(filtered_text)
+    # text est du texte brut : le HTML des notes est nettoyé à la sauvegarde
+    return normalize_text(text)
 
 def generate_embedding(text):
     preprocessed_text = preprocess_text(text)
-    return model.encode(preprocessed_text)
+    return encode_texts([preprocessed_text])[0]
+
+def embed_query(query):
+    """
+    Embedding d'une requête de recherche, mis en cache. La clé est d'abord le
+    texte normalisé, puis le texte prétraité : deux requêtes qui ne diffèrent
+    que par la casse, la ponctuation ou des mots vides partagent leur vecteur.
+    """
+    model = active_model()
+    model_id = model.model_id
+    raw_key = f"{model_id}:raw:{normalize_query(query)}"
+    embedding = query_embedding_cache.get(raw_key)
+    if embedding is not None:
+        return embedding
+
+    preprocessed_text = preprocess_text(query)
+    key = f"{model_id}:text:{preprocessed_text}"
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        embedding = encode_texts([preprocessed_text], model=model)[0]
+        query_embedding_cache.set(key, embedding)
+    query_embedding_cache.set(raw_key, embedding)
+    return embedding
+
+def generate_embeddings(texts, batch_size=32):
+    preprocessed_texts = [preprocess_text(text) for text in texts]
+    return encode_texts(preprocessed_texts, batch_size=batch_size)
+
+def note_document(note):
+    """
+    Texte indexable d'une note : (titre, contenu sans HTML, pièces jointes).
+    """
+    attachments = ' '.join(f"{attachment.file_type} {attachment.file.name}" for attachment in note.attachments.all())
+    return note.title, note.content_text, attachments
+
+def build_note_chunks(note, document=None):
+    """
+    Découpe le texte brut d'une note en passages. Renvoie des tuples
+    (début, fin, passage, texte à encoder) ; le titre et les pièces jointes
+    sont ajoutés au texte encodé de chaque passage pour garder le contexte.
+    """
+    title, text, attachments = document or note_document(note)
+    header = f"{title} {attachments}" if attachments else title
+    chunks = split_into_chunks(text) or [(0, 0, '')]
+    return [(start, end, passage, f"{header} {passage}") for start, end, passage in chunks]
+
+def search_vector_expression(title, text, attachments):
+    return (
+        SearchVector(Value(title), weight='A', config='french')
+        + SearchVector(Value(text), weight='B', config='french')
+        + SearchVector(Value(attachments), weight='C', config='french')
+    )
+
+def update_search_vector(note, document=None):
+    """
+    Met à jour le tsvector d'une note dès sa sauvegarde : la recherche plein
+    texte la trouve sans attendre le calcul de ses passages.
+    """
+    if connection.vendor == 'postgresql':
+        Note.objects.filter(pk=note.pk).update(
+            search_vector=search_vector_expression(*(document or note_document(note)))
+        )
+
+def content_fingerprint(preprocessed_text, model_id):
+    return hashlib.sha256(f"{model_id}\0{preprocessed_text}".encode('utf-8')).hexdigest()
+
+def _lookup_content_embeddings(fingerprints):
+    found = {}
+    for fingerprint in fingerprints:
+        embedding = content_embedding_cache.get(fingerprint)
+        if embedding is not None:
+            found[fingerprint] = embedding
+    missing = [fingerprint for fingerprint in fingerprints if fingerprint not in found]
+    if missing:
+        for entry in ContentEmbedding.objects.filter(fingerprint__in=missing):
+            embedding = entry.get_embedding()
+            content_embedding_cache.set(entry.fingerprint, embedding)
+            found[entry.fingerprint] = embedding
+    return found
+
+def _store_content_embeddings(embeddings_by_fingerprint, model_id):
+    dtype = getattr(settings, 'EMBEDDING_STORAGE_DTYPE', 'float16')
+    ContentEmbedding.objects.bulk_create(
+        [
+            ContentEmbedding(fingerprint=fingerprint, embedding=encode_embedding(embedding, dtype, model_id))
+            for fingerprint, embedding in embeddings_by_fingerprint.items()
+        ],
+        ignore_conflicts=True,
+    )
+    for fingerprint, embedding in embeddings_by_fingerprint.items():
+        content_embedding_cache.set(fingerprint, embedding)
+
+def embed_messages(texts, model=None):
+    """
+    Embeddings de messages du chat, gardés dans le cache mémoire des
+    requêtes (borné, avec expiration) et non dans ContentEmbedding : les
+    messages ne sont encodés qu'une fois par session sans remplir la base.
+    Les textes absents du cache sont encodés en un seul lot.
+    """
+    model = model or active_model()
+    preprocessed_texts = [preprocess_text(text) for text in texts]
+    keys = [f"{model.model_id}:text:{text}" for text in preprocessed_texts]
+    found = {}
+    missing = {}
+    for key, text in zip(keys, preprocessed_texts):
+        if key in found or key in missing:
+            continue
+        embedding = query_embedding_cache.get(key)
+        if embedding is None:
+            missing[key] = text
+        else:
+            found[key] = embedding
+    if missing:
+        for key, embedding in zip(missing, encode_texts(list(missing.values()), model=model)):
+            query_embedding_cache.set(key, embedding)
+            found[key] = embedding
+    return np.vstack([found[key] for key in keys])
+
+class NoteEmbeddingBatch:
+    """
+    Prépare le calcul des embeddings d'un lot de notes, passage par passage,
+    en évitant le modèle autant que possible :
+      - une note dont le texte prétraité n'a pas changé garde ses passages ;
+      - un passage déjà vu (cache par contenu) réutilise le vecteur connu ;
+      - les passages restants, dédoublonnés, sont dans missing_texts.
+    complete() reçoit les vecteurs de missing_texts et prépare les passages.
+
+    model : EmbeddingModel dont on calcule les passages (par défaut le modèle
+    actif). Pour un modèle en cours de migration, seuls ses passages sont
+    écrits : les champs de la note et les index de recherche restent ceux du
+    modèle actif.
+    """
+
+    def __init__(self, notes, force=False, model=None):
+        self.notes = list(notes)
+        self.model = model or active_model()
+        self.is_active = self.model.model_id == active_model().model_id
+        model_id = self.model.model_id
+        self.note_chunks = {}
+        self.fingerprints = {}
+        self.documents = {}
+        texts = {}
+        for note in self.notes:
+            self.documents[note.pk] = note_document(note)
+            chunks = []
+            for start, end, passage, text in build_note_chunks(note, self.documents[note.pk]):
+                text = preprocess_text(text)
+                fingerprint = content_fingerprint(text, model_id)
+                texts[fingerprint] = text
+                chunks.append((start, end, passage, fingerprint))
+            self.note_chunks[note.pk] = chunks
+            self.fingerprints[note.pk] = content_fingerprint(
+                '\n'.join(fingerprint for *_, fingerprint in chunks), model_id
+            )
+
+        # L'empreinte gardée sur la note est celle du modèle actif
+        self.unchanged = set()
+        if not force and self.is_active:
+            self.unchanged = {
+                note.pk for note in self.notes
+                if note.embedding_fingerprint == self.fingerprints[note.pk]
+            }
+        needed = {
+            fingerprint
+            for note in self.notes if note.pk not in self.unchanged
+            for *_, fingerprint in self.note_chunks[note.pk]
+        }
+        self.known = _lookup_content_embeddings(list(needed))
+        self.missing_fingerprints = [fingerprint for fingerprint in needed if fingerprint not in self.known]
+        self.missing_texts = [texts[fingerprint] for fingerprint in self.missing_fingerprints]
+        self.new_chunks = {}
+
+    def complete(self, embeddings=()):
+        model_id = self.model.model_id
+        computed = dict(zip(self.missing_fingerprints, embeddings))
+        if computed:
+            _store_content_embeddings(computed, model_id)
+        vectors = {**self.known, **computed}
+        encode_stats.record(
+            unchanged=len(self.unchanged),
+            cache_hits=len(self.known),
+            encoded=len(computed),
+        )
+
+        updated = []
+        for note in self.notes:
+            if self.is_active:
+                note.embedding_stale = False
+            if note.pk in self.unchanged:
+                continue
+            chunks = []
+            for position, (start, end, passage, fingerprint) in enumerate(self.note_chunks[note.pk]):
+                chunk = NoteChunk(note=note, position=position, start=start, end=end, text=passage)
+                chunk.set_embedding(vectors[fingerprint], model_id)
+                chunks.append(chunk)
+            self.new_chunks[note.pk] = chunks
+
+            if self.is_active:
+                note.embedding_fingerprint = self.fingerprints[note.pk]
+            updated.append(note)
+        return updated
+
+    def save(self, embeddings=(), update_index=True):
+        """
+        Enregistre le résultat du lot et renvoie les notes dont l'embedding a changé.
+        """
+        updated = self.complete(embeddings)
+        if updated:
+            with transaction.atomic():
+                if self.is_active:
+                    Note.objects.bulk_update(updated, ['embedding_stale', 'embedding_fingerprint'])
+                NoteChunk.objects.filter(note__in=updated, model_id=self.model.model_id).delete()
+                NoteChunk.objects.bulk_create([chunk for note in updated for chunk in self.new_chunks[note.pk]])
+                if self.is_active:
+                    for note in updated:
+                        update_search_vector(note, self.documents[note.pk])
+        if self.unchanged:
+            Note.objects.filter(pk__in=self.unchanged).update(embedding_stale=False)
+        if update_index and self.is_active:
+            for note in updated:
+                note_index_cache.update(
+                    note, [(chunk.id, chunk.get_embedding()) for chunk in self.new_chunks[note.pk]]
+                )
+        return updated
 
 def update_note_embedding(note):
-    content = f"{note.title} {clean_html(note.content)}"
-    for attachment in note.attachments.all():
-        content += f" {attachment.file_type} {attachment.file.name}"
-    
-    embedding = generate_embedding(content)
-    note.set_embedding(embedding)
-    note.save()
-
-def semantic_search(query, user):
-    query_embedding = generate_embedding(query)
-    notes = list(Note.objects.filter(user=user))
-    embeddings = [note.get_embedding() for note in notes if note.get_embedding() is not None]
-    
-    if not embeddings:
-        return []
+    update_note_embeddings([note])
 
-    embeddings_array = np.array(embeddings)
-    
-    faiss.normalize_L2(embeddings_array)
-    index = faiss.IndexFlatIP(embeddings_array.shape[1])
-    index.add(embeddings_array)
-    
-    k = min(3, len(embeddings))
-    scores, indices = index.search(np.array([query_embedding]), k)
-    
+def update_note_embeddings(notes, batch_size=32, force=False):
+    """
+    Recalcule les embeddings de plusieurs notes avec au plus un appel au
+    modèle, pour le modèle actif et, pendant une migration, pour le nouveau
+    modèle.
+    """
+    notes = list(notes)
+    for model in serving_models():
+        batch = NoteEmbeddingBatch(notes, force=force, model=model)
+        embeddings = encode_texts(batch.missing_texts, batch_size=batch_size, model=model) if batch.missing_texts else []
+        batch.save(embeddings)
+
+def _build_results(hits, scope):
+    """
+    hits : (note_id, score, chunk_id) par score décroissant. Le passage le plus
+    proche de la requête sert d'extrait. Les notes sont relues dans le
+    périmètre de recherche : une entrée périmée d'un index en mémoire (note
+    supprimée ou changée de cours) est ignorée. Une note trouvée par le plein
+    texte avant le calcul de ses passages (nouvelle ou modifiée) a pour extrait
+    le début de son contenu.
+    """
+    notes = Note.objects.filter(scope.q()).only('id', 'title').in_bulk([note_id for note_id, _, _ in hits])
+    chunks = NoteChunk.objects.only('id', 'text', 'start', 'end').in_bulk(
+        [chunk_id for _, _, chunk_id in hits if chunk_id is not None]
+    )
+    without_chunk = [note_id for note_id, _, chunk_id in hits if note_id in notes and chunk_id not in chunks]
+    texts = dict(Note.objects.filter(pk__in=without_chunk).values_list('id', 'content_text')) if without_chunk else {}
     results = []
-    for i, idx in enumerate(indices[0]):
-        note = notes[int(idx)]
-        score = float(scores[0][i])
-        clean_content = clean_html(note.content)
+    for note_id, score, chunk_id in hits:
+        note = notes.get(note_id)
+        if note is None:
+            continue
+        chunk = chunks.get(chunk_id)
+        if chunk is not None:
+            start, end, preview = chunk.start, chunk.end, chunk.text
+        else:
+            start, end, preview = (split_into_chunks(texts.get(note_id, '')) or [(0, 0, '')])[0]
         results.append({
             'id': note.id,
             'title': note.title,
-            'content_preview': clean_content[:100] + '...',
+            'content_preview': preview,
+            'passage': {'start': start, 'end': end},
             'score': score
         })
-    
-    return sorted(results, key=lambda x: x['score'], reverse=True)
\ No newline at end of file
+    return results
+
+def _faiss_hits(query_embedding, scope, k, note_ids=None):
+    # Un index par shard ; les filtres sont appliqués dans chaque index
+    hits_per_shard = []
+    for key in scope.shards:
+        index = note_index_cache.get(key)
+        if index is not None:
+            hits_per_shard.append(index.search(query_embedding, k, note_ids=note_ids, scope=scope))
+    return merge_hits(hits_per_shard, k)
+
+def _pgvector_hits(query_embedding, scope, k, note_ids=None):
+    # Le tri et le top-k des passages sont faits par PostgreSQL (index HNSW,
+    # distance cosinus), filtres compris ; on en lit quelques-uns de plus pour
+    # garder k notes. Seuls les passages du modèle actif sont comparés.
+    chunks = NoteChunk.objects.filter(
+        scope.q('note__'), model_id=active_model().model_id, embedding_vector__isnull=False
+    )
+    if note_ids is not None:
+        chunks = chunks.filter(note_id__in=note_ids)
+    overfetch = getattr(settings, 'NOTE_CHUNK_OVERFETCH', 4)
+    rows = (
+        chunks.annotate(distance=CosineDistance('embedding_vector', HalfVector(query_embedding)))
+        .order_by('distance')
+        .values_list('note_id', 'distance', 'id')[:k * overfetch]
+    )
+    return best_chunk_per_note(((note_id, 1.0 - distance, chunk_id) for note_id, distance, chunk_id in rows), k)
+
+def _vector_hits(query_embedding, scope, k, note_ids=None):
+    # La colonne pgvector a une dimension fixe : un modèle d'une autre
+    # dimension est servi par FAISS
+    backend = getattr(settings, 'NOTE_SEARCH_BACKEND', 'pgvector')
+    if backend == 'pgvector' and len(query_embedding) == EMBEDDING_DIM:
+        return _pgvector_hits(query_embedding, scope, k, note_ids)
+    return _faiss_hits(query_embedding, scope, k, note_ids)
+
+def _lexical_hits(query, scope, limit):
+    """
+    Candidats plein texte (index GIN sur search_vector) : [(note_id, rang ts_rank)].
+    """
+    if connection.vendor != 'postgresql':
+        return []
+    search_query = SearchQuery(query, config='french', search_type='websearch')
+    notes = Note.objects.filter(scope.q(), search_vector=search_query)
+    return list(
+        notes.annotate(rank=SearchRank('search_vector', search_query))
+        .order_by('-rank')
+        .values_list('id', 'rank')[:limit]
+    )
+def _best_lexical_chunks(query, note_ids):
+    """
+    Pour des notes trouvées uniquement par le plein texte, choisit le passage
+    qui contient le mieux les termes de la requête.
+    """
+    if not note_ids:
+        return {}
+    search_query = SearchQuery(query, config='french', search_type='websearch')
+    rows = (
+        NoteChunk.objects.filter(note_id__in=note_ids, model_id=active_model().model_id)
+        .annotate(rank=SearchRank(SearchVector('text', config='french'), search_query))
+        .order_by('note_id', '-rank', 'position')
+        .values_list('note_id', 'id')
+    )
+    best = {}
+    for note_id, chunk_id in rows:
+        best.setdefault(note_id, chunk_id)
+    return best
+
+def reciprocal_rank_fusion(rankings, k0=60):
+    """
+    rankings : listes d'identifiants par ordre de pertinence.
+    Renvoie [(identifiant, score)] trié, score = somme des 1 / (k0 + rang).
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k0 + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def _semantic(query, scope, k):
+    return _build_results(_vector_hits(embed_query(query), scope, k), scope)
+
+def _lexical(query, scope, k):
+    hits = _lexical_hits(query, scope, k)
+    chunks = _best_lexical_chunks(query, [note_id for note_id, _ in hits])
+    return _build_results([(note_id, float(rank), chunks.get(note_id)) for note_id, rank in hits], scope)
+
+def _hybrid(query, scope, k):
+    """
+    Fusion par rang réciproque des résultats plein texte et vectoriels. Si le
+    plein texte renvoie assez de candidats, l'étape vectorielle ne compare la
+    requête qu'aux passages de ces notes.
+    """
+    candidates = getattr(settings, 'HYBRID_LEXICAL_CANDIDATES', 50)
+    lexical = _lexical_hits(query, scope, candidates)
+    lexical_ids = [note_id for note_id, _ in lexical]
+
+    prefilter = lexical_ids if len(lexical_ids) >= getattr(settings, 'HYBRID_PREFILTER_MIN', 20) else None
+    vector = _vector_hits(embed_query(query), scope, max(k, candidates // 2), note_ids=prefilter)
+    vector_chunks = {note_id: chunk_id for note_id, _, chunk_id in vector}
+
+    fused = reciprocal_rank_fusion(
+        [lexical_ids, [note_id for note_id, _, _ in vector]], k0=getattr(settings, 'HYBRID_RRF_K', 60)
+    )[:k]
+    lexical_chunks = _best_lexical_chunks(query, [note_id for note_id, _ in fused if note_id not in vector_chunks])
+    hits = [
+        (note_id, score, vector_chunks.get(note_id) or lexical_chunks.get(note_id))
+        for note_id, score in fused
+    ]
+    return _build_results(hits, scope)
+
+SEARCH_MODES = {
+    'hybrid': _hybrid,
+    'semantic': _semantic,
+    'lexical': _lexical,
+}
+
+def search_notes(query, user, course=None, k=3, mode='hybrid', author=None, date_from=None, date_to=None):
+    """
+    Recherche dans les notes visibles par user (voir search_scope) :
+    course restreint à un cours, author à un auteur (enseignants),
+    date_from / date_to (dates incluses) à une période de création.
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Mode de recherche inconnu : {mode}")
+    scope = search_scope(user, course=course, author=author, date_from=date_from, date_to=date_to)
+    if not scope.shards:
+        return []
+    return SEARCH_MODES[mode](query, scope, k)
+
+def semantic_search(query, user, course=None, k=3):
+    return search_notes(query, user, course=course, k=k, mode='semantic')
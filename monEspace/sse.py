@@ -0,0 +1,154 @@
+"""
+Mise en trames server-sent events des réponses du chat.
+
+Le modèle produit un morceau de texte par token : une trame par token
+coûte un json.dumps, une écriture sur la socket et un réveil du lecteur
+côté navigateur à chaque fois. coalesce() regroupe les morceaux de texte
+reçus pendant CHAT_SSE_COALESCE_MS millisecondes (ou jusqu'à
+CHAT_SSE_COALESCE_BYTES octets) en une seule trame. Le premier morceau part
+immédiatement pour ne pas retarder l'affichage ; les autres événements
+(source, fin) vident le tampon et partent tels quels.
+
+Une trame regroupée porte le numéro de son dernier événement : reprendre
+après ce numéro (Last-Event-ID) ne perd ni ne répète de texte.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import suppress
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class SSEStats:
+    """
+    Trames, événements et octets envoyés depuis la dernière remise à zéro ;
+    un résumé est journalisé toutes les CHAT_SSE_STATS_INTERVAL secondes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record(self, size, events):
+        with self._lock:
+            self.frames += 1
+            self.events += events
+            self.bytes += size
+        interval = getattr(settings, 'CHAT_SSE_STATS_INTERVAL', 60)
+        if interval and time.monotonic() - self.started >= interval:
+            logger.info("Trames SSE : %s", self.snapshot())
+            self.reset()
+
+    def snapshot(self):
+        with self._lock:
+            seconds = max(time.monotonic() - self.started, 1e-9)
+            return {
+                'frames': self.frames,
+                'events': self.events,
+                'bytes': self.bytes,
+                'frames_per_second': self.frames / seconds,
+                'bytes_per_second': self.bytes / seconds,
+                'events_per_frame': self.events / self.frames if self.frames else 0.0,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.frames = 0
+            self.events = 0
+            self.bytes = 0
+            self.started = time.monotonic()
+
+
+sse_stats = SSEStats()
+
+
+def sse_frame(event, seq=None):
+    frame = f"data: {json.dumps(event)}\n\n"
+    return f"id: {seq}\n{frame}" if seq is not None else frame
+
+
+def _is_text(event):
+    return 'content' in event and 'type' not in event
+
+
+async def _pump(events, queue):
+    try:
+        async for item in events:
+            await queue.put(item)
+    except Exception as e:
+        await queue.put(e)
+    finally:
+        await queue.put(_END)
+
+
+async def coalesce(events, window=None, max_bytes=None):
+    """
+    events : générateur asynchrone de (numéro, événement). Renvoie des
+    (numéro, événement, nombre d'événements regroupés).
+    """
+    window = getattr(settings, 'CHAT_SSE_COALESCE_MS', 40) / 1000 if window is None else window
+    max_bytes = getattr(settings, 'CHAT_SSE_COALESCE_BYTES', 512) if max_bytes is None else max_bytes
+    if window <= 0:
+        async for seq, event in events:
+            yield seq, event, 1
+        return
+
+    # La lecture des événements tourne dans sa propre tâche : attendre avec
+    # un délai ne doit jamais interrompre le générateur source
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    pump = asyncio.create_task(_pump(events, queue))
+    texts, last_seq, size, deadline = [], None, 0, None
+    first = True
+    try:
+        while True:
+            try:
+                timeout = None if deadline is None else max(deadline - loop.time(), 0)
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+
+            if item is not None and item is not _END and not isinstance(item, Exception):
+                seq, event = item
+                if _is_text(event) and not first:
+                    texts.append(event['content'])
+                    last_seq = seq
+                    size += len(event['content'].encode('utf-8'))
+                    if deadline is None:
+                        deadline = loop.time() + window
+                    if size < max_bytes:
+                        continue
+                    item = None
+
+            # Délai écoulé, tampon plein, autre événement ou fin : on vide le tampon
+            if texts:
+                yield last_seq, {'content': ''.join(texts)}, len(texts)
+                texts, last_seq, size, deadline = [], None, 0, None
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            if item is not None:
+                first = False
+                yield item[0], item[1], 1
+    finally:
+        pump.cancel()
+        with suppress(asyncio.CancelledError):
+            await pump
+
+
+async def sse_frames(events):
+    """
+    Trames SSE des (numéro, événement) de events, regroupées par coalesce().
+    """
+    async for seq, event, count in coalesce(events):
+        frame = sse_frame(event, seq)
+        sse_stats.record(len(frame.encode('utf-8')), count)
+        yield frame
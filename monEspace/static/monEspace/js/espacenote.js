@@ -354,40 +354,53 @@ document.addEventListener('DOMContentLoaded', function() {
                 },
                 body: JSON.stringify({ 
                     message: messageContent,
-                    session_id: currentSessionId
+                    session_id: currentSessionId,
+                    course_id: currentCourseId
                 }),
             });
 
+            if (response.status === 429) {
+                // Trop de demandes en cours : le serveur indique quand réessayer
+                const retryAfter = response.headers.get('Retry-After') || 'quelques';
+                renderErrorMessage(`Beaucoup de demandes en ce moment. Réessayez dans ${retryAfter} secondes.`);
+                return;
+            }
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
 
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
-            let aiResponseContent = '';
-            let source = null;
-
-            while (true) {
-                const { value, done } = await reader.read();
-                if (done) break;
-                
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
-                
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
-                        const data = JSON.parse(line.slice(6));
-                        if (data.type === 'end') {
-                            break;
-                        } else if (data.type === 'source') {
-                            source = data.source;
-                        } else if (data.content) {
-                            aiResponseContent += data.content;
-                            updateAIMessageInUI(aiResponseContent, source);
-                        }
-                    }
+            // En cas de coupure, la réponse reprend là où elle s'est arrêtée
+            // (Last-Event-ID) sans être régénérée
+            const stream = {
+                id: response.headers.get('X-Chat-Stream-Id'),
+                lastEventId: null,
+                content: '',
+                source: null,
+                ended: false,
+            };
+            let current = response;
+            for (let attempt = 0; ; attempt++) {
+                try {
+                    await readChatStream(current, stream);
+                } catch (error) {
+                    console.warn('Flux de réponse interrompu :', error);
+                }
+                if (stream.ended || !stream.id || attempt >= 5) break;
+                await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+                try {
+                    current = await fetch(`/api/chat/stream/${stream.id}/`, {
+                        headers: stream.lastEventId ? { 'Last-Event-ID': stream.lastEventId } : {},
+                    });
+                    if (!current.ok) break;
+                } catch (error) {
+                    current = null;
                 }
             }
+            if (!stream.ended) {
+                throw new Error('Réponse incomplète');
+            }
+            const aiResponseContent = stream.content;
+            const source = stream.source;
 
             addMessageToHistory('ai', aiResponseContent, source);
             finalizeAIMessageInUI(aiResponseContent, source);
@@ -398,6 +411,52 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    async function readChatStream(response, stream) {
+        if (!response) {
+            throw new Error('Pas de réponse');
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            // Un événement peut être coupé entre deux lectures
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+
+            for (const frame of frames) {
+                let id = null;
+                let data = null;
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('id: ')) {
+                        id = line.slice(4);
+                    } else if (line.startsWith('data: ')) {
+                        data = JSON.parse(line.slice(6));
+                    }
+                }
+                if (id !== null) {
+                    stream.lastEventId = id;
+                }
+                if (!data) continue;
+                if (data.type === 'end') {
+                    stream.ended = true;
+                } else if (data.type === 'source') {
+                    stream.source = data.source;
+                } else if (data.type === 'replace') {
+                    stream.content = data.content;
+                    updateAIMessageInUI(stream.content, stream.source);
+                } else if (data.content) {
+                    stream.content += data.content;
+                    updateAIMessageInUI(stream.content, stream.source);
+                }
+            }
+        }
+    }
+
     function addMessageToHistory(role, content, source = null) {
         chatHistory.push({ role, content, source });
     }
@@ -1,3 +1,694 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import embedding_models, embedding_queue, services
+from .admission import AdmissionRejected, GenerationLimiter, admit
+from .batching import MicroBatcher
+from .chat_context import MESSAGE_OVERHEAD, build_chat_context, count_tokens
+from .chat_stream import run_stream, start_stream
+from .chunking import split_into_chunks
+from .embedding_backends import HashBackend, set_backend
+from .embedding_format import FLOAT16, FLOAT32, INT8, decode_embedding, decode_header, encode_embedding
+from .embedding_models import activate, active_model, notes_to_migrate, override_active_model, start_migration
+from .embedding_queue import process_jobs, schedule_note_embedding
+from .llm_client import CircuitBreaker, LLMClient, LLMUnavailable
+from .models import CachedAnswer, ChatMessage, ChatSession, EmbeddingJob, EmbeddingModel, Note
+from .search_scope import SearchScope, search_scope
+from .sse import coalesce
+from .vector_index import NoteIndexCache, note_index_cache
+
+# Cache propre aux tests : les compteurs et les flux ne dépendent pas de la
+# table du cache
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+async def _events(items, delay=0.0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+class EmbeddingTestCase(TestCase):
+    """
+    Les embeddings sont calculés par le moteur HashBackend (déterministe, sans
+    modèle à charger), à la place du modèle actif.
+    """
+
+    def setUp(self):
+        cache.clear()
+        note_index_cache.clear()
+        self.addCleanup(note_index_cache.clear)
+        self.backend = HashBackend(dim=16)
+        self.enterContext(override_active_model(self.backend))
+        self.user = User.objects.create(username='eleve')
+
+    def create_note(self, title, content, user=None):
+        note = Note.objects.create(user=user or self.user, title=title, content=content)
+        services.update_note_embeddings([note])
+        return note
+
+
+@override_settings(CACHES=LOCMEM_CACHES, NOTE_INDEX_TYPE='flat', EMBEDDING_MICRO_BATCHING=False)
+class NoteIndexCacheTests(EmbeddingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.key = ('user', self.user.id)
+        self.first = self.create_note('Intégrales', '<p>intégration par parties</p>')
+        self.second = self.create_note('Dérivées', '<p>dérivée du produit</p>')
+
+    def test_index_is_built_on_first_search_then_reused(self):
+        self.assertNotIn(self.key, note_index_cache._indexes)
+        index = note_index_cache.get(self.key)
+        self.assertEqual(set(index.note_meta), {self.first.id, self.second.id})
+        with self.assertNumQueries(0):
+            self.assertIs(note_index_cache.get(self.key), index)
+
+    def test_note_changes_update_the_index_in_place(self):
+        index = note_index_cache.get(self.key)
+        third = self.create_note('Limites', '<p>limite en zéro</p>')
+        with self.assertNumQueries(0):
+            self.assertIs(note_index_cache.get(self.key), index)
+        query = self.backend.encode(['limite en zéro'])[0]
+        self.assertEqual(index.search(query, 1)[0][0], third.id)
+
+        # post_delete retire la note des index chargés
+        third.delete()
+        with self.assertNumQueries(0):
+            self.assertIs(note_index_cache.get(self.key), index)
+        self.assertNotIn(third.id, index.note_meta)
+        self.assertNotIn(third.id, index.note_chunks)
+
+    def test_change_made_by_another_process_makes_the_index_stale(self):
+        # other joue un autre processus : il ne voit la modification que par
+        # le numéro de version du shard, dans le cache partagé
+        other = NoteIndexCache()
+        stale = other.get(self.key)
+        third = self.create_note('Limites', '<p>limite en zéro</p>')
+        self.assertNotIn(third.id, stale.note_meta)
+        rebuilt = other.get(self.key)
+        self.assertIsNot(rebuilt, stale)
+        self.assertIn(third.id, rebuilt.note_meta)
+
+    def test_least_recently_used_shard_is_evicted_over_budget(self):
+        users = [User.objects.create(username=f'eleve{i}') for i in range(3)]
+        for user in users:
+            self.create_note('Suites', '<p>suite arithmétique</p>', user=user)
+        keys = [('user', user.id) for user in users]
+        size = NoteIndexCache().get(keys[0]).nbytes
+
+        indexes = NoteIndexCache(max_bytes=2 * size)
+        indexes.get(keys[0])
+        indexes.get(keys[1])
+        indexes.get(keys[0])
+        indexes.get(keys[2])
+        self.assertEqual(list(indexes._indexes), [keys[0], keys[2]])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, EMBEDDING_ASYNC=True, EMBEDDING_MICRO_BATCHING=False,
+                   EMBEDDING_QUEUE_DEBOUNCE=5, EMBEDDING_QUEUE_MAX_DELAY=60)
+class EmbeddingQueueTests(EmbeddingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.note = Note.objects.create(user=self.user, title='Intégrales', content='<p>par parties</p>')
+
+    def make_due(self):
+        EmbeddingJob.objects.update(run_after=timezone.now() - timedelta(seconds=1))
+
+    def test_successive_saves_share_one_debounced_job(self):
+        schedule_note_embedding(self.note)
+        schedule_note_embedding(self.note)
+        job = EmbeddingJob.objects.get(note=self.note)
+        self.assertEqual(job.version, 2)
+        self.assertGreater(job.run_after, timezone.now())
+        # Pas encore échue : le worker n'y touche pas
+        self.assertEqual(process_jobs(), 0)
+
+    def test_worker_embeds_the_note_and_deletes_the_job(self):
+        schedule_note_embedding(self.note)
+        self.make_due()
+        self.assertEqual(process_jobs(), 1)
+        self.assertFalse(EmbeddingJob.objects.exists())
+        self.note.refresh_from_db()
+        self.assertFalse(self.note.embedding_stale)
+        self.assertTrue(self.note.chunks.filter(model_id=self.backend.model_id).exists())
+
+    def test_note_edited_during_processing_keeps_its_job(self):
+        schedule_note_embedding(self.note)
+        self.make_due()
+        update = embedding_queue.update_note_embeddings
+
+        def edited_meanwhile(notes, **kwargs):
+            update(notes, **kwargs)
+            schedule_note_embedding(self.note)
+
+        with mock.patch.object(embedding_queue, 'update_note_embeddings', side_effect=edited_meanwhile):
+            self.assertEqual(process_jobs(), 1)
+        job = EmbeddingJob.objects.get(note=self.note)
+        self.assertEqual(job.version, 2)
+        self.assertIsNone(job.locked_until)
+        self.note.refresh_from_db()
+        self.assertTrue(self.note.embedding_stale)
+
+    def test_failed_batch_is_retried_later(self):
+        schedule_note_embedding(self.note)
+        self.make_due()
+        with mock.patch.object(embedding_queue, 'update_note_embeddings', side_effect=RuntimeError("panne")), \
+                self.assertLogs('monEspace.embedding_queue', 'ERROR'):
+            self.assertEqual(process_jobs(), 0)
+        job = EmbeddingJob.objects.get(note=self.note)
+        self.assertEqual((job.attempts, job.last_error), (1, "panne"))
+        self.assertIsNone(job.locked_until)
+        self.assertGreater(job.run_after, timezone.now())
+
+    @override_settings(EMBEDDING_ASYNC=False)
+    def test_synchronous_mode_embeds_right_away(self):
+        schedule_note_embedding(self.note)
+        self.assertFalse(EmbeddingJob.objects.exists())
+        self.assertTrue(self.note.chunks.exists())
+
+
+class EmbeddingFormatTests(SimpleTestCase):
+    def setUp(self):
+        self.vector = np.random.default_rng(0).standard_normal(384).astype(np.float32)
+
+    def test_float32_round_trip_is_exact(self):
+        data = encode_embedding(self.vector, dtype=FLOAT32, model_id='mpnet')
+        np.testing.assert_array_equal(decode_embedding(data), self.vector)
+
+    def test_compact_dtypes_round_trip(self):
+        for dtype, size, tolerance in ((FLOAT16, 2, 1e-2), (INT8, 1, 5e-2)):
+            with self.subTest(dtype=dtype):
+                data = encode_embedding(self.vector, dtype=dtype, model_id='mpnet')
+                header = decode_header(data)
+                self.assertEqual((header.dtype, header.dim, header.model_id), (dtype, 384, 'mpnet'))
+                self.assertEqual(len(data) - header.offset, 384 * size)
+                np.testing.assert_allclose(decode_embedding(data), self.vector, atol=tolerance * np.abs(self.vector).max())
+
+    def test_legacy_raw_float32_is_readable(self):
+        header = decode_header(self.vector.tobytes())
+        self.assertEqual((header.dtype, header.dim, header.model_id), (FLOAT32, 384, ''))
+        np.testing.assert_array_equal(decode_embedding(self.vector.tobytes()), self.vector)
+
+    def test_unknown_dtype_is_rejected(self):
+        with self.assertRaises(ValueError):
+            encode_embedding(self.vector, dtype='bfloat16')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, EMBEDDING_MICRO_BATCHING=False)
+class ContentHashTests(EmbeddingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.note = self.create_note('Intégrales', '<p>intégration par parties</p>')
+
+    def batch_for(self, note, **kwargs):
+        return services.NoteEmbeddingBatch([Note.objects.get(pk=note.pk)], **kwargs)
+
+    def test_unchanged_text_is_not_encoded_again(self):
+        # Seul le HTML change : même texte, même empreinte
+        Note.objects.filter(pk=self.note.pk).update(content='<div><b>intégration</b> par parties</div>')
+        self.note.refresh_from_db()
+        self.note.save()
+        batch = self.batch_for(self.note)
+        self.assertEqual(batch.unchanged, {self.note.pk})
+        self.assertEqual(batch.missing_texts, [])
+
+    def test_changed_text_is_encoded(self):
+        self.note.content = '<p>intégration par changement de variable</p>'
+        self.note.save()
+        batch = self.batch_for(self.note)
+        self.assertEqual(batch.unchanged, set())
+        self.assertEqual(len(batch.missing_texts), 1)
+
+    def test_passage_seen_in_another_note_reuses_its_vector(self):
+        other = Note.objects.create(
+            user=User.objects.create(username='autre'), title='Intégrales', content='<p>intégration par parties</p>',
+        )
+        batch = self.batch_for(other)
+        self.assertEqual(batch.unchanged, set())
+        self.assertEqual(batch.missing_texts, [])
+        self.assertEqual(len(batch.known), 1)
+
+    def test_force_rebuilds_the_passages(self):
+        batch = self.batch_for(self.note, force=True)
+        self.assertEqual(batch.unchanged, set())
+        self.assertEqual(len(batch.save()), 1)
+
+
+class ChunkingTests(SimpleTestCase):
+    def test_short_text_is_one_passage(self):
+        self.assertEqual(split_into_chunks('  une phrase courte '), [(2, 19, 'une phrase courte')])
+        self.assertEqual(split_into_chunks(' \n '), [])
+
+    def test_passages_overlap_on_word_boundaries(self):
+        text = ' '.join(f'mot{i}' for i in range(200))
+        chunks = split_into_chunks(text, size=100, overlap=30)
+        self.assertGreater(len(chunks), 1)
+        for start, end, passage in chunks:
+            self.assertEqual(text[start:end], passage)
+            self.assertLessEqual(len(passage), 100)
+            self.assertFalse(passage.startswith(' ') or passage.endswith(' '))
+        for (_, previous_end, _), (start, _, _) in zip(chunks, chunks[1:]):
+            self.assertLess(start, previous_end)
+            self.assertLessEqual(previous_end - start, 30)
+        self.assertEqual((chunks[0][0], chunks[-1][1]), (0, len(text)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, EMBEDDING_MICRO_BATCHING=False, NOTE_CHUNK_SIZE=100, NOTE_CHUNK_OVERLAP=20)
+class NoteChunkTests(EmbeddingTestCase):
+    def test_note_is_indexed_as_passages_replaced_on_edit(self):
+        note = self.create_note('Suites', '<p>' + ' '.join(f'terme{i}' for i in range(60)) + '</p>')
+        positions = list(note.chunks.values_list('position', flat=True))
+        self.assertGreater(len(positions), 1)
+        self.assertEqual(positions, list(range(len(positions))))
+
+        note.content = '<p>suite arithmétique</p>'
+        note.save()
+        services.update_note_embeddings([note])
+        self.assertEqual(list(note.chunks.values_list('text', flat=True)), ['suite arithmétique'])
+
+    def test_encoded_text_keeps_the_title(self):
+        note = Note.objects.create(user=self.user, title='Suites', content='<p>raison constante</p>')
+        [(start, end, passage, text)] = services.build_note_chunks(note)
+        self.assertEqual((start, end, passage), (0, 16, 'raison constante'))
+        self.assertEqual(text, 'Suites raison constante')
+
+
+class HybridSearchTests(SimpleTestCase):
+    def test_reciprocal_rank_fusion(self):
+        fused = dict(services.reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k0=60))
+        self.assertAlmostEqual(fused[1], 1 / 61 + 1 / 62)
+        self.assertAlmostEqual(fused[3], 1 / 63 + 1 / 61)
+        self.assertAlmostEqual(fused[2], 1 / 62)
+        self.assertEqual(list(fused), [1, 3, 2])
+
+    def test_hybrid_merges_lexical_and_vector_rankings(self):
+        lexical = [(10, 0.9), (20, 0.5), (30, 0.1)]
+        vector = [(20, 0.8, 201), (40, 0.7, 401)]
+        with mock.patch.object(services, '_lexical_hits', return_value=lexical), \
+                mock.patch.object(services, '_vector_hits', return_value=vector) as vector_hits, \
+                mock.patch.object(services, 'embed_query', return_value=np.zeros(4, dtype=np.float32)), \
+                mock.patch.object(services, '_best_lexical_chunks', return_value={10: 101, 30: 301}) as lexical_chunks, \
+                mock.patch.object(services, '_build_results', side_effect=lambda hits, scope: hits):
+            hits = services._hybrid('intégrale', scope=None, k=3)
+
+        # Trop peu de candidats plein texte pour préfiltrer l'étape vectorielle
+        self.assertIsNone(vector_hits.call_args.kwargs['note_ids'])
+        self.assertEqual([note_id for note_id, _, _ in hits], [20, 10, 40])
+        # Passage vectoriel si la note en a un, sinon le meilleur passage plein texte
+        self.assertEqual([chunk_id for _, _, chunk_id in hits], [201, 101, 401])
+        lexical_chunks.assert_called_once_with('intégrale', [10])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, EMBEDDING_MICRO_BATCHING=False)
+class SearchResultsTests(EmbeddingTestCase):
+    def test_note_without_passages_is_previewed_from_its_text(self):
+        # Trouvée par le plein texte avant le passage du worker
+        note = Note.objects.create(user=self.user, title='Limites', content='<p>limite en zéro</p>')
+        results = services._build_results([(note.id, 0.5, None)], search_scope(self.user))
+        self.assertEqual(results, [{
+            'id': note.id,
+            'title': 'Limites',
+            'content_preview': 'limite en zéro',
+            'passage': {'start': 0, 'end': 14},
+            'score': 0.5,
+        }])
+
+    def test_notes_outside_the_scope_are_dropped(self):
+        note = self.create_note('Limites', '<p>limite en zéro</p>')
+        chunk = note.chunks.get()
+        other = User.objects.create(username='autre')
+        self.assertEqual(services._build_results([(note.id, 0.5, chunk.id)], search_scope(other)), [])
+        [result] = services._build_results([(note.id, 0.5, chunk.id)], search_scope(self.user))
+        self.assertEqual(result['content_preview'], chunk.text)
+
+    def test_results_are_hydrated_in_a_fixed_number_of_queries(self):
+        notes = [self.create_note(f'Note {i}', f'<p>contenu {i}</p>') for i in range(6)]
+        hits = [(note.id, 1.0 - i / 10, note.chunks.get().id) for i, note in enumerate(notes)]
+        scope = search_scope(self.user)
+        for count in (1, 6):
+            with self.subTest(hits=count), self.assertNumQueries(2):
+                results = services._build_results(hits[:count], scope)
+            self.assertEqual([result['id'] for result in results], [note.id for note in notes[:count]])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, EMBEDDING_MICRO_BATCHING=False)
+class SearchScopeTests(EmbeddingTestCase):
+    def test_filters_apply_inside_the_shard(self):
+        old = self.create_note('Suites', '<p>suite géométrique</p>')
+        recent = self.create_note('Suites', '<p>suite géométrique</p>')
+        Note.objects.filter(pk=old.pk).update(created_at=timezone.make_aware(datetime(2026, 1, 15)))
+        note_index_cache.clear()
+
+        scope = SearchScope([('user', self.user.id)], date_from=date(2026, 6, 1))
+        query = self.backend.encode(['suite géométrique'])[0]
+        self.assertEqual([note_id for note_id, _, _ in services._faiss_hits(query, scope, 5)], [recent.id])
+        self.assertEqual(list(Note.objects.filter(scope.q()).values_list('id', flat=True)), [recent.id])
+
+        scope = SearchScope([('user', self.user.id)], date_to=date(2026, 1, 15))
+        self.assertEqual([note_id for note_id, _, _ in services._faiss_hits(query, scope, 5)], [old.id])
+
+    def test_student_only_searches_own_notes(self):
+        scope = search_scope(self.user, author=User.objects.create(username='autre').id)
+        self.assertEqual(scope.shards, [('user', self.user.id)])
+        self.assertFalse(scope.has_filters)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def test_concurrent_calls_share_a_batch(self):
+        batches = []
+
+        def double(items):
+            batches.append(list(items))
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(double, max_batch_size=8, max_latency=0.05)
+        futures = batcher.submit_many(range(20))
+        self.assertEqual([future.result(timeout=5) for future in futures], [i * 2 for i in range(20)])
+        self.assertTrue(all(len(batch) <= 8 for batch in batches))
+        self.assertLess(len(batches), 20)
+        self.assertEqual(batcher.stats.snapshot()['items'], 20)
+
+    def test_exception_reaches_every_caller_of_the_batch(self):
+        def fail(items):
+            raise RuntimeError("modèle indisponible")
+
+        batcher = MicroBatcher(fail, max_latency=0.05)
+        futures = batcher.submit_many(['a', 'b'])
+        for future in futures:
+            with self.assertRaisesMessage(RuntimeError, "modèle indisponible"):
+                future.result(timeout=5)
+
+        # Le thread du batcher survit à l'erreur
+        batcher.fn = lambda items: [item.upper() for item in items]
+        self.assertEqual(batcher.submit('c').result(timeout=5), 'C')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, EMBEDDING_MICRO_BATCHING=False)
+class ModelMigrationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(set_backend, set_backend(HashBackend(dim=16)))
+        embedding_models.reset()
+        self.addCleanup(embedding_models.reset)
+        self.user = User.objects.create(username='eleve')
+
+    def create_note(self, content):
+        note = Note.objects.create(user=self.user, title='Note', content=content)
+        services.update_note_embeddings([note])
+        return note
+
+    def test_new_model_serves_searches_once_every_note_is_covered(self):
+        old = active_model()
+        self.assertEqual((old.model_id, old.status), ('hash-stub-16', EmbeddingModel.ACTIVE))
+        first = self.create_note('<p>intégration par parties</p>')
+
+        new = start_migration(HashBackend(dim=8))
+        self.assertEqual(list(notes_to_migrate(new)), [first])
+        with self.assertRaisesMessage(ValueError, 'Migration incomplète'):
+            activate(new)
+
+        # Pendant la migration, une note modifiée reçoit les passages des deux modèles
+        second = self.create_note('<p>dérivée du produit</p>')
+        self.assertEqual(
+            set(second.chunks.values_list('model_id', flat=True)), {'hash-stub-16', 'hash-stub-8'}
+        )
+        self.assertEqual(active_model().model_id, 'hash-stub-16')
+
+        services.update_note_embeddings([first])
+        self.assertFalse(notes_to_migrate(new).exists())
+        activate(new)
+        self.assertEqual(active_model().model_id, 'hash-stub-8')
+        old.refresh_from_db()
+        self.assertEqual(old.status, EmbeddingModel.RETIRED)
+
+    def test_warm_up_does_not_touch_the_database(self):
+        with self.assertNumQueries(0):
+            services.warm_up()
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_threshold_then_lets_one_trial_through(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        breaker.opened_at -= 31
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        breaker.opened_at -= 31
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+
+    def test_abandoned_trial_frees_the_slot(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.release()
+        self.assertTrue(breaker.allow())
+
+    async def test_open_breaker_fails_fast(self):
+        client = LLMClient()
+        client.breaker.opened_at = time.monotonic()
+        with self.assertRaises(LLMUnavailable):
+            async for _ in client.stream("[INST] bonjour [/INST]"):
+                pass
+
+    async def test_client_of_a_loop_is_closed_with_it(self):
+        client = LLMClient()
+        http = client._client()
+        self.assertIs(client._client(), http)
+        await client.aclose_loop_client()
+        self.assertTrue(http.is_closed)
+        self.assertEqual(len(client._clients), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHAT_SSE_COALESCE_MS=0)
+class ChatResumeTests(TestCase):
+    async def test_last_event_id_resumes_after_the_given_event(self):
+        user = await User.objects.acreate(username='eleve')
+        await self.async_client.aforce_login(user)
+        stream_id = uuid.uuid4()
+        events = [{'content': f'mot{i} '} for i in range(5)] + [{'type': 'end'}]
+        stream = start_stream(stream_id, user.id, _events(events, delay=0.001))
+        await stream.task
+
+        response = await self.async_client.get(f'/api/chat/stream/{stream_id}/', headers={'Last-Event-ID': '3'})
+        self.assertEqual(response.status_code, 200)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(body.count('data:'), 3)
+        self.assertTrue(body.startswith('id: 4\n'))
+        self.assertNotIn('mot2', body)
+        self.assertIn('mot3', body)
+
+        other = await User.objects.acreate(username='autre')
+        await self.async_client.aforce_login(other)
+        response = await self.async_client.get(f'/api/chat/stream/{stream_id}/', headers={'Last-Event-ID': '3'})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_wsgi_stream_ends_after_on_done(self):
+        # Sous WSGI, la boucle se ferme avec la réponse : on_done (place de
+        # génération, résumé) doit être terminé avant
+        finished = []
+
+        async def on_done():
+            await asyncio.sleep(0.01)
+            finished.append(True)
+
+        events = [{'content': 'bonjour'}, {'type': 'end'}]
+        items = [item async for item in run_stream(uuid.uuid4(), 1, _events(events), on_done)]
+        self.assertEqual(items, list(enumerate(events, start=1)))
+        self.assertEqual(finished, [True])
+
+
+class CoalesceTests(SimpleTestCase):
+    async def _collect(self, events, **kwargs):
+        return [item async for item in coalesce(_events(events), **kwargs)]
+
+    async def test_text_chunks_are_grouped_under_the_last_number(self):
+        events = [
+            (1, {'content': 'Bon'}),
+            (2, {'content': 'jour'}),
+            (3, {'content': ' à'}),
+            (4, {'content': ' tous'}),
+            (5, {'type': 'source', 'source': 7}),
+            (6, {'type': 'end'}),
+        ]
+        frames = await self._collect(events, window=1.0, max_bytes=512)
+        self.assertEqual(frames, [
+            (1, {'content': 'Bon'}, 1),
+            (4, {'content': 'jour à tous'}, 3),
+            (5, {'type': 'source', 'source': 7}, 1),
+            (6, {'type': 'end'}, 1),
+        ])
+
+    async def test_full_buffer_is_flushed(self):
+        events = [(i, {'content': 'abcd'}) for i in range(1, 6)]
+        frames = await self._collect(events, window=1.0, max_bytes=8)
+        self.assertEqual([(seq, count) for seq, _, count in frames], [(1, 1), (3, 2), (5, 2)])
+
+    async def test_zero_window_passes_events_through(self):
+        events = [(1, {'content': 'a'}), (2, {'content': 'b'})]
+        frames = await self._collect(events, window=0)
+        self.assertEqual(frames, [(1, {'content': 'a'}, 1), (2, {'content': 'b'}, 1)])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHAT_MAX_CONCURRENT_GENERATIONS=1,
+                   CHAT_ADMISSION_QUEUE=1, CHAT_ADMISSION_TIMEOUT=5)
+class AdmissionTests(SimpleTestCase):
+    async def test_released_slot_goes_to_the_waiter(self):
+        limiter = GenerationLimiter()
+        self.assertEqual(await limiter.acquire(), 0.0)
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.01)
+        self.assertEqual(limiter.queue_depth, 1)
+
+        # File pleine : refus immédiat
+        with self.assertRaises(AdmissionRejected) as rejected:
+            await limiter.acquire()
+        self.assertEqual(rejected.exception.reason, 'queue_full')
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+
+        limiter.release()
+        await asyncio.wait_for(waiter, 1)
+        self.assertEqual((limiter.active, limiter.queue_depth), (1, 0))
+        limiter.release()
+        self.assertEqual(limiter.active, 0)
+
+    async def test_waiter_times_out(self):
+        limiter = GenerationLimiter()
+        await limiter.acquire()
+        with override_settings(CHAT_ADMISSION_TIMEOUT=0.01):
+            with self.assertRaises(AdmissionRejected) as rejected:
+                await limiter.acquire()
+        self.assertEqual(rejected.exception.reason, 'timeout')
+        limiter.release()
+        self.assertEqual((limiter.active, limiter.queue_depth), (0, 0))
+
+    async def test_slot_is_handed_to_a_waiter_in_another_thread(self):
+        limiter = GenerationLimiter()
+        await limiter.acquire()
+        admitted = threading.Event()
+
+        def wait_in_own_loop():
+            async def wait():
+                await limiter.acquire()
+                admitted.set()
+            asyncio.run(wait())
+
+        thread = threading.Thread(target=wait_in_own_loop)
+        thread.start()
+        while limiter.queue_depth == 0:
+            await asyncio.sleep(0.01)
+        limiter.release()
+        await asyncio.get_running_loop().run_in_executor(None, thread.join, 5)
+        self.assertTrue(admitted.is_set())
+        self.assertEqual(limiter.active, 1)
+
+    @override_settings(CHAT_MAX_CONCURRENT_GENERATIONS=10, CHAT_MAX_GENERATIONS_PER_USER=1)
+    async def test_per_user_limit(self):
+        user_id = uuid.uuid4().int
+        admission = await admit(user_id)
+        with self.assertRaises(AdmissionRejected) as rejected:
+            await admit(user_id)
+        self.assertEqual(rejected.exception.reason, 'user_limit')
+        await admission.release()
+        await (await admit(user_id)).release()
+
+
+@override_settings(CACHES=LOCMEM_CACHES, EMBEDDING_MICRO_BATCHING=False, CHAT_TOKENIZER=None,
+                   CHAT_CONTEXT_TOKENS=1500, CHAT_NOTES_CONTEXT_TOKENS=300, CHAT_RECALL_TOKENS=200)
+class ChatContextTests(EmbeddingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = ChatSession.objects.create(user=self.user)
+        self.old_question = self.say('user', "Les intégrales par parties me posent problème")
+        self.say('assistant', "Rappelle-toi la dérivée d'un produit.")
+        for i in range(30):
+            self.say('user', f"question {i} sur les suites " + 'bla ' * 40)
+            self.say('assistant', f"réponse {i} " + 'mot ' * 60)
+        self.question = self.say('user', "Les intégrales par parties me posent problème")
+
+    def say(self, role, content):
+        return ChatMessage.objects.create(session=self.session, role=role, content=content)
+
+    def build(self):
+        return build_chat_context(self.session, self.question.content, 'extrait ' * 1000, self.question.id)
+
+    def test_long_session_fits_the_budget(self):
+        context = self.build()
+        total = sum(count_tokens(message['content']) + MESSAGE_OVERHEAD for message in context.messages)
+        self.assertLessEqual(total, 1500)
+        self.assertEqual(context.messages[-1], {'role': 'user', 'content': self.question.content})
+        self.assertTrue(context.messages[-2]['content'].startswith('réponse 29 '))
+        # Les échanges les plus anciens sont hors de la fenêtre
+        self.assertGreater(context.window_start_id, self.old_question.id)
+        self.assertFalse(any(message['content'].startswith('question 0 ') for message in context.messages))
+
+    def test_relevant_old_turn_is_recalled(self):
+        recalled = [message['content'] for message in self.build().messages
+                    if message['content'].startswith('Échanges antérieurs')]
+        self.assertEqual(len(recalled), 1)
+        self.assertIn(self.old_question.content, recalled[0])
+
+    def test_summarized_turns_are_replaced_by_the_summary(self):
+        window = list(self.session.messages.filter(id__gte=self.build().window_start_id, id__lt=self.question.id)
+                      .values_list('id', flat=True))
+        self.session.summary = "L'étudiant révise les suites."
+        self.session.summary_until = window[len(window) // 2]
+        context = self.build()
+        self.assertIn("L'étudiant révise les suites.", context.messages[1]['content'])
+        self.assertGreater(context.window_start_id, self.session.summary_until)
+
+
+@override_settings(CHAT_ANSWER_CACHE=True)
+class AnswerCacheInvalidationTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='eleve')
+        self.note = Note.objects.create(user=user, title='Intégrales', content='<p>Par parties</p>')
+        self.answer = CachedAnswer.objects.create(
+            notes_key='k', query='intégration par parties', embedding=b'', model_id='m',
+            answer='…', expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.answer.notes.set([self.note])
+
+    def test_content_change_drops_the_answer(self):
+        self.note.content = '<p>Nouvelle version</p>'
+        self.note.save()
+        self.assertFalse(CachedAnswer.objects.exists())
+
+    def test_embedding_bookkeeping_keeps_the_answer(self):
+        self.note.embedding_stale = False
+        self.note.save(update_fields=['embedding_stale'])
+        self.assertTrue(CachedAnswer.objects.exists())
+
+    def test_note_deletion_drops_the_answer(self):
+        self.note.delete()
+        self.assertFalse(CachedAnswer.objects.exists())
+
+    @override_settings(CHAT_ANSWER_CACHE=False)
+    def test_disabled_cache_skips_the_invalidation(self):
+        with self.assertNumQueries(1):
+            self.note.save(update_fields=['title'])
@@ -0,0 +1,35 @@
+import re
+from functools import lru_cache
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+
+def html_to_text(html_content):
+    """
+    Texte brut d'un contenu HTML de note. Appelé une fois par sauvegarde
+    (Note.content_text) ; la recherche et le chat lisent la valeur stockée.
+    """
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html_content or '', 'html.parser').get_text()
+
+
+@lru_cache(maxsize=None)
+def _french_stopwords():
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('french'))
+
+
+@lru_cache(maxsize=None)
+def _tokenizer():
+    from nltk.tokenize import word_tokenize
+    return word_tokenize
+
+
+def normalize_text(text):
+    """
+    Prétraitement avant encodage : minuscules, ponctuation retirée, mots vides
+    français supprimés. text est du texte brut (pas de HTML).
+    """
+    stop_words = _french_stopwords()
+    tokens = _tokenizer()(_PUNCTUATION.sub('', text.lower()))
+    return ' '.join(token for token in tokens if token not in stop_words)
@@ -1,20 +1,16 @@
-import openai
-import pytesseract
-from PIL import Image
-import whisper
-
 def create_embedding(text):
-    response = openai.Embedding.create(
-        input=text,
-        model="text-embedding-ada-002"
-    )
-    return response['data'][0]['embedding']
+    # Même moteur que l'indexation des notes : les vecteurs sont comparables
+    from .services import generate_embedding
+    return generate_embedding(text).tolist()
 
 def perform_ocr(image_path):
+    import pytesseract
+    from PIL import Image
     image = Image.open(image_path)
     return pytesseract.image_to_string(image)
 
 def transcribe_with_whisper(audio_path):
+    import whisper
     model = whisper.load_model("base")
     result = model.transcribe(audio_path)
     return result["text"]
\ No newline at end of file
@@ -0,0 +1,316 @@
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .embedding_format import decode_matrix
+from .embedding_models import active_model
+from .models import NoteChunk
+
+
+def _normalize(vectors):
+    import faiss
+    # Copie : normalize_L2 travaille en place et l'appelant peut passer un
+    # vecteur en lecture seule ou partagé (cache des requêtes)
+    vectors = np.array(vectors, dtype=np.float32, order='C')
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _create_index(dim, index_type):
+    import faiss
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dim)
+    quantizers = {
+        'fp16': faiss.ScalarQuantizer.QT_fp16,
+        'sq8': faiss.ScalarQuantizer.QT_8bit,
+    }
+    if index_type not in quantizers:
+        raise ValueError(f"Type d'index inconnu : {index_type}")
+    return faiss.IndexScalarQuantizer(dim, quantizers[index_type], faiss.METRIC_INNER_PRODUCT)
+
+
+class NoteIndex:
+    """
+    Index FAISS des passages (NoteChunk) d'un shard : les notes d'un
+    utilisateur ou d'un cours. Les identifiants FAISS sont ceux des passages ;
+    les scores sont ramenés aux notes à la recherche. Les vecteurs sont
+    normalisés une seule fois, à l'insertion. Pour chaque note, l'auteur et la
+    date de création sont gardés pour filtrer pendant la recherche.
+
+    index_type : 'flat' (exact, float32), 'fp16' ou 'sq8' (quantification
+    scalaire 8 bits). Un index quantifié reste exact (flat) tant que le shard
+    a moins de NOTE_INDEX_MIN_TRAIN passages, puis est reconstruit une fois,
+    entraîné sur tous ses vecteurs : un quantificateur entraîné sur les
+    quelques passages d'une première note ne sait pas coder les suivants.
+    model_id : modèle d'embeddings des vecteurs de l'index.
+    """
+
+    def __init__(self, dim, version=0, index_type='flat', model_id=None):
+        import faiss
+        self.dim = dim
+        self.version = version
+        self.model_id = model_id
+        self.index_type = index_type
+        self.index = faiss.IndexIDMap2(_create_index(dim, 'flat'))
+        self.quantized = index_type == 'flat'
+        self.chunk_notes = {}
+        self.note_chunks = defaultdict(set)
+        self.note_meta = {}
+        # FAISS ne supporte pas les écritures concurrentes aux lectures
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        # codes des vecteurs + identifiants int64 + tables passage <-> note
+        return self.index.ntotal * (self.index.index.sa_code_size() + 8 + 64) + len(self.note_meta) * 96
+
+    def add(self, chunk_ids, note_ids, vectors, note_meta):
+        """
+        note_meta : {note_id: (user_id, timestamp de création)}.
+        """
+        if not len(chunk_ids):
+            return
+        vectors = _normalize(vectors)
+        with self._lock:
+            self.index.add_with_ids(vectors, np.asarray(chunk_ids, dtype=np.int64))
+            if not self.quantized and self.index.ntotal >= getattr(settings, 'NOTE_INDEX_MIN_TRAIN', 1000):
+                self._quantize()
+            for chunk_id, note_id in zip(chunk_ids, note_ids):
+                self.chunk_notes[int(chunk_id)] = int(note_id)
+                self.note_chunks[int(note_id)].add(int(chunk_id))
+            self.note_meta.update(note_meta)
+
+    def _quantize(self):
+        import faiss
+        vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+        ids = faiss.vector_to_array(self.index.id_map)
+        index = faiss.IndexIDMap2(_create_index(self.dim, self.index_type))
+        index.train(vectors)
+        index.add_with_ids(vectors, ids)
+        self.index = index
+        self.quantized = True
+
+    def remove(self, note_id):
+        with self._lock:
+            chunk_ids = self.note_chunks.pop(note_id, ())
+            if chunk_ids:
+                self.index.remove_ids(np.array(sorted(chunk_ids), dtype=np.int64))
+            for chunk_id in chunk_ids:
+                self.chunk_notes.pop(chunk_id, None)
+            self.note_meta.pop(note_id, None)
+
+    def search(self, query_embedding, k, note_ids=None, scope=None):
+        """
+        Renvoie au plus k tuples (note_id, score, chunk_id) : pour chaque note,
+        le meilleur de ses passages.
+
+        note_ids (candidats d'un préfiltre) et scope (SearchScope dont les
+        filtres s'appliquent aux métadonnées des notes) restreignent les
+        passages comparés à la requête, via un sélecteur d'identifiants FAISS.
+        """
+        import faiss
+        overfetch = getattr(settings, 'NOTE_CHUNK_OVERFETCH', 4)
+        query = _normalize(query_embedding)
+        with self._lock:
+            params = None
+            n = self.index.ntotal
+            if note_ids is not None or (scope is not None and scope.has_filters):
+                candidates = self.note_meta.keys() if note_ids is None else note_ids
+                if scope is not None and scope.has_filters:
+                    candidates = [note_id for note_id in candidates
+                                  if note_id in self.note_meta and scope.matches(*self.note_meta[note_id])]
+                chunk_ids = [chunk_id for note_id in candidates for chunk_id in self.note_chunks.get(note_id, ())]
+                n = len(chunk_ids)
+                if n:
+                    selector = faiss.IDSelectorBatch(np.asarray(chunk_ids, dtype=np.int64))
+                    params = faiss.SearchParameters(sel=selector)
+            n = min(k * overfetch, n)
+            if n == 0:
+                return []
+            scores, ids = self.index.search(query, n, params=params)
+            chunk_notes = [self.chunk_notes.get(int(chunk_id)) for chunk_id in ids[0]]
+        return best_chunk_per_note(zip(chunk_notes, scores[0], ids[0]), k)
+
+
+def best_chunk_per_note(hits, k):
+    """
+    hits : (note_id, score, chunk_id) triés par score décroissant.
+    """
+    results = []
+    seen = set()
+    for note_id, score, chunk_id in hits:
+        if note_id is None or chunk_id == -1 or note_id in seen:
+            continue
+        seen.add(note_id)
+        results.append((int(note_id), float(score), int(chunk_id)))
+        if len(results) == k:
+            break
+    return results
+
+
+def merge_hits(hits_per_shard, k):
+    """
+    Fusionne les résultats de plusieurs shards (scores cosinus comparables).
+    """
+    hits = sorted((hit for hits in hits_per_shard for hit in hits), key=lambda hit: hit[1], reverse=True)
+    return best_chunk_per_note(hits, k)
+
+
+class NoteIndexCache:
+    """
+    Cache LRU des index par shard, borné par un budget mémoire. Un shard est
+    identifié par ('user', user_id) ou ('course', course_id).
+
+    Les index sont construits paresseusement à la première recherche (donc
+    reconstruits après un redémarrage), puis mis à jour sur place à chaque
+    changement d'embedding ou suppression de note. Un numéro de version par
+    shard, stocké dans le cache Django, permet aux autres processus de
+    détecter qu'un de leurs index est périmé. Un index ne contient que les
+    passages du modèle d'embeddings actif ; il est reconstruit quand un autre
+    modèle devient actif.
+    """
+
+    def __init__(self, max_bytes=None):
+        self._max_bytes = max_bytes
+        self._indexes = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return getattr(settings, 'NOTE_INDEX_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+
+    @property
+    def index_type(self):
+        return getattr(settings, 'NOTE_INDEX_TYPE', 'flat')
+
+    @staticmethod
+    def _version_key(key):
+        kind, key_id = key
+        return f'note_index_version:{kind}:{key_id}'
+
+    def _current_version(self, key):
+        return cache.get(self._version_key(key), 0)
+
+    def _bump_version(self, key):
+        version_key = self._version_key(key)
+        cache.add(version_key, 0, timeout=None)
+        try:
+            return cache.incr(version_key)
+        except ValueError:
+            cache.set(version_key, 1, timeout=None)
+            return 1
+
+    @staticmethod
+    def keys_for(note):
+        keys = [('user', note.user_id)]
+        if note.course_id:
+            keys.append(('course', note.course_id))
+        return keys
+
+    def _build(self, key, version, model_id):
+        kind, key_id = key
+        chunks = NoteChunk.objects.filter(model_id=model_id, embedding__isnull=False)
+        if kind == 'user':
+            chunks = chunks.filter(note__user_id=key_id)
+        else:
+            chunks = chunks.filter(note__course_id=key_id)
+
+        rows = [
+            row for row in chunks.values_list('id', 'note_id', 'note__user_id', 'note__created_at', 'embedding').iterator()
+            if row[4]
+        ]
+        if not rows:
+            return None
+        chunk_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        note_ids = np.array([row[1] for row in rows], dtype=np.int64)
+        note_meta = {row[1]: (row[2], row[3].timestamp()) for row in rows}
+        vectors, valid = decode_matrix([row[4] for row in rows])
+
+        index = NoteIndex(vectors.shape[1], version=version, index_type=self.index_type, model_id=model_id)
+        index.add(chunk_ids[valid], note_ids[valid], vectors[valid], note_meta)
+        return index
+
+    def _evict(self):
+        total = sum(index.nbytes for index in self._indexes.values())
+        while total > self.max_bytes and len(self._indexes) > 1:
+            _, evicted = self._indexes.popitem(last=False)
+            total -= evicted.nbytes
+
+    def get(self, key):
+        version = self._current_version(key)
+        model_id = active_model().model_id
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None and index.version == version and index.model_id == model_id:
+                self._indexes.move_to_end(key)
+                return index
+            self._indexes.pop(key, None)
+            self._building[key] = False
+
+        index = self._build(key, version, model_id)
+
+        with self._lock:
+            dirty = self._building.pop(key, False)
+            if index is not None and not dirty:
+                self._indexes[key] = index
+                self._evict()
+        return index
+
+    def _mark_building_dirty(self, keys):
+        for key in self._building:
+            if key in keys:
+                self._building[key] = True
+
+    def update(self, note, chunks):
+        """
+        Répercute les nouveaux passages d'une note dans les index en mémoire.
+        chunks : liste de (chunk_id, embedding).
+        """
+        chunk_ids = [chunk_id for chunk_id, _ in chunks]
+        vectors = [embedding for _, embedding in chunks]
+        note_meta = {note.id: (note.user_id, note.created_at.timestamp())}
+        versions = {key: self._bump_version(key) for key in self.keys_for(note)}
+        with self._lock:
+            self._mark_building_dirty(versions)
+            # La note est retirée de tous les shards (elle a pu changer de
+            # cours), puis ajoutée à ceux dont elle fait partie
+            for key, index in self._indexes.items():
+                index.remove(note.id)
+                if key in versions:
+                    if chunks and all(vector.shape[0] == index.dim for vector in vectors):
+                        index.add(chunk_ids, [note.id] * len(chunk_ids), vectors, note_meta)
+                    index.version = versions[key]
+
+    def remove(self, note):
+        versions = {key: self._bump_version(key) for key in self.keys_for(note)}
+        with self._lock:
+            self._mark_building_dirty(versions)
+            for key, index in self._indexes.items():
+                index.remove(note.id)
+                if key in versions:
+                    index.version = versions[key]
+
+    def invalidate(self, key):
+        """
+        Périme un shard après une mise à jour en masse ; il sera reconstruit
+        à la prochaine recherche.
+        """
+        self._bump_version(key)
+        with self._lock:
+            self._indexes.pop(key, None)
+            self._mark_building_dirty({key})
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+note_index_cache = NoteIndexCache()
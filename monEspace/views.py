@@ -1,6 +1,5 @@
 from datetime import timezone
 import json
-import os
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -10,14 +9,15 @@ from .serializers import NoteSerializer, AttachmentSerializer, TodoItemSerialize
 from django.db.models import Q
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.exceptions import ValidationError, PermissionDenied
-from .services import update_note_embedding, semantic_search
+from .services import SEARCH_MODES, search_notes
+from .embedding_queue import schedule_note_embedding
 import logging
 from django.shortcuts import get_object_or_404, render
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from accounts.models import Visitor, Subject, Level, CoursType, VisitorSubjectCourse, Teacher
 from django.http import JsonResponse
-from transformers import pipeline
+from django.utils.dateparse import parse_date
 
 logger = logging.getLogger(__name__)
 
@@ -160,7 +160,7 @@ class NoteViewSet(viewsets.ModelViewSet):
             else:
                 course = get_object_or_404(VisitorSubjectCourse, id=course_id, visitor__user=user)
         note = serializer.save(user=self.request.user, course=course)
-        update_note_embedding(note)
+        schedule_note_embedding(note)
 
     def create(self, request, *args, **kwargs):
         try:
@@ -171,23 +171,90 @@ class NoteViewSet(viewsets.ModelViewSet):
 
     def perform_update(self, serializer):
         note = serializer.save()
-        update_note_embedding(note)
+        schedule_note_embedding(note)
 
     @action(detail=False, methods=['GET'])
     def search(self, request):
         query = request.query_params.get('q', '')
         if len(query) < 4:
             return Response([])
-        results = semantic_search(query, request.user)
+        mode = request.query_params.get('mode', 'hybrid')
+        if mode not in SEARCH_MODES:
+            return Response(
+                {'error': f"mode doit valoir {', '.join(SEARCH_MODES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            k = min(max(int(request.query_params.get('k', 3)), 1), 20)
+        except ValueError:
+            return Response({'error': "k doit être un entier"}, status=status.HTTP_400_BAD_REQUEST)
+        # fields= : champs de full_note à renvoyer ; vide, full_note est omis
+        fields = request.query_params.get('fields')
+        if fields is not None:
+            fields = [name for name in fields.split(',') if name]
+            unknown = set(fields) - set(NoteSerializer.Meta.fields)
+            if unknown:
+                return Response(
+                    {'error': f"Champs inconnus : {', '.join(sorted(unknown))}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        try:
+            filters = self._search_filters(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = search_notes(query, request.user, mode=mode, k=k, **filters)
+        if fields == []:
+            return Response(results)
+
+        # Une requête pour les notes (dans l'ordre du classement) et une par
+        # relation imbriquée, quel que soit le nombre de résultats
+        notes = Note.objects.all()
+        if fields is None or 'attachments' in fields:
+            notes = notes.prefetch_related('attachments')
+        if fields is None or 'todo_items' in fields:
+            notes = notes.select_related('course').prefetch_related('course__todo_items')
+        notes = notes.in_bulk([result['id'] for result in results])
+
         serialized_results = []
-        for result in results[:3]:
-            note = Note.objects.get(id=result['id'])
-            serializer = self.get_serializer(note)
+        for result in results:
+            note = notes.get(result['id'])
+            if note is None:
+                continue
+            serializer = self.get_serializer(note, fields=fields)
             serialized_results.append({
                 **result,
                 'full_note': serializer.data
             })
-        return Response(serialized_results)      
+        return Response(serialized_results)
+
+    def _search_filters(self, request):
+        """
+        Filtres optionnels de la recherche : course (id d'un cours visible),
+        author (id d'utilisateur, enseignants), date_from / date_to (AAAA-MM-JJ).
+        """
+        user = request.user
+        filters = {}
+        course_id = request.query_params.get('course')
+        if course_id:
+            if hasattr(user, 'teacher'):
+                filters['course'] = get_object_or_404(VisitorSubjectCourse, id=course_id, teacher=user.teacher)
+            else:
+                filters['course'] = get_object_or_404(VisitorSubjectCourse, id=course_id, visitor__user=user)
+        author = request.query_params.get('author')
+        if author:
+            if not author.isdigit():
+                raise ValueError("author doit être un identifiant d'utilisateur")
+            filters['author'] = int(author)
+        for name in ('date_from', 'date_to'):
+            value = request.query_params.get(name)
+            if value:
+                day = parse_date(value)
+                if day is None:
+                    raise ValueError(f"{name} doit être une date AAAA-MM-JJ")
+                filters[name] = day
+        return filters
 
     @action(detail=True, methods=['GET'])
     def get_note(self, request, pk=None):
@@ -266,22 +333,21 @@ class AttachmentViewSet(viewsets.ModelViewSet):
                     raise ValidationError({"error": "Vous ne pouvez ajouter des attachements qu'à vos propres notes."})
             
             attachment = serializer.save(note_id=note_id, file_type=file_type)
-            update_note_embedding(attachment.note)
+            schedule_note_embedding(attachment.note)
             return attachment
         except Exception as e:
             raise ValidationError({"error": str(e)})
     
     def perform_update(self, serializer):
         attachment = serializer.save()
-        update_note_embedding(attachment.note)
+        schedule_note_embedding(attachment.note)
 
     def perform_destroy(self, instance):
         note = instance.note
         instance.delete()
-        update_note_embedding(note)
+        schedule_note_embedding(note)
 
 
-from openai import OpenAI
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -291,102 +357,276 @@ from django.shortcuts import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
 from .models import ChatSession, ChatMessage, Note
-from .services import semantic_search
+from .services import search_notes
+from .llm_client import LLMUnavailable, llm_client
+from .admission import AdmissionRejected, admit
+from .answer_cache import find_answer, prepare_lookup, store_answer
+from .chat_context import build_chat_context, update_summary
+from .chat_stream import read_stream, run_stream, start_stream, stream_owner
+from .sse import sse_frames
 from django.conf import settings
-from huggingface_hub import InferenceClient
-
-from dotenv import load_dotenv
+from django.views import View
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from asgiref.sync import sync_to_async
+import time
+import uuid
 
-load_dotenv()
 
-api_key = os.getenv('openai_API_KEY')
-hf_token = os.getenv('HF_TOKEN')
-
-# Initialiser le client OpenAI
-#client = OpenAI(api_key="")
+def visible_courses(user):
+    """
+    Cours de user : ceux qu'il enseigne, ou ceux auxquels il est inscrit.
+    """
+    if hasattr(user, 'teacher'):
+        return VisitorSubjectCourse.objects.filter(teacher=user.teacher)
+    return VisitorSubjectCourse.objects.filter(visitor__user=user)
 
 
 class ChatViewSet(viewsets.ViewSet):
+    """
+    Début et fin des sessions de chat. Les messages passent par
+    ChatStreamView (POST /api/chat/).
+    """
     permission_classes = [IsAuthenticated]
-    
+
     @action(detail=False, methods=['POST'])
-    def chat(self, request):
+    def start_session(self, request):
         """
-        Gère les requêtes de chat et retourne une réponse en streaming.
+        Démarre une nouvelle session de chat.
         """
-        query = request.data.get('message', '')
-        session_id = request.data.get('session_id')
+        course_id = request.data.get('course_id')
         user = request.user
+        course = get_object_or_404(visible_courses(user), id=course_id) if course_id else None
+
+        chat_session = ChatSession.objects.create(user=user, course=course)
         
-        chat_session = self._get_or_create_session(session_id, user)
-        self._save_user_message(chat_session, query)
-        
-        search_results = semantic_search(query, user)
-        context, related_note = self._process_search_results(search_results)
+        return Response({
+            "session_id": chat_session.id,
+            "message": "Session de chat démarrée avec succès"
+        })
+
+    @action(detail=False, methods=['POST'])
+    def end_session(self, request):
+        """
+        Termine une session de chat existante.
+        """
+        session_id = request.data.get('session_id')
         
-        return StreamingHttpResponse(
-            self._generate_ai_response_stream(chat_session, query, context, related_note),
-            content_type='text/event-stream'
-        )
+        try:
+            chat_session = ChatSession.objects.get(id=session_id, user=request.user)
+            chat_session.ended_at = timezone.now()
+            chat_session.save()
+            return Response({"message": "Session de chat terminée avec succès"})
+        except ChatSession.DoesNotExist:
+            return Response({"error": "Session de chat non trouvée"}, status=404)
+
+
+class ChatStreamView(View):
+    """
+    Chat en streaming (server-sent events), servi en asynchrone sous ASGI
+    (monFocus.asgi) : une génération en cours n'occupe pas un thread du
+    serveur mais une tâche de la boucle d'événements, et un processus peut
+    tenir des centaines de réponses en parallèle. Sous WSGI (runserver), la
+    génération tourne pendant la lecture de la réponse, qui n'est envoyée
+    qu'une fois complète.
+
+    La génération tourne en tâche de fond (chat_stream) et la réponse est
+    enregistrée au fil de l'eau : si la connexion tombe, le navigateur
+    reprend avec ChatStreamResumeView et l'en-tête Last-Event-ID, sans
+    relancer le modèle. L'identifiant du flux est renvoyé dans l'en-tête
+    X-Chat-Stream-Id.
+
+    Le nombre de générations simultanées est limité (admission) : au-delà,
+    la demande attend dans une file bornée, et reçoit un 429 avec l'en-tête
+    Retry-After si la file est pleine ou si l'utilisateur a déjà trop de
+    réponses en cours. Une question déjà traitée dans le cours peut être
+    servie par le cache des réponses (answer_cache, en-tête X-Answer-Cache).
+    """
+    http_method_names = ['post']
+
+    async def post(self, request):
+        """
+        Gère les requêtes de chat et retourne une réponse en streaming.
+        """
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({"detail": "Informations d'authentification non fournies."}, status=403)
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({"error": "Corps JSON invalide"}, status=400)
+
+        query = data.get('message', '')
+        chat_session = await self._get_or_create_session(data.get('session_id'), data.get('course_id'), user)
+        if chat_session is None:
+            return JsonResponse({"error": "Session de chat ou cours non trouvé"}, status=404)
+
+        user_message = await self._save_user_message(chat_session, query)
+
+        # Recherche (modèle d'embeddings, FAISS) et lectures ORM synchrones,
+        # exécutées hors de la boucle d'événements
+        context, related_note, lookup, cached = await off_thread(self._retrieve)(chat_session, user_message, query, user)
+
+        # Réponse déjà générée pour une question proche (answer_cache) : pas
+        # d'appel au modèle ni de place de génération
+        if cached is not None:
+            message = await ChatMessage.objects.acreate(
+                session=chat_session,
+                role='assistant',
+                content=cached.answer,
+                related_note=related_note,
+                stream_id=uuid.uuid4(),
+            )
+            response = sse_response(self._replay_cached_answer(message), message.stream_id)
+            response['X-Answer-Cache'] = 'hit'
+            return response
+
+        # Place de génération : attente dans la file, ou 429 tout de suite
+        try:
+            admission = await admit(user.id)
+        except AdmissionRejected as e:
+            await user_message.adelete()
+            response = JsonResponse({"error": "Trop de demandes en cours, réessayez plus tard", "reason": e.reason}, status=429)
+            response['Retry-After'] = str(e.retry_after)
+            return response
 
-    def _get_or_create_session(self, session_id, user):
+        try:
+            prompt = await off_thread(self._prepare_messages)(chat_session, query, context, user_message.id)
+            message = await ChatMessage.objects.acreate(
+                session=chat_session,
+                role='assistant',
+                content='',
+                related_note=related_note,
+                stream_id=uuid.uuid4(),
+                is_complete=False,
+            )
+            events = self._generate_ai_response_stream(message, prompt, lookup)
+
+            async def on_done():
+                # La place est rendue à la fin de la génération, pas de la
+                # requête ; le résumé de la session passe ensuite, avec sa
+                # propre place, dans la production : sous WSGI, une tâche
+                # lancée à part serait annulée à la fermeture de la boucle
+                await admission.release()
+                await update_summary(message.session_id, prompt.window_start_id)
+
+            if isinstance(request, ASGIRequest):
+                start_stream(message.stream_id, user.id, events, on_done=on_done)
+                stream = read_stream(message.stream_id)
+            else:
+                # WSGI : la boucle de la vue se ferme à son retour, la
+                # génération tourne dans celle qui lit la réponse
+                stream = run_stream(message.stream_id, user.id, events, on_done=on_done)
+        except BaseException:
+            await admission.release()
+            raise
+        response = sse_response(stream, message.stream_id)
+        response['X-Queue-Wait-Ms'] = str(round(admission.wait * 1000))
+        if lookup is not None:
+            response['X-Answer-Cache'] = 'miss'
+        return response
+
+    async def _get_or_create_session(self, session_id, course_id, user):
         """
-        Récupère une session existante ou en crée une nouvelle.
+        Récupère une session existante ou en crée une nouvelle, dans le cours
+        course_id s'il est donné ; None si la session demandée n'existe pas ou
+        appartient à un autre utilisateur, ou si le cours n'est pas celui de
+        l'utilisateur.
         """
         if session_id:
-            return get_object_or_404(ChatSession, id=session_id, user=user)
-        return ChatSession.objects.create(user=user)
-
-    def _save_user_message(self, chat_session, content):
+            return await off_thread(ChatSession.objects.filter(id=session_id, user=user).first)()
+        course = None
+        if course_id:
+            if not str(course_id).isdigit():
+                return None
+            course = await off_thread(lambda: visible_courses(user).filter(id=course_id).first())()
+            if course is None:
+                return None
+        return await ChatSession.objects.acreate(user=user, course=course)
+
+    async def _save_user_message(self, chat_session, content):
         """
         Enregistre le message de l'utilisateur dans la base de données.
         """
-        ChatMessage.objects.create(
+        return await ChatMessage.objects.acreate(
             session=chat_session,
             role='user',
             content=content
         )
 
+    async def _replay_cached_answer(self, message):
+        yield 1, {'content': message.content}
+        yield 2, {'type': 'source', 'source': message.related_note_id}
+        yield 3, {'type': 'end'}
+
+    def _retrieve(self, chat_session, user_message, query, user):
+        """
+        Notes en rapport avec la question, et réponse du cache des réponses
+        s'il en a une : (contexte, note liée, AnswerLookup, CachedAnswer).
+        """
+        search_results = search_notes(query, user)
+        context, related_note = self._process_search_results(search_results)
+        lookup = prepare_lookup(chat_session, user_message.id, query, search_results)
+        cached = find_answer(lookup) if lookup else None
+        return context, related_note, lookup, cached
+
     def _process_search_results(self, search_results):
         """
         Traite les résultats de la recherche sémantique.
         """
         if not search_results:
             return "", None
-        
-        context = " ".join([result['content_preview'] for result in search_results[:3]])
+
+        context = "\n\n".join(f"{result['title']} : {result['content_preview']}" for result in search_results[:3])
         related_note = Note.objects.get(id=search_results[0]['id'])
         return context, related_note
-    
-    def _generate_ai_response_stream(self, chat_session, query, context='', related_note=None):
+
+    async def _generate_ai_response_stream(self, message, prompt, lookup=None):
         """
-        Génère la réponse de l'IA en streaming en utilisant l'API Hugging Face.
+        Génère la réponse de l'IA avec le client partagé du modèle de langage
+        (llm_client) : générateur des événements du flux. La réponse est
+        enregistrée dans message toutes les CHAT_CHECKPOINT_INTERVAL
+        secondes, puis complète à la fin ou à l'abandon de la génération.
+        prompt est le ChatContext du message ; une fois complète, la réponse
+        est gardée dans le cache des réponses si lookup est fourni.
         """
-        messages = self._prepare_messages(chat_session, query, context)
-        
+        full_response = ""
+        started = time.monotonic()
+        checkpoint_interval = getattr(settings, 'CHAT_CHECKPOINT_INTERVAL', 2)
+        checkpoint_at = time.monotonic() + checkpoint_interval
         try:
-            # Initialisez le client Hugging Face
-            token = hf_token
-            client = InferenceClient(model="mistralai/Mixtral-8x7B-Instruct-v0.1", token=token)
-            
-            # Préparez l'entrée pour le modèle
-            input_text = self._format_input_for_mixtral(messages)
-            
-            # Générez la réponse en streaming
-            full_response = ""
-            for chunk in client.text_generation(input_text, max_new_tokens=300, temperature=0.7, stream=True):
+            input_text = self._format_input_for_mixtral(prompt.messages)
+            async for chunk in llm_client.stream(input_text, max_new_tokens=300, temperature=0.7):
                 full_response += chunk
-                yield f"data: {json.dumps({'content': chunk})}\n\n"
-            
-            self._save_ai_message(chat_session, full_response, related_note)
-            
-            yield f"data: {json.dumps({'type': 'source', 'source': related_note.id if related_note else None})}\n\n"
-            yield f"data: {json.dumps({'type': 'end'})}\n\n"
-        
+                yield {'content': chunk}
+                if time.monotonic() >= checkpoint_at:
+                    await self._save_ai_message(message, full_response, is_complete=False)
+                    checkpoint_at = time.monotonic() + checkpoint_interval
+
+            await self._save_ai_message(message, full_response)
+            if lookup is not None and full_response.strip():
+                try:
+                    await sync_to_async(store_answer)(lookup, full_response, time.monotonic() - started)
+                except Exception:
+                    logger.warning("Réponse non gardée dans le cache", exc_info=True)
+
+            yield {'type': 'source', 'source': message.related_note_id}
+            yield {'type': 'end'}
+
         except Exception as e:
-            print(f"Erreur lors de la génération de la réponse : {str(e)}")
-            yield f"data: {json.dumps({'content': 'Désolé, je n\'ai pas pu générer une réponse appropriée. Pouvez-vous reformuler votre question ?'})}\n\n"
-            yield f"data: {json.dumps({'type': 'end'})}\n\n"
+            if isinstance(e, LLMUnavailable):
+                logger.warning("Réponse non générée : %s", e)
+            else:
+                logger.exception("Erreur lors de la génération de la réponse")
+            await self._save_ai_message(message, full_response)
+            yield {'content': 'Désolé, je n\'ai pas pu générer une réponse appropriée. Pouvez-vous reformuler votre question ?'}
+            yield {'type': 'end'}
+
+        finally:
+            # Génération abandonnée (plus de lecteur, arrêt du serveur) : le
+            # début de la réponse est gardé
+            if not message.is_complete:
+                await self._save_ai_message(message, full_response)
 
     def _format_input_for_mixtral(self, messages):
         formatted_messages = []
@@ -399,121 +639,82 @@ class ChatViewSet(viewsets.ViewSet):
                 formatted_messages.append(msg['content'])
         return "\n".join(formatted_messages)
 
-    # def _generate_ai_response_stream(self, chat_session, query, context='', related_note=None):
-    #     """
-    #     Génère la réponse de l'IA en streaming.
-    #     """
-    #     messages = self._prepare_messages(chat_session, query, context)
-        
-    #     try:
-    #         stream = client.chat.completions.create(
-    #             model="gpt-3.5-turbo",
-    #             messages=messages,
-    #             max_tokens=150,
-    #             n=1,
-    #             stop=None,
-    #             temperature=0.7,
-    #             stream=True
-    #         )
-            
-    #         collected_messages = []
-    #         for chunk in stream:
-    #             if chunk.choices[0].delta.content is not None:
-    #                 content = chunk.choices[0].delta.content
-    #                 collected_messages.append(content)
-    #                 yield f"data: {json.dumps({'content': content})}\n\n"
-            
-    #         full_response = ''.join(collected_messages)
-    #         self._save_ai_message(chat_session, full_response, related_note)
-            
-    #         yield f"data: {json.dumps({'type': 'source', 'source': related_note.id if related_note else None})}\n\n"
-    #         yield f"data: {json.dumps({'type': 'end'})}\n\n"
-        
-    #     except Exception as e:
-    #         print(f"Erreur lors de la génération de la réponse : {str(e)}")
-    #         yield f"data: {json.dumps({'content': 'Désolé, je n\'ai pas pu générer une réponse appropriée. Pouvez-vous reformuler votre question ?'})}\n\n"
-    #         yield f"data: {json.dumps({'type': 'end'})}\n\n"
-
-    def _prepare_messages(self, chat_session, query, context):
-        """
-        Prépare les messages pour l'API OpenAI.
-        """
-        recent_messages = chat_session.messages.order_by('timestamp')[:5]
-        
-        messages = [
-                    {"role": "system", "content": """
-                        Tu es un tuteur en ligne. Ton rôle est d'aider les étudiants à apprendre en posant des questions et en les guidant, sans donner directement les réponses. Voici comment tu dois te comporter :
-
-                        1. **Poser des questions** :
-                        - Demande des questions pour faire réfléchir l'étudiant et l'aider à trouver les réponses par lui-même.
-                        - Adapte tes questions en fonction du niveau de l'étudiant.
-
-                        2. **Découper les problèmes** :
-                        - Décompose les problèmes en petites étapes compréhensibles.
-                        - Demande à l'étudiant de résoudre chaque étape une par une.
-
-                        3. **Encourager les efforts** :
-                        - Rappelle à l'étudiant que faire des erreurs est normal et fait partie de l'apprentissage.
-                        - Encourage l'étudiant à persévérer et félicite ses efforts.
-
-                        4. **Fournir des ressources** :
-                        - Propose des vidéos, articles, ou autres ressources pour aider l'étudiant à comprendre les sujets.
-                        - Utilise des sources fiables et éducatives.
-
-                        5. **Vérifier les réponses** :
-                        - Utilise des outils pour vérifier les calculs et t'assurer que tout est correct.
-                        - Si une erreur est détectée, demande à l'étudiant de réévaluer son travail et guide-le pour trouver l'erreur.
-
-                        6. **Ne jamais donner directement la réponse** :
-                        - Aide l'étudiant à réfléchir et à arriver à la solution par lui-même.
-                        - Si l'étudiant est bloqué, donne des indices ou pose des questions supplémentaires pour le débloquer.
-                    """},
-                    {"role": "system", "content": f"Contexte des notes pertinentes : {context}"}
-                    ]
-        
-        for msg in recent_messages:
-            messages.append({"role": msg.role, "content": msg.content})
-        
-        messages.append({"role": "user", "content": query})
-        return messages
-
-    def _save_ai_message(self, chat_session, content, related_note):
+    def _prepare_messages(self, chat_session, query, context, before_id):
         """
-        Enregistre la réponse de l'IA dans la base de données.
-        """
-        ChatMessage.objects.create(
-            session=chat_session,
-            role='assistant',
-            content=content,
-            related_note=related_note
-        )
-
-    @action(detail=False, methods=['POST'])
-    def start_session(self, request):
+        Prépare les messages pour le modèle de langage, dans le budget de
+        tokens du prompt (chat_context).
         """
-        Démarre une nouvelle session de chat.
-        """
-        course_id = request.data.get('course_id')
-        user = request.user
-        
-        chat_session = ChatSession.objects.create(user=user, course_id=course_id)
-        
-        return Response({
-            "session_id": chat_session.id,
-            "message": "Session de chat démarrée avec succès"
-        })
+        return build_chat_context(chat_session, query, context, before_id)
 
-    @action(detail=False, methods=['POST'])
-    def end_session(self, request):
+    async def _save_ai_message(self, message, content, is_complete=True):
         """
-        Termine une session de chat existante.
+        Enregistre la réponse de l'IA (partielle ou complète) dans la base de
+        données.
         """
-        session_id = request.data.get('session_id')
-        
+        message.content = content
+        message.is_complete = is_complete
+        await ChatMessage.objects.filter(pk=message.pk).aupdate(content=content, is_complete=is_complete)
+
+
+class ChatStreamResumeView(View):
+    """
+    Reprise d'une réponse du chat après une coupure : renvoie les événements
+    qui suivent l'en-tête Last-Event-ID, puis la suite de la génération.
+    Si le flux a expiré du cache, la réponse enregistrée est renvoyée d'un
+    bloc (événement 'replace').
+    """
+    http_method_names = ['get']
+
+    async def get(self, request, stream_id):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({"detail": "Informations d'authentification non fournies."}, status=403)
         try:
-            chat_session = ChatSession.objects.get(id=session_id, user=request.user)
-            chat_session.ended_at = timezone.now()
-            chat_session.save()
-            return Response({"message": "Session de chat terminée avec succès"})
-        except ChatSession.DoesNotExist:
-            return Response({"error": "Session de chat non trouvée"}, status=404)
\ No newline at end of file
+            after = int(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id') or 0)
+        except ValueError:
+            return JsonResponse({"error": "Last-Event-ID invalide"}, status=400)
+
+        owner = await stream_owner(stream_id)
+        if owner is not None:
+            if owner != user.id:
+                return JsonResponse({"error": "Flux introuvable"}, status=404)
+            return sse_response(read_stream(stream_id, after), stream_id)
+
+        message = await ChatMessage.objects.filter(stream_id=stream_id, session__user=user).afirst()
+        if message is None:
+            return JsonResponse({"error": "Flux introuvable"}, status=404)
+        return sse_response(self._replay(message), stream_id)
+
+    async def _replay(self, message):
+        yield None, {'type': 'replace', 'content': message.content}
+        yield None, {'type': 'source', 'source': message.related_note_id}
+        yield None, {'type': 'end'}
+
+
+def off_thread(func):
+    """
+    sync_to_async pour les appels en lecture seule ou de calcul (recherche,
+    embeddings, lectures ORM) : ils tournent dans le pool de threads, et les
+    conversations en cours ne s'attendent pas les unes les autres sur le
+    thread unique de thread_sensitive=True. La connexion à la base ouverte
+    par le thread est rendue après l'appel (CONN_MAX_AGE).
+    """
+    def call(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)
+
+
+def sse_response(events, stream_id):
+    """
+    Réponse server-sent events à partir de (numéro, événement), les
+    morceaux de texte rapprochés étant regroupés en une trame (voir sse).
+    """
+    response = StreamingHttpResponse(sse_frames(events), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Pas de mise en tampon par nginx : chaque morceau part tout de suite
+    response['X-Accel-Buffering'] = 'no'
+    response['X-Chat-Stream-Id'] = str(stream_id)
+    return response
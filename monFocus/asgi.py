@@ -3,6 +3,14 @@ ASGI config for monFocus project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Le chat en streaming (ChatStreamView) est asynchrone et doit être servi par
+un serveur ASGI (``uvicorn monFocus.asgi:application``) : les tokens
+partent au fil de la génération, une réponse en cours n'occupe pas de
+thread, et la génération continue en tâche de fond si la connexion tombe.
+Sous WSGI (runserver, gunicorn synchrone), la génération tourne pendant la
+lecture de la réponse, qui n'est envoyée au navigateur qu'une fois
+complète.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -14,3 +22,12 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "monFocus.settings")
 
 application = get_asgi_application()
+
+# Préchargement du modèle d'embeddings avant la première requête (production)
+from django.conf import settings
+
+if getattr(settings, "EMBEDDING_WARMUP", False):
+    from monEspace.services import warm_up
+
+    warm_up()
+
@@ -13,6 +13,11 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
+# Variables d'environnement du fichier .env (HF_TOKEN, REDIS_URL...)
+load_dotenv()
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,6 +48,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 ]
 
 MIDDLEWARE = [
@@ -91,6 +97,25 @@ DATABASES = {
     }
 }
 
+# Cache partagé par tous les processus (limite de générations par
+# utilisateur, reprise des réponses du chat, versions des index de
+# recherche) : Redis si REDIS_URL est défini, sinon une table de la base
+# (python manage.py createcachetable)
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'monfocus_cache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -160,3 +185,132 @@ REST_FRAMEWORK = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+
+# Recherche sémantique
+EMBEDDING_MODEL_NAME = 'all-mpnet-base-v2'
+# Moteur d'embeddings : 'sentence-transformers', 'onnx' (modèle exporté par
+# export_onnx_model, quantifié int8 pour les serveurs sans GPU) ou 'hash'
+# (déterministe et sans modèle : tests et benchmarks)
+EMBEDDING_BACKEND = 'sentence-transformers'
+EMBEDDING_ONNX_DIR = os.path.join(BASE_DIR, 'models', 'onnx')
+EMBEDDING_ONNX_QUANTIZED = True
+EMBEDDING_ONNX_THREADS = 0  # 0 : nombre de cœurs
+# Les recherches utilisent le modèle actif (table EmbeddingModel) ; changer
+# EMBEDDING_BACKEND ou EMBEDDING_MODEL_NAME puis lancer migrate_embeddings
+# start / run pour migrer sans interruption. Délai de relecture du modèle
+# actif par chaque processus après une bascule :
+EMBEDDING_MODEL_REFRESH = 5  # secondes
+# Regroupement des petits encodages concurrents d'un processus en un seul
+# appel au moteur : attente maximale pour compléter un lot, taille maximale
+EMBEDDING_MICRO_BATCHING = True
+EMBEDDING_BATCH_MAX_LATENCY_MS = 5
+EMBEDDING_BATCH_MAX_SIZE = 32
+# Stockage de NoteChunk.embedding : 'float32', 'float16' (2x plus compact) ou 'int8' (4x)
+EMBEDDING_STORAGE_DTYPE = 'float16'
+# 'pgvector' : top-k calculé dans PostgreSQL ; 'faiss' : index en mémoire par processus
+NOTE_SEARCH_BACKEND = 'pgvector'
+# Budget mémoire du cache LRU des index FAISS par utilisateur / cours
+NOTE_INDEX_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Découpage des notes en passages indexés séparément (en caractères)
+NOTE_CHUNK_SIZE = 1000
+NOTE_CHUNK_OVERLAP = 200
+# Index FAISS : 'flat' (exact), 'fp16' ou 'sq8' (quantifié, 2x / 4x moins de mémoire)
+NOTE_INDEX_TYPE = 'flat'
+# Taille (en passages) à partir de laquelle un shard est quantifié ; exact en dessous
+NOTE_INDEX_MIN_TRAIN = 1000
+# Cache des embeddings de requêtes (recherche à la frappe, chat)
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+QUERY_EMBEDDING_CACHE_TTL = 3600  # secondes
+QUERY_EMBEDDING_CACHE_ALIAS = None  # alias de CACHES à partager entre processus
+# Cache mémoire devant la table ContentEmbedding (empreinte du texte -> vecteur)
+CONTENT_EMBEDDING_CACHE_SIZE = 4096
+# Recherche hybride : candidats plein texte (index GIN) fusionnés par rang
+# réciproque avec les résultats vectoriels
+HYBRID_LEXICAL_CANDIDATES = 50
+# À partir de ce nombre de candidats plein texte, l'étape vectorielle ne
+# compare la requête qu'aux passages de ces notes
+HYBRID_PREFILTER_MIN = 20
+HYBRID_RRF_K = 60  # constante k de la fusion : score = somme des 1 / (k + rang)
+
+# File d'embeddings (commande embedding_worker)
+# Si False, les embeddings sont recalculés de manière synchrone à chaque sauvegarde
+EMBEDDING_ASYNC = True
+EMBEDDING_QUEUE_DEBOUNCE = 5  # secondes sans modification avant recalcul
+EMBEDDING_QUEUE_MAX_DELAY = 60  # délai maximal depuis la première modification
+
+# Serveur d'embeddings partagé (commande run_embedder). Si la socket n'existe
+# pas, chaque processus charge son propre modèle.
+EMBEDDING_SOCKET_PATH = os.path.join(BASE_DIR, 'run', 'embedder.sock')
+
+# Chargement du modèle d'embeddings au démarrage de wsgi/asgi plutôt qu'à la
+# première requête (avec gunicorn --preload, le modèle est partagé par fork)
+EMBEDDING_WARMUP = not DEBUG
+# Budget de temps d'import vérifié par la commande check_import_time
+IMPORT_TIME_BUDGET = 2.0  # secondes
+
+# Modèle de langage du chat (monEspace.llm_client), protocole de streaming de
+# text-generation-inference. En local : manage.py fake_llm_server et
+# LLM_BASE_URL = 'http://127.0.0.1:8081/models'
+LLM_BASE_URL = 'https://api-inference.huggingface.co/models'
+LLM_MODEL = 'mistralai/Mixtral-8x7B-Instruct-v0.1'
+LLM_API_TOKEN = None  # défaut : variable d'environnement HF_TOKEN
+LLM_CONNECT_TIMEOUT = 5  # secondes
+LLM_READ_TIMEOUT = 30  # secondes sans nouveau token
+LLM_MAX_CONNECTIONS = 100  # connexions gardées ouvertes par processus
+# Nouveaux essais avant le premier token, délai exponentiel avec aléa
+LLM_RETRIES = 2
+LLM_RETRY_BACKOFF = 0.2  # secondes
+# Disjoncteur : après LLM_BREAKER_THRESHOLD échecs consécutifs, les messages
+# échouent immédiatement pendant LLM_BREAKER_RESET secondes
+LLM_BREAKER_THRESHOLD = 5
+LLM_BREAKER_RESET = 30
+
+# Reprise des réponses du chat (monEspace.chat_stream)
+CHAT_STREAM_TTL = 600  # secondes de conservation des événements dans le cache
+CHAT_STREAM_FLUSH_INTERVAL = 0.5  # recopie des événements dans le cache
+CHAT_STREAM_POLL_INTERVAL = 0.25  # lecture du cache depuis un autre processus
+CHAT_STREAM_ORPHAN_TIMEOUT = 30  # génération abandonnée sans lecteur
+CHAT_CHECKPOINT_INTERVAL = 2  # enregistrement de la réponse partielle
+# Regroupement des morceaux de texte en trames SSE : fenêtre de temps (0 :
+# une trame par token) et taille maximale ; le premier morceau part seul
+CHAT_SSE_COALESCE_MS = 40
+CHAT_SSE_COALESCE_BYTES = 512
+CHAT_SSE_STATS_INTERVAL = 60  # secondes entre deux résumés journalisés (0 : jamais)
+
+# Admission des générations du chat (monEspace.admission). Les générations
+# simultanées sont comptées par processus ; au-delà, les demandes attendent
+# dans une file bornée puis reçoivent un 429 avec Retry-After.
+# Limite et file sont par processus : la charge maximale sur le modèle est
+# CHAT_MAX_CONCURRENT_GENERATIONS × nombre de workers (32 avec --workers 4) ;
+# à diviser par le nombre de workers quand on l'augmente
+CHAT_MAX_CONCURRENT_GENERATIONS = 8
+CHAT_ADMISSION_QUEUE = 16  # demandes en attente au plus, par processus
+CHAT_ADMISSION_TIMEOUT = 20  # secondes d'attente au plus dans la file
+CHAT_MAX_GENERATIONS_PER_USER = 2  # tous processus confondus (CACHES partagé)
+CHAT_ADMISSION_STATS_INTERVAL = 60  # secondes entre deux résumés journalisés (0 : jamais)
+
+# Prompt du chat (monEspace.chat_context) : budget fixe de tokens, rempli par
+# les derniers échanges du plus récent au plus ancien ; les plus anciens sont
+# résumés dans la session et rappelés par embedding s'ils sont pertinents
+CHAT_CONTEXT_TOKENS = 3000
+CHAT_NOTES_CONTEXT_TOKENS = 800  # extraits des notes
+CHAT_HISTORY_MAX_MESSAGES = 50  # messages lus au plus pour la fenêtre
+CHAT_TOKENIZER = None  # tokenizer transformers, sinon estimation
+CHAT_CHARS_PER_TOKEN = 3.5  # estimation sans tokenizer
+CHAT_RECALL_TOKENS = 400  # échanges antérieurs rappelés (0 : désactivé)
+CHAT_RECALL_TURNS = 3
+CHAT_RECALL_MIN_SIMILARITY = 0.5
+CHAT_RECALL_CANDIDATES = 200  # échanges antérieurs comparés au plus
+# Résumé : mis à jour quand les échanges sortis de la fenêtre dépassent
+# CHAT_SUMMARY_TRIGGER_TOKENS, par lots d'au plus CHAT_SUMMARY_INPUT_TOKENS
+CHAT_SUMMARY_TRIGGER_TOKENS = 600
+CHAT_SUMMARY_INPUT_TOKENS = 2000
+CHAT_SUMMARY_TOKENS = 250  # longueur maximale du résumé
+
+# Cache sémantique des réponses du chat (monEspace.answer_cache) : première
+# question d'une session, même cours et mêmes notes retrouvées
+CHAT_ANSWER_CACHE = False
+CHAT_ANSWER_CACHE_THRESHOLD = 0.92  # similarité cosinus minimale des questions
+CHAT_ANSWER_CACHE_TTL = 86400  # secondes
+CHAT_ANSWER_CACHE_CANDIDATES = 100  # réponses comparées au plus par question
+CHAT_ANSWER_CACHE_STATS_INTERVAL = 60  # secondes entre deux résumés journalisés (0 : jamais)
@@ -3,7 +3,7 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
-from monEspace.views import NoteViewSet, AttachmentViewSet, ChatViewSet, espacenote_view, TodoItemViewSet
+from monEspace.views import NoteViewSet, AttachmentViewSet, ChatViewSet, ChatStreamView, ChatStreamResumeView, espacenote_view, TodoItemViewSet
 
 router = DefaultRouter()
 router.register(r'notes', NoteViewSet, basename='note')
@@ -20,7 +20,8 @@ urlpatterns = [
     path('monespace/', include('monEspace.urls', namespace='monEspace')),
     path("api/", include(router.urls)),
     path("", espacenote_view, name="espacenote"),  # La vue espacenote est maintenant la page d'accueil
-    path('api/chat/', ChatViewSet.as_view({'post': 'chat'}), name='chat'),
+    path('api/chat/', ChatStreamView.as_view(), name='chat'),
+    path('api/chat/stream/<uuid:stream_id>/', ChatStreamResumeView.as_view(), name='chat-resume'),
 
 ]
 
@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "monFocus.settings")
 
 application = get_wsgi_application()
+
+# Préchargement du modèle d'embeddings avant la première requête (production)
+from django.conf import settings
+
+if getattr(settings, "EMBEDDING_WARMUP", False):
+    from monEspace.services import warm_up
+
+    warm_up()
+